@@ -9,9 +9,15 @@ import random
 import math
 import numpy as np
 import copy
+import functools
 
 import CGAComponents
 import CGAOperator
+import CGAStatistics
+import CGAIsland
+import CGADistribution
+import CGAKernels
+import CGAMemmap
 
 '''
 Canonical Genetic Algorithm (CGA)
@@ -64,6 +70,13 @@ def print_runtime_line(gen_num, most_fit_score, avg_fit_score, identical_percent
     print(screen_line)
 
 
+def print_statistics_line(statistics):
+    # <distinct genome fraction> <share of the most common genome> <fraction of loci every genome agrees on>
+    screen_line = '<distinct genome fraction: {:f}> <modal genome share: {:f}> <converged loci: {:f}>'.format(
+        statistics['distinct_fraction'], statistics['modal_share'], statistics['converged_loci'])
+    print(screen_line)
+
+
 def print_termination_line(best_fit_flag):
     if best_fit_flag:
         termination_reason = 'population has converaged'
@@ -81,64 +94,287 @@ def stopCondition(fitness_score_list):
     return False
 
 
-def run_max_one(bit_len, population_size, c_rate, mu_rate, qname):
-    '''run Canonical Genetic Algorithm'''
+def check_modes(packed=False, double_buffer=False, steady_state=0, incremental=False, jit=False, memmap_dir=None):
+    '''raise ValueError for modes run_max_one() can not run together
+    # memmap, packed, steady-state, incremental and jit each pick the population or the
+      generation loop, at most one of them can be asked for
+    # incremental, jit and memmap are double buffered anyway, steady-state replaces rows
+      in place and has no second buffer
+    '''
+    modes = [name for name, value in [('memmap', memmap_dir), ('packed', packed), ('steady-state', steady_state),
+                                      ('incremental', incremental), ('jit', jit)] if value]
+    if len(modes) > 1:
+        raise ValueError('{} can not run together'.format(' and '.join(modes)))
+    if steady_state and double_buffer:
+        raise ValueError('steady-state replaces rows in place, it can not run double buffered')
+
+
+def run_max_one(bit_len, population_size, c_rate, mu_rate, qname, matrix=False, packed=False, select_method='roulette', double_buffer=False, crossover_method='one_point', stats=False,
+                steady_state=0, replacement='worst', elite_num=1, incremental=False, jit=False, memmap_dir=None,
+                block_rows=CGAMemmap.BLOCK_ROWS):
+    '''run Canonical Genetic Algorithm
+    # matrix: keep the population in one (population_size, bit_len) uint8 matrix
+      instead of one Individual object per genome
+    # select_method: parent selection, one of CGAOperator.SELECTIONS
+    # double_buffer: run selection, crossover and mutation through two preallocated
+      genome buffers instead of building new populations, implies matrix
+    # crossover_method: one of CGAOperator.CROSSOVER_METHODS, all but one_point need
+      a matrix population
+    # packed: keep 64 genes per uint64 word, fitness becomes a popcount, use it
+      for genomes of 10^5 bits and more
+    # stats: also print the modal genome share and the per-locus convergence every
+      generation, implies matrix
+    # steady_state: children bred per step of a steady-state run, 0 runs generations;
+      they replace rows in place, a generation number then counts population_size
+      children, implies matrix
+    # replacement: rows the children replace, one of CGAOperator.REPLACEMENTS
+    # elite_num: genomes kept in the elite archive of a steady-state run
+    # incremental: double buffered pipeline that updates the fitness of every child by
+      the delta of the genes cross-over and mutation changed, implies double_buffer
+    # jit: run the double buffered generations through the fused numba kernel, the
+      NumPy pipeline is used when numba is not installed, implies double_buffer
+    # memmap_dir: keep the genomes in two .npy files under memmap_dir and stream every
+      generation through them block_rows genomes at a time, for populations that do not
+      fit in memory; the files are removed however the run ends
+    memmap_dir, packed, steady_state, incremental and jit exclude each other, see check_modes()
+    '''
+    check_modes(packed=packed, double_buffer=double_buffer, steady_state=steady_state, incremental=incremental, jit=jit,
+                memmap_dir=memmap_dir)
     print_header_line(qname, population_size, bit_len, mu_rate, c_rate)
 
-    # setup all objects
-    population = CGAComponents.Population(bit_len, population_size)
-    selection = CGAOperator.Roulette_Wheel_Selection(bit_len)
-    crossover = CGAOperator.Crossover(c_rate, bit_len)
+    # setup all objects, the population last, a memory mapped one creates its files
+    selection = CGAOperator.SELECTIONS[select_method](bit_len)
+    crossover = CGAOperator.Crossover(c_rate, bit_len, crossover_method)
     mutation = CGAOperator.Mutation(mu_rate)
-
-    # initialize population
-    population.initialize()
+    if memmap_dir:
+        population = CGAMemmap.PopulationMemmap(bit_len, population_size, memmap_dir, block_rows)
+    elif packed:
+        population = CGAComponents.PopulationPacked(bit_len, population_size)
+    elif matrix or double_buffer or stats or steady_state or incremental or jit:
+        population = CGAComponents.PopulationMatrix(bit_len, population_size)
+    else:
+        population = CGAComponents.Population(bit_len, population_size)
+
+    # the genome files of a memory mapped run go, however the run ends
+    try:
+        # initialize population
+        population.initialize()
+        pipeline = None
+        steady = None
+        if memmap_dir:
+            pipeline = CGAMemmap.Streaming_Pipeline(selection, crossover, mutation, population)
+        elif steady_state:
+            steady = CGAOperator.Steady_State_Pipeline(selection, crossover, mutation, population, steady_state, replacement,
+                                                       elite_num=elite_num)
+        elif incremental:
+            pipeline = CGAOperator.Delta_Pipeline(selection, crossover, mutation, population)
+        elif jit and CGAKernels.AVAILABLE:
+            pipeline = CGAOperator.Fused_Pipeline(selection, crossover, mutation, population)
+        elif double_buffer or jit:
+            if jit:
+                print('numba is not installed, running the NumPy pipeline')
+            pipeline = CGAOperator.Generation_Pipeline(selection, crossover, mutation, population)
+        # pipelines that keep the fitness of the population, instead of evaluating it again
+        cached = steady if steady is not None else (pipeline if incremental else None)
+
+        # solving process
+        best_fit_flag = False
+        n = 1
+        while 1:
+            # evaluate, steady-state and incremental runs only evaluated what changed
+            if cached is not None:
+                proportional_list, fitness_list = cached.fitness()
+            else:
+                proportional_list, fitness_list = population.fitness()
+            most_fit_score = np.max(fitness_list)
+            avg_fit_score = np.mean(fitness_list)
+            if memmap_dir:
+                # one pass over the files gives all the statistics
+                statistics = population.statistics()
+                identical_percentage = statistics['distinct_fraction']
+            else:
+                identical_percentage = population.compute_identical_percentage()
+            print_runtime_line(n, most_fit_score, avg_fit_score, identical_percentage)
+            if stats:
+                print_statistics_line(statistics if memmap_dir else CGAStatistics.summarize(population.genomes, bit_len))
+
+            # check stop condition
+            if stopCondition(fitness_list):
+                best_fit_flag = True
+                break
+
+            # ranked selections pick from the fitness scores, not from the wheel
+            selection_weights = fitness_list if selection.ranked else proportional_list
+
+            if steady is not None:
+                # population_size children, written over the replaced rows
+                population = steady.generation()
+            elif pipeline is not None:
+                # select, crossover and mutation into the back buffer, then swap
+                population = pipeline.step(selection_weights)
+            else:
+                # select
+                parents = selection.select(selection_weights, population)
+
+                # crossover
+                offspring = crossover.crossover(parents)
+
+                # mutation
+                population = mutation.mutation(offspring)
+
+            n = n + 1
+
+        # print termination line
+        print_termination_line(best_fit_flag)
+
+        if steady is not None:
+            # the archive also holds children replacement threw away
+            print('<evaluations: {}> <objective value of the elite: {:f}>'.format(steady.evaluations, steady.elite_pheno_val_list[0]))
+            # the archive is kept fittest first
+            return population.spawn(steady.elite_genomes[:1]).best([1.0])
+        if incremental:
+            print('<genes evaluated: {}> <genes a full evaluation reads: {}>'.format(pipeline.evaluated_genes, n * population_size * bit_len))
+
+        # return the best individual
+        return population.best(fitness_list)
+    finally:
+        if memmap_dir:
+            population.close()
+
+
+def run_max_one_distribution(bit_len, qname, model='cga', population_size=100, batch_size=20, learning_rate=0.1,
+                              negative_rate=0.075, generation_limit=100000):
+    '''run a compact GA or PBIL, memory is O(bit_len) instead of O(population_size * bit_len)
+    # model: one of CGADistribution.MODELS
+    # population_size: population the cga vector stands for, every step moves a locus
+      1/population_size
+    # batch_size, learning_rate, negative_rate: genomes sampled per step, and how far the
+      PBIL vector moves towards the best and away from the worst of them
+    # generation_limit: safety limit, one generation is one sampled batch
+    there is no mutation and no cross-over, the header reports both rates as 0
+    '''
+    if 'cga' == model:
+        distribution = CGADistribution.Compact_GA(bit_len, population_size)
+    else:
+        distribution = CGADistribution.PBIL(bit_len, batch_size, learning_rate, negative_rate)
+    print_header_line(qname, population_size if 'cga' == model else batch_size, bit_len, 0, 0)
 
     # solving process
     best_fit_flag = False
-    n = 1
-    while 1:
-        # evaluate
-        proportional_list, fitness_list = population.fitness()
-        most_fit_score = max(fitness_list)
-        avg_fit_score = sum(fitness_list) / len(fitness_list)
-        identical_percentage = population.compute_identical_percentage()
+    for n in range(1, generation_limit + 1):
+        # sample, evaluate and update
+        proportional_list, fitness_list = distribution.step()
+        most_fit_score = np.max(fitness_list)
+        avg_fit_score = np.mean(fitness_list)
+        identical_percentage = distribution.batch.compute_identical_percentage()
         print_runtime_line(n, most_fit_score, avg_fit_score, identical_percentage)
 
-        # check stop condition
-        if stopCondition(fitness_list):
+        # check stop condition, a fixed vector only samples the same genome again
+        if stopCondition(fitness_list) or distribution.converged():
             best_fit_flag = True
             break
 
-        # select
-        parents = selection.select(proportional_list, population)
+    # print termination line
+    print_termination_line(best_fit_flag)
 
-        # crossover
-        offspring = crossover.crossover(parents)
+    # return the best genome of the last batch
+    return distribution.batch.best(fitness_list)
 
-        # mutation
-        population = mutation.mutation(offspring)
 
-        n = n + 1
+def make_island(bit_len, population_size, c_rate, mu_rate, select_method='roulette', crossover_method='one_point'):
+    '''one island of the island model, built inside its worker process'''
+    population = CGAComponents.PopulationMatrix(bit_len, population_size)
+    selection = CGAOperator.SELECTIONS[select_method](bit_len)
+    crossover = CGAOperator.Crossover(c_rate, bit_len, crossover_method)
+    mutation = CGAOperator.Mutation(mu_rate)
+    return CGAIsland.Island(population, selection, crossover, mutation, stopCondition)
+
+
+def run_max_one_islands(bit_len, population_size, c_rate, mu_rate, qname, island_num, generation_limit=1000,
+                        migration_interval=10, migrant_num=2, topology='ring', select_method='roulette',
+                        crossover_method='one_point', seed=None):
+    '''run island_num Canonical Genetic Algorithms of population_size each in parallel
+    # migration_interval: generations between two migrations
+    # migrant_num: fittest genomes every island sends along the topology
+    # topology: one of CGAIsland.TOPOLOGIES
+    # generation_limit: safety limit of the whole run, the islands have no other one
+    '''
+    print_header_line(qname, population_size, bit_len, mu_rate, c_rate)
+    print('<islands: {}> <topology: {}> <migration interval: {}> <migrants: {}>'.format(island_num, topology, migration_interval, migrant_num))
+
+    island = functools.partial(make_island, bit_len, population_size, c_rate, mu_rate, select_method, crossover_method)
+    genomes, best_fit_flag = CGAIsland.run_islands(island, island_num, generation_limit, migration_interval, migrant_num, topology, seed,
+                                                   report=lambda n, *scores: print_runtime_line(n + 1, *scores))
 
     # print termination line
     print_termination_line(best_fit_flag)
 
-    # return the best individual
+    # return the best individual of all islands
+    population = CGAComponents.PopulationMatrix(bit_len, len(genomes))
+    population.setGenomes(genomes)
+    _, fitness_list = population.fitness()
     return population.best(fitness_list)
 
 
-def main():
+def main(opts):
     # setup parameters
-    bit_len = 32    # genome length
-    population_size = 100
+    bit_len = opts.bit_len    # genome length
+    population_size = opts.population_size
     c_rate = 0.5    # crossover rate
     mu_rate = 0.01   # mutation rate
 
-    run_max_one(bit_len, population_size, c_rate, mu_rate, 'max_one')
+    if opts.distribution:
+        run_max_one_distribution(opts.bit_len, 'max_one', opts.distribution, population_size, batch_size=opts.batch_size,
+                                 learning_rate=opts.learning_rate)
+        print('CGA run finished!')
+        return
+
+    if opts.islands:
+        run_max_one_islands(bit_len, population_size, c_rate, mu_rate, 'max_one', opts.islands, migration_interval=opts.migration_interval,
+                            migrant_num=opts.migrants, topology=opts.topology, select_method=opts.selection, crossover_method=opts.crossover)
+        print('CGA run finished!')
+        return
+
+    run_max_one(bit_len, population_size, c_rate, mu_rate, 'max_one', matrix=opts.matrix, packed=opts.packed, select_method=opts.selection, double_buffer=opts.double_buffer, crossover_method=opts.crossover, stats=opts.stats,
+                steady_state=opts.steady_state, replacement=opts.replacement, elite_num=opts.elite, incremental=opts.incremental,
+                jit=opts.jit, memmap_dir=opts.memmap, block_rows=opts.block_rows)
 
     print('CGA run finished!')
 
 
+def parserArgs(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--matrix', action='store_true', help='keep the population in one uint8 genome matrix')
+    parser.add_argument('-b', '--double-buffer', action='store_true', help='double buffered generation pipeline')
+    parser.add_argument('--stats', action='store_true', help='print genome statistics every generation')
+    parser.add_argument('-x', '--crossover', default='one_point', choices=CGAOperator.CROSSOVER_METHODS, help='cross-over mask')
+    parser.add_argument('-s', '--selection', default='roulette', choices=sorted(CGAOperator.SELECTIONS), help='parent selection')
+    parser.add_argument('-i', '--islands', type=int, default=0, help='number of islands evolved in parallel, 0 runs one population')
+    parser.add_argument('--migration-interval', type=int, default=10, help='generations between two migrations')
+    parser.add_argument('--migrants', type=int, default=2, help='genomes every island sends per migration')
+    parser.add_argument('--topology', default='ring', choices=sorted(CGAIsland.TOPOLOGIES), help='islands an island receives migrants from')
+    parser.add_argument('-p', '--packed', action='store_true', help='keep 64 genes per uint64 word')
+    parser.add_argument('-l', '--bit-len', type=int, default=32, help='genome length')
+    parser.add_argument('-e', '--distribution', choices=CGADistribution.MODELS, help='evolve a probability vector instead of a population')
+    parser.add_argument('--batch-size', type=int, default=20, help='genomes PBIL samples per generation')
+    parser.add_argument('--learning-rate', type=float, default=0.1, help='PBIL learning rate')
+    parser.add_argument('-d', '--incremental', action='store_true', help='update the fitness by the delta of the changed genes')
+    parser.add_argument('--jit', action='store_true', help='fused numba generation kernel, NumPy without numba')
+    parser.add_argument('-n', '--population-size', type=int, default=100, help='number of genomes')
+    parser.add_argument('--memmap', metavar='DIR', help='keep the genomes in files under DIR and stream the generations through them')
+    parser.add_argument('--block-rows', type=int, default=CGAMemmap.BLOCK_ROWS, help='genomes a memory mapped run holds in memory at a time')
+    parser.add_argument('--steady-state', type=int, default=0, help='children bred per steady-state step, 0 runs generations')
+    parser.add_argument('--replacement', default='worst', choices=CGAOperator.REPLACEMENTS, help='rows the steady-state children replace')
+    parser.add_argument('--elite', type=int, default=1, help='genomes kept in the steady-state elite archive')
+    opts = parser.parse_args()
+    try:
+        check_modes(packed=opts.packed, double_buffer=opts.double_buffer, steady_state=opts.steady_state,
+                    incremental=opts.incremental, jit=opts.jit, memmap_dir=opts.memmap)
+    except ValueError as error:
+        parser.error(str(error))
+    return opts
+
+
 if __name__ == "__main__":
-    main()
+    opts = parserArgs(sys.argv)
+    main(opts)
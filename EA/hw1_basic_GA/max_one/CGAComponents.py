@@ -11,6 +11,8 @@ import numpy as np
 import numpy.random as np_rand
 import copy
 
+import CGAStatistics
+
 
 '''
 Canonical Genetic Algorithm (CGA)
@@ -47,12 +49,46 @@ Max One Problem:
 
 
 def get_probability_list(fitness_list):
-    total_fit = float(sum(fitness_list))
-    relative_fitness = [f/total_fit for f in fitness_list]
-    proportional_list = [sum(relative_fitness[:i+1]) for i in range(len(relative_fitness))]
+    '''cumulative selection probability of each slot of the wheel'''
+    fitness_list = np.asarray(fitness_list, dtype=np.float64)
+    relative_fitness = fitness_list / fitness_list.sum()
+    proportional_list = np.cumsum(relative_fitness)
     return proportional_list
 
 
+# packed genomes keep 64 genes per uint64 word, gene j lives in bit (j % 64) of word (j // 64)
+WORD_BITS = 64
+_BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def packed_word_len(bit_len):
+    return (bit_len + WORD_BITS - 1) // WORD_BITS
+
+
+def pack_genomes(bits):
+    '''pack a (N, bit_len) 0/1 matrix into (N, ceil(bit_len/64)) uint64 words'''
+    bits = np.asarray(bits, dtype=np.uint8)
+    word_len = packed_word_len(bits.shape[1])
+    packed = np.packbits(bits, axis=1, bitorder='little')
+    padded = np.zeros((bits.shape[0], word_len * 8), dtype=np.uint8)
+    padded[:, :packed.shape[1]] = packed
+    return padded.view('<u8').astype(np.uint64)
+
+
+def unpack_genomes(words, bit_len):
+    '''inverse of pack_genomes, returns a (N, bit_len) uint8 matrix'''
+    words = np.ascontiguousarray(np.atleast_2d(words), dtype='<u8')
+    return np.unpackbits(words.view(np.uint8), axis=1, bitorder='little')[:, :bit_len]
+
+
+def popcount(words):
+    '''number of set bits in each row of a uint64 word matrix'''
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+    as_bytes = np.ascontiguousarray(words, dtype='<u8').view(np.uint8)
+    return _BYTE_POPCOUNT[as_bytes].sum(axis=-1, dtype=np.int64)
+
+
 class Individual():
     def __init__(self, bit_len, doInitialize=True):
         # set representation format
@@ -66,6 +102,13 @@ class Individual():
         self.evaluation = None
         self.fitness = None
 
+    @classmethod
+    def from_row(cls, row):
+        '''wrap one row of a population matrix as an individual, without copying it'''
+        individual = cls(len(row), doInitialize=False)
+        individual.value = row
+        return individual
+
 
 class Population():
     '''collection of individuals'''
@@ -111,21 +154,8 @@ class Population():
 
     def compute_identical_percentage(self):
         '''compute identical individual percentage'''
-        def notInPool(indv_val, identical_pool):
-            if not identical_pool:
-                return True
-            for item in identical_pool:
-                if (indv_val == item).all():
-                    return False
-            return True
-
-        identical_pool = []
-        for individual in self.individuals:
-            indv_val = individual.value
-            if notInPool(indv_val, identical_pool):
-                identical_pool.append(indv_val)
-
-        identical_percentage = len(identical_pool) / self.population_size
+        genomes = np.array([individual.value for individual in self.individuals], dtype=np.uint8)
+        identical_percentage = CGAStatistics.distinct_fraction(genomes)
         return identical_percentage
 
     def best(self, fit_list):
@@ -133,3 +163,188 @@ class Population():
         index = fit_list.index(max(fit_list))
         bestOne = self.individuals[index]
         print('best one has value: ', bestOne.value)
+
+
+class PopulationMatrix():
+    '''collection of individuals backed by one contiguous (population_size, bit_len) uint8 matrix,
+    each row of the matrix is the genome of one individual'''
+    def __init__(self, bit_len, size=10):
+        self.bit_len = bit_len
+        self.population_size = size
+
+        self.genomes = np.zeros((size, bit_len), dtype=np.uint8)
+        self.IndvClass = Individual
+
+    @property
+    def individuals(self):
+        '''row views of the genome matrix, only built when someone asks for them'''
+        return [self.IndvClass.from_row(row) for row in self.genomes]
+
+    def setGenomes(self, genomes):
+        '''set genome matrix for the next generation'''
+        self.genomes = np.ascontiguousarray(genomes, dtype=np.uint8)
+        self.population_size = self.genomes.shape[0]
+
+    def spawn(self, genomes):
+        '''new population with the same encoding, holding the given genome matrix'''
+        next_generation = PopulationMatrix(self.bit_len, len(genomes))
+        next_generation.setGenomes(genomes)
+        return next_generation
+
+    def initialize(self):
+        '''initialization random individuals for start point'''
+        self.genomes = (np.random.rand(self.population_size, self.bit_len) > 0.5).astype(np.uint8)
+
+    # Max-One is additively separable: evaluate() is total_value() of the sum of the
+    # locus_values() of every gene, so a changed gene changes it by a known delta
+    separable = True
+
+    def locus_values(self, genes, cols):
+        '''contribution of genes at loci cols to the total, a one counts one'''
+        return genes.astype(np.int64)
+
+    def total_value(self, totals):
+        '''evaluate() value of rows whose locus_values() add up to totals'''
+        return totals / self.bit_len
+
+    def delta(self, cols, old_genes, new_genes):
+        '''change of the total when the genes at loci cols change from old to new'''
+        return self.locus_values(new_genes, cols) - self.locus_values(old_genes, cols)
+
+    def evaluate(self, genomes):
+        '''Max-One value of every row of a genome matrix, the share of ones'''
+        return self.total_value(genomes.sum(axis=1))
+
+    def normalize(self, pheno_val_list):
+        '''fitness of the evaluate() values of a population, the share of ones already is one'''
+        return pheno_val_list
+
+    def elite_order(self, pheno_val_list):
+        '''indices of some evaluate() values from the fittest to the least fit, the most ones first'''
+        return np.argsort(-pheno_val_list, kind='stable')
+
+    def fitness(self):
+        '''calculate fitness score for every row at once'''
+        if 0 == self.genomes.size:
+            raise ValueError('individuals has not been set')
+
+        fit_list = self.normalize(self.evaluate(self.genomes))
+        proportional_list = get_probability_list(fit_list)
+        return proportional_list, fit_list
+
+    def compute_identical_percentage(self):
+        '''compute identical individual percentage'''
+        identical_percentage = CGAStatistics.distinct_fraction(self.genomes)
+        return identical_percentage
+
+    def best(self, fit_list):
+        '''return the most fit object'''
+        index = int(np.argmax(fit_list))
+        bestOne = self.IndvClass.from_row(self.genomes[index])
+        print('best one has value: ', bestOne.value)
+
+
+class PopulationPacked():
+    '''collection of individuals with bit-packed genomes, for very long Max-One runs
+    the genome matrix is (population_size, ceil(bit_len/64)) uint64 words, the padding
+    bits of the last word are always kept at zero'''
+    def __init__(self, bit_len, size=10):
+        self.bit_len = bit_len
+        self.population_size = size
+        self.word_len = packed_word_len(bit_len)
+
+        self.genomes = np.zeros((size, self.word_len), dtype=np.uint64)
+        self.IndvClass = Individual
+
+    @property
+    def tail_mask(self):
+        '''mask of the valid bits in the last word'''
+        tail_bits = self.bit_len - (self.word_len - 1) * WORD_BITS
+        return np.uint64((1 << tail_bits) - 1)
+
+    @property
+    def individuals(self):
+        '''unpacked individuals, only built when someone asks for them'''
+        return [self.IndvClass.from_row(row) for row in unpack_genomes(self.genomes, self.bit_len)]
+
+    def setGenomes(self, genomes):
+        '''set packed genome matrix for the next generation'''
+        self.genomes = np.ascontiguousarray(genomes, dtype=np.uint64)
+        self.population_size = self.genomes.shape[0]
+
+    def spawn(self, genomes):
+        '''new population with the same encoding, holding the given packed genome matrix'''
+        next_generation = PopulationPacked(self.bit_len, len(genomes))
+        next_generation.setGenomes(genomes)
+        return next_generation
+
+    def initialize(self):
+        '''initialization random individuals for start point, 64 random genes at a time'''
+        self.genomes = np.random.randint(0, 2**64, size=(self.population_size, self.word_len), dtype=np.uint64)
+        self.genomes[:, -1] &= self.tail_mask
+
+    def evaluate(self, words):
+        '''Max-One value of every row of a packed genome matrix'''
+        return popcount(words) / self.bit_len
+
+    def normalize(self, pheno_val_list):
+        return pheno_val_list
+
+    def elite_order(self, pheno_val_list):
+        '''indices of some evaluate() values from the fittest to the least fit, the most ones first'''
+        return np.argsort(-pheno_val_list, kind='stable')
+
+    def fitness(self):
+        '''Max-One fitness is the popcount of each row over the genome length'''
+        if 0 == self.genomes.size:
+            raise ValueError('individuals has not been set')
+
+        fit_list = self.normalize(self.evaluate(self.genomes))
+        proportional_list = get_probability_list(fit_list)
+        return proportional_list, fit_list
+
+    def compute_identical_percentage(self):
+        '''compute identical individual percentage'''
+        identical_percentage = CGAStatistics.distinct_fraction(self.genomes)
+        return identical_percentage
+
+    def best(self, fit_list):
+        '''return the most fit object'''
+        index = int(np.argmax(fit_list))
+        bestOne = self.IndvClass.from_row(unpack_genomes(self.genomes[index], self.bit_len)[0])
+        print('best one has value: ', bestOne.value)
+
+
+def test():
+    print('now doing the test function')
+    # the matrix population has to score the same genomes the same way as the object one
+    genomes = (np.random.rand(20, 33) > 0.5).astype(np.uint8)
+    genomes[1] = genomes[0]
+    population = Population(33, 20)
+    population.setIndividuals([Individual.from_row(row.copy()) for row in genomes])
+    matrix_population = PopulationMatrix(33, 20)
+    matrix_population.setGenomes(genomes)
+
+    proportional_list, fit_list = population.fitness()
+    matrix_proportional_list, matrix_fit_list = matrix_population.fitness()
+    assert np.allclose(fit_list, matrix_fit_list)
+    assert np.allclose(proportional_list, matrix_proportional_list)
+    assert population.compute_identical_percentage() == matrix_population.compute_identical_percentage()
+    print('matrix population fitness matches the object population')
+
+    # packed genomes have to round trip and count the same ones, also across word boundaries
+    for bit_len in [1, 63, 64, 65, 130]:
+        genomes = (np.random.rand(9, bit_len) > 0.5).astype(np.uint8)
+        packed_population = PopulationPacked(bit_len, 9)
+        packed_population.setGenomes(pack_genomes(genomes))
+        matrix_population = PopulationMatrix(bit_len, 9)
+        matrix_population.setGenomes(genomes)
+        assert (unpack_genomes(packed_population.genomes, bit_len) == genomes).all()
+        assert np.allclose(packed_population.fitness()[0], matrix_population.fitness()[0])
+        assert np.allclose(packed_population.fitness()[1], matrix_population.fitness()[1])
+
+    print('packed population matches the matrix population')
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import argparse
+import pdb
+
+import numpy as np
+
+import CGAComponents
+
+'''
+Estimation of distribution modes for Max-One with very long genomes.
+
+The canonical GA keeps N genomes of L genes, so memory grows as O(N * L) and genomes of
+10^7 bits are out of reach. An estimation of distribution algorithm keeps one float32
+probability vector of length L instead, the probability of a one at every locus. Every
+step samples a small batch of genomes from it, evaluates them, and moves the vector
+towards the winners:
+    # Compact GA (cGA): two genomes compete, every locus where they differ moves 1/n
+      towards the winner, which behaves like a GA with a population of n
+    # PBIL: batch_size genomes, the vector moves learning_rate of the way towards the
+      best of them, and negative_rate away from the worst where the two differ
+
+The batch lives in one preallocated PopulationMatrix, so the evaluation, the identical
+percentage and best() are the canonical ones. Sampling and updates go over the loci in
+chunks of CHUNK_SIZE, the temporaries stay O(CHUNK_SIZE) and the whole mode O(L).
+'''
+
+MODELS = ['cga', 'pbil']
+# loci sampled or updated at a time
+CHUNK_SIZE = 1 << 20
+
+
+def chunks(bit_len, chunk_size=CHUNK_SIZE):
+    for start in range(0, bit_len, chunk_size):
+        yield slice(start, min(bit_len, start + chunk_size))
+
+
+class Distribution_Model():
+    '''
+    # probability vector of bit_len float32 entries, all 0.5 at the start
+    # batch: PopulationMatrix of the batch_size genomes sampled every step
+    # a model moves the vector with its update(fitness_list), see Compact_GA and PBIL
+    '''
+    def __init__(self, bit_len, batch_size):
+        self.bit_len = bit_len
+        self.probability = np.full(bit_len, 0.5, dtype=np.float32)
+        self.batch = CGAComponents.PopulationMatrix(bit_len, batch_size)
+
+    def sample(self):
+        '''draw the batch from the probability vector, in place'''
+        genomes = self.batch.genomes
+        for loci in chunks(self.bit_len):
+            draws = np.random.rand(len(genomes), loci.stop - loci.start)
+            np.less(draws, self.probability[loci], out=genomes[:, loci], casting='unsafe')
+        return self.batch
+
+    def converged(self):
+        '''every locus is fixed at 0 or 1, sampling can not find anything new'''
+        return bool(((self.probability == 0) | (self.probability == 1)).all())
+
+    def step(self):
+        '''sample a batch, evaluate it and update the vector
+        return (proportional_list, fitness_list) of the batch, before the update'''
+        batch = self.sample()
+        proportional_list, fitness_list = batch.fitness()
+        self.update(np.asarray(fitness_list))
+        return proportional_list, fitness_list
+
+
+class Compact_GA(Distribution_Model):
+    '''
+    # virtual_size: population size n the vector stands for, a step moves a locus 1/n
+    # float32 sums of 1/n do not land on 0 or 1 exactly, a locus within half a step of
+      either is set to it, or converged() would never see the vector fixed
+    '''
+    def __init__(self, bit_len, virtual_size):
+        super().__init__(bit_len, 2)
+        self.virtual_size = virtual_size
+        self.shift = np.float32(1.0 / virtual_size)
+        self.snap = self.shift / 2
+
+    def update(self, fitness_list):
+        winner, loser = self.batch.genomes[np.argsort(-fitness_list, kind='stable')]
+        for loci in chunks(self.bit_len):
+            # +1 where only the winner has a one, -1 where only the loser has
+            difference = winner[loci].astype(np.float32) - loser[loci]
+            probability = self.probability[loci]
+            probability += difference * self.shift
+            probability[probability < self.snap] = 0
+            probability[probability > 1 - self.snap] = 1
+
+
+class PBIL(Distribution_Model):
+    '''
+    # learning_rate: share of the way towards the best genome of the batch
+    # negative_rate: extra share away from the worst genome, where it differs from the best
+    '''
+    def __init__(self, bit_len, batch_size, learning_rate=0.1, negative_rate=0.075):
+        super().__init__(bit_len, batch_size)
+        self.learning_rate = np.float32(learning_rate)
+        self.negative_rate = np.float32(negative_rate)
+
+    def update(self, fitness_list):
+        best = self.batch.genomes[int(np.argmax(fitness_list))]
+        worst = self.batch.genomes[int(np.argmin(fitness_list))]
+        for loci in chunks(self.bit_len):
+            target = best[loci].astype(np.float32)
+            probability = self.probability[loci]
+            probability *= 1 - self.learning_rate
+            probability += self.learning_rate * target
+            if self.negative_rate:
+                differ = best[loci] != worst[loci]
+                probability[differ] *= 1 - self.negative_rate
+                probability[differ] += self.negative_rate * target[differ]
+
+
+def test():
+    print('now doing the test function')
+    # samples follow the vector
+    model = PBIL(1000, 200)
+    model.probability[:500] = 0.2
+    batch = model.sample()
+    assert abs(batch.genomes[:, :500].mean() - 0.2) < 0.02 and abs(batch.genomes[:, 500:].mean() - 0.5) < 0.02
+    model.probability[:] = 1
+    assert model.sample().genomes.all() and model.converged()
+
+    # the cga moves loci only where the two genomes differ, towards the winner
+    model = Compact_GA(8, 4)
+    model.batch.setGenomes(np.array([[1, 1, 0, 0, 1, 1, 1, 1], [1, 0, 1, 0, 0, 0, 0, 0]], dtype=np.uint8))
+    model.update(np.array([0.75, 0.25]))
+    assert np.allclose(model.probability, [0.5, 0.75, 0.25, 0.5, 0.75, 0.75, 0.75, 0.75])
+
+    # five steps of 1/10 fix a locus at 0 and 1 exactly, even where the float32 sums miss
+    # them, a vector fixed away from the optimum is converged and the run stops there
+    model = Compact_GA(2, 10)
+    model.batch.setGenomes(np.array([[0, 1], [1, 0]], dtype=np.uint8))
+    for _ in range(5):
+        model.update(np.array([0.75, 0.25]))
+    assert model.probability.tolist() == [0, 1] and model.converged()
+    _, fitness_list = model.step()
+    assert max(fitness_list) == 0.5 and model.converged()
+
+    # both models solve a small Max-One with the batch as the only genome matrix
+    np.random.seed(1)
+    for model in [Compact_GA(64, 50), PBIL(64, 20)]:
+        for n in range(5000):
+            _, fitness_list = model.step()
+            if max(fitness_list) == 1:
+                break
+        assert max(fitness_list) == 1 and model.batch.genomes.nbytes <= 20 * 64
+        assert model.probability.dtype == np.float32
+    print('cga and pbil solve max one from a probability vector')
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,187 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import argparse
+import pdb
+
+import random
+import queue
+import multiprocessing
+import numpy as np
+
+import CGAComponents
+import CGAOperator
+
+'''
+Island model for the Canonical Genetic Algorithm.
+
+K sub-populations evolve in a multiprocessing pool, one island per worker process. Every
+migration_interval generations each island sends a copy of its migrant_num fittest genomes
+to the parent process and waits. The parent routes the migrants along the topology, and
+each island replaces its worst genomes with the ones it receives. The parent also merges
+the per-generation statistics of all islands into one report and decides when to stop:
+the whole archipelago stops after the epoch in which any island met the stop condition or
+the generation limit was reached.
+
+Topologies (the islands an island receives migrants from):
+    # ring: island i receives from island i - 1
+    # full: island i receives from every other island
+'''
+
+
+def ring_sources(island_id, island_num):
+    if island_num < 2:
+        return []
+    return [(island_id - 1) % island_num]
+
+
+def full_sources(island_id, island_num):
+    return [i for i in range(island_num) if i != island_id]
+
+
+TOPOLOGIES = {'ring': ring_sources, 'full': full_sources}
+
+
+class Island():
+    '''one sub-population, evolved through the double buffered generation pipeline'''
+    def __init__(self, population, selection, crossover, mutation, stop_condition):
+        population.initialize()
+        self.population = population
+        self.pipeline = CGAOperator.Generation_Pipeline(selection, crossover, mutation, population)
+        self.stop_condition = stop_condition
+
+    def evolve(self, generation_num):
+        '''run up to generation_num generations, one (most fit, average, identical) row each,
+        and whether the stop condition was met'''
+        rows = []
+        for n in range(generation_num):
+            proportional_list, fitness_list = self.population.fitness()
+            rows.append((np.max(fitness_list), np.mean(fitness_list), self.population.compute_identical_percentage()))
+            if self.stop_condition(fitness_list):
+                return rows, True
+            selection_weights = fitness_list if self.pipeline.selection.ranked else proportional_list
+            self.population = self.pipeline.step(selection_weights)
+        return rows, False
+
+    def emigrants(self, migrant_num):
+        '''copies of the migrant_num fittest genomes'''
+        _, fitness_list = self.population.fitness()
+        order = np.argsort(fitness_list, kind='stable')[::-1][:migrant_num]
+        return self.population.genomes[order].copy()
+
+    def immigrate(self, genomes):
+        '''overwrite the worst genomes with the arriving ones'''
+        genomes = genomes[:self.population.population_size]
+        if 0 == len(genomes):
+            return
+        _, fitness_list = self.population.fitness()
+        worst = np.argsort(fitness_list, kind='stable')[:len(genomes)]
+        self.population.genomes[worst] = genomes
+
+
+def island_worker(make_island, island_id, seed_seq, generation_limit, migration_interval, migrant_num, inbox, outbox):
+    '''evolve one island epoch by epoch until the parent says stop, return its final genomes'''
+    state = seed_seq.generate_state(2)
+    np.random.seed(state[0])
+    random.seed(int(state[1]))
+    island = make_island()
+
+    generation = 0
+    while True:
+        rows, best_fit_flag = island.evolve(min(migration_interval, generation_limit - generation))
+        generation = generation + len(rows)
+        done = best_fit_flag or generation >= generation_limit
+        outbox.put((island_id, rows, island.emigrants(migrant_num), done))
+
+        immigrants, stop = inbox.get()
+        if stop:
+            return island.population.genomes, best_fit_flag
+        island.immigrate(immigrants)
+
+
+def collect(outbox, results, island_num):
+    '''one message from every island, re-raising the error of a crashed worker'''
+    messages = {}
+    while len(messages) < island_num:
+        try:
+            island_id, rows, emigrants, done = outbox.get(timeout=1)
+            messages[island_id] = (rows, emigrants, done)
+        except queue.Empty:
+            for result in results:
+                if result.ready() and not result.successful():
+                    result.get()
+    return messages
+
+
+def run_islands(make_island, island_num, generation_limit, migration_interval, migrant_num, topology='ring', seed=None, report=None):
+    '''
+    # make_island: picklable callable building one Island, called inside every worker
+    # report: called with (generation number, most fit, average fitness, identical percentage)
+      of the merged archipelago after every epoch
+    return the final genomes of all islands stacked, and whether an island met the stop condition
+    '''
+    sources = TOPOLOGIES[topology]
+    seed_seqs = np.random.SeedSequence(seed).spawn(island_num)
+
+    # every island blocks on its inbox between epochs, so each one needs its own worker
+    with multiprocessing.Manager() as manager, multiprocessing.Pool(island_num) as pool:
+        inboxes = [manager.Queue() for i in range(island_num)]
+        outbox = manager.Queue()
+        results = [pool.apply_async(island_worker, (make_island, i, seed_seqs[i], generation_limit, migration_interval, migrant_num, inboxes[i], outbox))
+                   for i in range(island_num)]
+
+        generation = 0
+        while True:
+            messages = collect(outbox, results, island_num)
+
+            # merge the epoch, the report ends with the first generation an island stopped at
+            stopped = [len(messages[i][0]) for i in messages if messages[i][2]]
+            epoch_len = min(stopped) if stopped else max(len(messages[i][0]) for i in messages)
+            for n in range(epoch_len):
+                rows = [messages[i][0][n] for i in messages if n < len(messages[i][0])]
+                most_fit_score = max(row[0] for row in rows)
+                avg_fit_score = np.mean([row[1] for row in rows])
+                identical_percentage = np.mean([row[2] for row in rows])
+                if report is not None:
+                    report(generation + n, most_fit_score, avg_fit_score, identical_percentage)
+            generation = generation + epoch_len
+
+            stop = any(messages[i][2] for i in messages)
+            for i in range(island_num):
+                immigrants = [messages[j][1] for j in sources(i, island_num)]
+                immigrants = np.concatenate(immigrants) if immigrants else messages[i][1][:0]
+                inboxes[i].put((immigrants, stop))
+            if stop:
+                break
+
+        finished = [result.get() for result in results]
+
+    genomes = np.concatenate([item[0] for item in finished])
+    best_fit_flag = any(item[1] for item in finished)
+    return genomes, best_fit_flag
+
+
+def test():
+    print('now doing the test function')
+    assert ring_sources(0, 4) == [3] and ring_sources(2, 4) == [1] and ring_sources(0, 1) == []
+    assert full_sources(1, 3) == [0, 2]
+
+    # migrants replace the worst genomes, the stop condition ends the evolve loop early
+    population = CGAComponents.PopulationMatrix(8, 6)
+    island = Island(population, CGAOperator.Roulette_Wheel_Selection(8), CGAOperator.Crossover(0.5, 8), CGAOperator.Mutation(0.0), lambda fitness_list: False)
+    island.population.genomes[:] = 0
+    island.population.genomes[0] = 1
+    assert (island.emigrants(1) == 1).all()
+    island.immigrate(np.ones((2, 8), dtype=np.uint8))
+    assert island.population.genomes.sum() == 3 * 8
+    rows, done = island.evolve(3)
+    assert len(rows) == 3 and not done
+    island.stop_condition = lambda fitness_list: True
+    rows, done = island.evolve(3)
+    assert len(rows) == 1 and done
+    print('island migration matches the expected replacement')
+
+
+if __name__ == "__main__":
+    test()
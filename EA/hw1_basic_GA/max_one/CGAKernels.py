@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import argparse
+import pdb
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+'''
+Fused generation kernel, compiled with numba when it is installed.
+
+Generation_Pipeline makes one NumPy call after the other: the wheel search, the gather of
+the parents, the masks, two np.where and the flips, each with its own temporaries. For
+small genomes the time goes into the calls, not into the work. fused_generation() does
+all of it in one pass that writes every child row once: it finds the parents on the
+wheel, copies or swaps every gene by the segment or mask of its pair and xors the
+flipped genes of the row.
+
+The kernel draws no random numbers. The caller draws them with numpy.random in exactly
+the order the NumPy operators draw them and hands them in, so a fixed seed gives the
+same population with and without numba.
+
+Without numba AVAILABLE is False and the functions stay plain Python, which is far too
+slow for a run; the callers use the NumPy pipeline then.
+'''
+
+AVAILABLE = numba is not None
+
+
+def jit(function):
+    '''compile function with numba, or leave it as it is without numba'''
+    if numba is None:
+        return function
+    return numba.njit(cache=True, nogil=True)(function)
+
+
+@jit
+def fused_generation(front, back, wheel, spins, parent_index, first_pos, second_pos, do_cross, starts, stops, masks, flips):
+    '''one generation from front into back
+    # wheel, spins: cumulative probability list and the roulette spins of every slot, or
+      spins empty and parent_index holding the parent of every slot
+    # first_pos, second_pos: slots of the first and second parent of every pair
+    # do_cross: pairs that cross, starts and stops: segment every pair swaps, masks: the
+      uniform masks of the pairs, True where the first child keeps the first parent's
+      gene, an empty array for segment cross-over
+    # flips: ascending flat positions of the flipped genes of back
+    '''
+    population_size, bit_len = back.shape
+    if len(spins):
+        chosen = np.minimum(np.searchsorted(wheel, spins), population_size - 1)
+    else:
+        chosen = parent_index
+    use_masks = masks.shape[0] > 0
+
+    flip_num = len(flips)
+    f = 0
+    for p in range(len(first_pos)):
+        parent_a = chosen[first_pos[p]]
+        parent_b = chosen[second_pos[p]]
+        for child in range(2):
+            row = 2 * p + child
+            if row >= population_size:
+                break
+            keep, other = (parent_a, parent_b) if 0 == child else (parent_b, parent_a)
+            if not do_cross[p]:
+                back[row, :] = front[keep, :]
+            elif use_masks:
+                for j in range(bit_len):
+                    back[row, j] = front[keep, j] if masks[p, j] else front[other, j]
+            else:
+                back[row, :starts[p]] = front[keep, :starts[p]]
+                back[row, starts[p]:stops[p]] = front[other, starts[p]:stops[p]]
+                back[row, stops[p]:] = front[keep, stops[p]:]
+            # the flips are sorted, those of this row come next
+            while f < flip_num and flips[f] // bit_len == row:
+                back[row, flips[f] % bit_len] ^= 1
+                f += 1
+    return back
+
+
+def test():
+    print('now doing the test function')
+    # two pairs of two parents, one_point segments, the second pair does not cross
+    front = np.array([[0, 0, 0, 0], [1, 1, 1, 1], [0, 1, 0, 1]], dtype=np.uint8)
+    back = np.empty((4, 4), dtype=np.uint8)
+    empty_masks = np.zeros((0, 4), dtype=bool)
+    fused_generation(front, back, np.zeros(0), np.zeros(0), np.array([0, 1, 2, 1]), np.array([0, 2]), np.array([1, 3]),
+                     np.array([True, False]), np.array([1, 0]), np.array([4, 4]), empty_masks, np.array([0, 15]))
+    assert back.tolist() == [[1, 1, 1, 1], [1, 0, 0, 0], [0, 1, 0, 1], [1, 1, 1, 0]]
+
+    # roulette spins land on the wheel the way searchsorted does, and masks pick genes
+    wheel = np.array([0.5, 0.75, 1.0])
+    fused_generation(front, back, wheel, np.array([0.1, 0.6, 0.9, 0.2]), np.zeros(0, dtype=np.int64), np.array([0, 2]),
+                     np.array([1, 3]), np.array([True, True]), np.zeros(2, dtype=np.int64), np.zeros(2, dtype=np.int64),
+                     np.array([[True, False, True, False]] * 2), np.zeros(0, dtype=np.int64))
+    assert back.tolist() == [[0, 1, 0, 1], [1, 0, 1, 0], [0, 0, 0, 0], [0, 1, 0, 1]]
+    print('fused kernel crosses, selects and flips, compiled: {}'.format(AVAILABLE))
+
+
+if __name__ == "__main__":
+    test()
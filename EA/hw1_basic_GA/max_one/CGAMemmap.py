@@ -0,0 +1,240 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import argparse
+import pdb
+
+import numpy as np
+
+import CGAComponents
+
+'''
+Out-of-core Max-One populations.
+
+A population of millions of genomes does not fit in memory, as Individual objects or as
+one matrix. PopulationMemmap keeps the (population_size, bit_len) uint8 genome matrix in
+a .npy file and only ever maps block_rows rows of it at a time:
+    # fitness: evaluated block by block into one float64 per genome
+    # statistics: every block adds the hashes of its rows and the OR / AND of its loci,
+      so distinct genomes, the modal share and the converged loci need O(N) memory, not
+      O(N * L)
+    # a generation: Streaming_Pipeline draws the parent indices of the whole population
+      from the wheel, then for every block of children reads its parents from the
+      current file, crosses and mutates them in memory and writes them into the other
+      file, which becomes the population when all blocks are written
+
+Every block maps the file again and drops the map after, so the pages a block touched
+leave the resident set with it. The parents of a block are scattered over the whole file
+and are read with pread instead of a map. Peak RSS is set by block_rows and the O(N)
+fitness vectors, not by the genome matrix.
+'''
+
+BLOCK_ROWS = 8192
+# multiplier of the row hash, the 64 bit golden ratio constant
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def row_hashes(genomes):
+    '''one uint64 hash per genome, equal genomes give equal hashes'''
+    packed = np.packbits(genomes, axis=1)
+    pad = -packed.shape[1] % 8
+    words = np.pad(packed, ((0, 0), (0, pad))).view(np.uint64)
+    hashes = np.full(len(genomes), np.uint64(packed.shape[1]))
+    for column in words.T:
+        hashes = (hashes ^ column) * HASH_MULTIPLIER
+        hashes ^= hashes >> np.uint64(29)
+    return hashes
+
+
+class PopulationMemmap():
+    '''Max-One population whose genome matrix lives in a .npy file under directory
+    # the children of a generation go to a second file, the two files swap roles
+    # block_rows: genomes mapped at a time
+    '''
+    def __init__(self, bit_len, size, directory, block_rows=BLOCK_ROWS):
+        self.bit_len = bit_len
+        self.population_size = size
+        self.block_rows = block_rows
+        self.IndvClass = CGAComponents.Individual
+
+        os.makedirs(directory, exist_ok=True)
+        self.file_path = os.path.join(directory, 'genomes_a.npy')
+        self.back_path = os.path.join(directory, 'genomes_b.npy')
+        for file_path in [self.file_path, self.back_path]:
+            genomes = np.lib.format.open_memmap(file_path, mode='w+', dtype=np.uint8, shape=(size, bit_len))
+            # where the rows start, after the .npy header
+            self.offset = genomes.offset
+            del genomes
+
+    def open(self, file_path=None, mode='r'):
+        '''map the whole genome file, mapping costs no memory until rows are read'''
+        return np.lib.format.open_memmap(file_path or self.file_path, mode=mode)
+
+    def blocks(self):
+        '''(start, stop) rows of every block'''
+        for start in range(0, self.population_size, self.block_rows):
+            yield start, min(self.population_size, start + self.block_rows)
+
+    def read_block(self, start, stop):
+        genomes = self.open()
+        block = np.array(genomes[start:stop])
+        del genomes
+        return block
+
+    def read_rows(self, rows, out):
+        '''genomes of rows scattered over the file, into out
+        # a map would pull in the pages around every row read as well, which for rows all
+          over the file is the whole file, so the rows are read with pread, one call per
+          run of consecutive rows
+        '''
+        unique_rows, inverse = np.unique(rows, return_inverse=True)
+        genomes = np.empty((len(unique_rows), self.bit_len), dtype=np.uint8)
+        run_starts = np.flatnonzero(np.diff(unique_rows, prepend=-2) != 1)
+        run_stops = np.append(run_starts[1:], len(unique_rows))
+        row_bytes = self.bit_len
+        fd = os.open(self.file_path, os.O_RDONLY)
+        try:
+            for start, stop in zip(run_starts.tolist(), run_stops.tolist()):
+                data = os.pread(fd, (stop - start) * row_bytes, self.offset + int(unique_rows[start]) * row_bytes)
+                genomes[start:stop] = np.frombuffer(data, dtype=np.uint8).reshape(stop - start, row_bytes)
+        finally:
+            os.close(fd)
+        out[:] = genomes[inverse]
+        return out
+
+    def write_block(self, start, stop, block, file_path=None):
+        genomes = self.open(file_path, 'r+')
+        genomes[start:stop] = block
+        genomes.flush()
+        del genomes
+
+    def swap(self):
+        '''the file the children were written to becomes the population'''
+        self.file_path, self.back_path = self.back_path, self.file_path
+
+    def initialize(self):
+        '''initialization random individuals for start point, one block at a time'''
+        for start, stop in self.blocks():
+            self.write_block(start, stop, (np.random.rand(stop - start, self.bit_len) > 0.5).astype(np.uint8))
+
+    def evaluate(self, genomes):
+        '''Max-One value of every row of a genome matrix, the share of ones'''
+        return genomes.sum(axis=1) / self.bit_len
+
+    def normalize(self, pheno_val_list):
+        return pheno_val_list
+
+    def fitness(self):
+        '''calculate fitness score, evaluated block by block'''
+        pheno_val_list = np.empty(self.population_size, dtype=np.float64)
+        for start, stop in self.blocks():
+            pheno_val_list[start:stop] = self.evaluate(self.read_block(start, stop))
+        fit_list = self.normalize(pheno_val_list)
+        proportional_list = CGAComponents.get_probability_list(fit_list)
+        return proportional_list, fit_list
+
+    def statistics(self):
+        '''CGAStatistics.summarize() of the population, reduced block by block'''
+        hashes = np.empty(self.population_size, dtype=np.uint64)
+        any_one = np.zeros(self.bit_len, dtype=bool)
+        all_one = np.ones(self.bit_len, dtype=bool)
+        for start, stop in self.blocks():
+            block = self.read_block(start, stop)
+            hashes[start:stop] = row_hashes(block)
+            any_one |= block.any(axis=0)
+            all_one &= block.all(axis=0)
+        _, counts = np.unique(hashes, return_counts=True)
+        return {
+            'distinct_fraction': len(counts) / self.population_size,
+            'modal_share': counts.max() / self.population_size,
+            'converged_loci': 1.0 - np.count_nonzero(any_one & ~all_one) / self.bit_len,
+        }
+
+    def compute_identical_percentage(self):
+        '''compute identical individual percentage'''
+        return self.statistics()['distinct_fraction']
+
+    def best(self, fit_list):
+        '''return the most fit object'''
+        index = int(np.argmax(fit_list))
+        bestOne = self.IndvClass.from_row(self.read_block(index, index + 1)[0])
+        print('best one has value: ', bestOne.value)
+
+    def close(self):
+        '''remove both genome files'''
+        for file_path in [self.file_path, self.back_path]:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+
+class Streaming_Pipeline():
+    '''
+    # generation loop of a PopulationMemmap: the parent indices of the whole population
+      are drawn at once, then every block of children is bred from its parents read
+      from the current file and written into the other one
+    # the pairs are formed inside a block, the parents of a block are a random sample of
+      the wheel already, so this changes nothing about who mates with whom
+    # the parents of a block are read in file order, so the reads move forward through
+      the file instead of jumping back and forth, see PopulationMemmap.read_rows()
+    '''
+    def __init__(self, selection, crossover, mutation, population):
+        self.selection = selection
+        self.crossover = crossover
+        self.mutation = mutation
+        self.population = population
+        self.parents = np.empty((population.block_rows, population.bit_len), dtype=np.uint8)
+        self.children = np.empty_like(self.parents)
+
+    def step(self, selection_weights):
+        '''one generation, selection_weights is the wheel, or the fitness list for a ranked selection'''
+        population = self.population
+        parent_index = self.selection.select_indices(selection_weights, population.population_size)
+        for start, stop in population.blocks():
+            row_num = stop - start
+            parents, children = self.parents[:row_num], self.children[:row_num]
+            population.read_rows(parent_index[start:stop], parents)
+            self.crossover.crossover_into(parents, np.arange(row_num), children)
+            self.mutation.mutation_inplace(children, population.bit_len)
+            population.write_block(start, stop, children, population.back_path)
+        population.swap()
+        return population
+
+
+def test():
+    print('now doing the test function')
+    import tempfile
+    import CGAOperator
+    import CGAStatistics
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        population = PopulationMemmap(37, 103, tmp_dir, block_rows=16)
+        population.initialize()
+        genomes = np.array(population.open())
+        genomes[5] = genomes[4] = genomes[3]
+        population.write_block(0, 103, genomes)
+
+        # block by block reductions give what the whole matrix gives
+        matrix_population = CGAComponents.PopulationMatrix(37, 103)
+        matrix_population.setGenomes(genomes)
+        assert np.allclose(population.fitness()[0], matrix_population.fitness()[0])
+        assert population.statistics() == CGAStatistics.summarize(genomes, 37)
+
+        # a streamed generation writes the children into the other file, and a run
+        # solves Max-One
+        file_path = population.file_path
+        pipeline = Streaming_Pipeline(CGAOperator.Tournament_Selection(37), CGAOperator.Crossover(0.7, 37, 'uniform'),
+                                      CGAOperator.Mutation(0.01), population)
+        for n in range(200):
+            proportional_list, fitness_list = population.fitness()
+            if fitness_list.max() == 1:
+                break
+            population = pipeline.step(fitness_list)
+            assert (population.file_path == file_path) == (1 == n % 2)
+        assert fitness_list.max() == 1
+        population.close()
+        assert os.listdir(tmp_dir) == []
+    print('memory mapped population matches the matrix population')
+
+
+if __name__ == "__main__":
+    test()
@@ -11,6 +11,7 @@ import numpy as np
 import copy
 
 import CGAComponents
+import CGAKernels
 
 '''
 Canonical Genetic Algorithm (CGA)
@@ -46,30 +47,170 @@ Max One Problem:
 '''
 
 
+def bernoulli_positions(total, rate):
+    '''flat positions in range(total), each one picked independently with probability rate
+    # same law as drawing one random number per position, but the gaps between picked
+      positions are drawn from a geometric distribution, so the cost scales with the
+      number of picked positions instead of total
+    '''
+    if rate <= 0 or total <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if rate >= 1:
+        return np.arange(total, dtype=np.int64)
+
+    expected = total * rate
+    batch = int(expected + 4 * math.sqrt(expected)) + 16
+    chunks = []
+    last = -1
+    while True:
+        positions = last + np.cumsum(np.random.geometric(rate, size=batch))
+        if positions[-1] >= total:
+            chunks.append(positions[positions < total])
+            break
+        chunks.append(positions)
+        last = positions[-1]
+    return np.concatenate(chunks)
+
+
+def prefix_word_masks(cuts, word_len):
+    '''(len(cuts), word_len) uint64 masks with every bit in front of the cut point set'''
+    word_index, offset = np.divmod(cuts, CGAComponents.WORD_BITS)
+    masks = np.where(np.arange(word_len) < word_index[:, None], ~np.uint64(0), np.uint64(0))
+    inside = word_index < word_len
+    rows = np.flatnonzero(inside)
+    masks[rows, word_index[inside]] = np.left_shift(np.uint64(1), offset[inside].astype(np.uint64)) - np.uint64(1)
+    return masks
+
+# individuals per tournament of Tournament_Selection
+TOURNAMENT_SIZE = 2
+# share of the population Truncation_Selection breeds from
+TRUNCATION_FRACTION = 0.5
+
+
 class Roulette_Wheel_Selection():
+    # ranked selections take the fitness list instead of the cumulative wheel
+    ranked = False
+
     def __init__(self, bit_len):
         self.bit_len = bit_len
 
+    def select_indices(self, proportional_list, num=None):
+        '''indices of the chosen parents, one independent spin of the wheel per slot
+        # all spins are drawn at once and located on the cumulative probability list
+          with one binary search each, so the whole selection is O(N log N)
+        '''
+        proportional_list = np.asarray(proportional_list, dtype=np.float64)
+        population_size = len(proportional_list)
+        if num is None:
+            num = population_size
+
+        r = np.random.rand(num) * proportional_list[-1]
+        # first slot whose cumulative probability reaches r
+        chosen = np.searchsorted(proportional_list, r, side='left')
+        return np.minimum(chosen, population_size - 1)
+
     def select(self, proportional_list, population):
+        if isinstance(population, (CGAComponents.PopulationMatrix, CGAComponents.PopulationPacked)):
+            return self.select_matrix(proportional_list, population)
+
         population_size = population.population_size
-        population = population.individuals
-        chosen = []
-        for n in range(population_size):
-            r = random.random()
-            for (i, individual) in enumerate(population):
-                if r <= proportional_list[i]:
-                    chosen.append(copy.deepcopy(individual))
-                    break
+        chosen = self.select_indices(proportional_list, population_size)
 
+        # the operators after selection copy before they change anything, so the
+        # chosen individuals can be shared instead of deep copied
         parents = CGAComponents.Population(self.bit_len, population_size)
-        parents.setIndividuals(chosen)
+        parents.setIndividuals(list(population.individuals[chosen]))
         return parents
 
+    def select_matrix(self, proportional_list, population):
+        '''same wheel as select(), but gathers the chosen rows of the genome matrix'''
+        chosen = self.select_indices(proportional_list, population.population_size)
+        return population.spawn(population.genomes[chosen])
+
+
+class Stochastic_Universal_Sampling(Roulette_Wheel_Selection):
+    '''
+    # Stochastic Universal Sampling: one spin of a wheel with N equally spaced pointers,
+      each individual is chosen either floor or ceil of its expected number of times,
+      so there is less sampling noise than with N independent spins
+    '''
+    def select_indices(self, proportional_list, num=None):
+        proportional_list = np.asarray(proportional_list, dtype=np.float64)
+        population_size = len(proportional_list)
+        if num is None:
+            num = population_size
+
+        step = proportional_list[-1] / num
+        pointers = (np.random.rand() + np.arange(num)) * step
+        chosen = np.searchsorted(proportional_list, pointers, side='left')
+        return np.minimum(chosen, population_size - 1)
+
+
+class Tournament_Selection(Roulette_Wheel_Selection):
+    '''
+    # k-tournament: every parent is the fittest of k individuals drawn uniformly with
+      replacement, all tournaments are one (num, k) index matrix and one argmax along
+      its rows, so the selection is O(N k)
+    # only the order of the fitness scores counts, the pressure does not depend on how
+      fitness() normalized them
+    '''
+    ranked = True
+
+    def __init__(self, bit_len, k=TOURNAMENT_SIZE):
+        super().__init__(bit_len)
+        self.k = k
+
+    def select_indices(self, fitness_list, num=None):
+        fitness_list = np.asarray(fitness_list, dtype=np.float64)
+        population_size = len(fitness_list)
+        if num is None:
+            num = population_size
+
+        entrants = np.random.randint(population_size, size=(num, self.k))
+        winners = np.argmax(fitness_list[entrants], axis=1)
+        return entrants[np.arange(num), winners]
+
+
+class Truncation_Selection(Roulette_Wheel_Selection):
+    '''
+    # truncation: only the fittest fraction of the population breeds, every parent is
+      drawn uniformly from it, the fittest are found with one O(N) argpartition
+    '''
+    ranked = True
+
+    def __init__(self, bit_len, fraction=TRUNCATION_FRACTION):
+        super().__init__(bit_len)
+        self.fraction = fraction
+
+    def select_indices(self, fitness_list, num=None):
+        fitness_list = np.asarray(fitness_list, dtype=np.float64)
+        population_size = len(fitness_list)
+        if num is None:
+            num = population_size
+
+        keep_num = max(1, int(math.ceil(population_size * self.fraction)))
+        fittest = np.argpartition(-fitness_list, keep_num - 1)[:keep_num]
+        return fittest[np.random.randint(keep_num, size=num)]
+
+
+# parent selection operators, by the name run() takes
+SELECTIONS = {
+    'roulette': Roulette_Wheel_Selection,
+    'sus': Stochastic_Universal_Sampling,
+    'tournament': Tournament_Selection,
+    'truncation': Truncation_Selection,
+}
+
 
 class Crossover():
-    def __init__(self, c_rate, bit_len):
+    def __init__(self, c_rate, bit_len, method='one_point'):
         self.c_rate = c_rate
         self.bit_len = bit_len
+        self.method = method
+        # (first, second, starts, stops) of the last crossover_into() on a matrix, the
+        # first child of a pair takes the genes of the second parent in [start, stop),
+        # the second child the other way around; starts and stops are None for uniform
+        self.last_pairs = None
 
     def crossover_one_pair(self, pa, pb):
         bit_len = self.bit_len
@@ -97,6 +238,11 @@ class Crossover():
         return offsprings
 
     def crossover(self, parents):
+        if isinstance(parents, (CGAComponents.PopulationMatrix, CGAComponents.PopulationPacked)):
+            return self.crossover_matrix(parents)
+        if self.method != 'one_point':
+            raise ValueError('{} cross-over needs a matrix population'.format(self.method))
+
         crossover_rate = self.c_rate
         # one-point cross-over
         parents_size = parents.population_size
@@ -120,16 +266,127 @@ class Crossover():
         next_generation.setIndividuals(children_pool)
         return next_generation
 
+    def crossover_masks(self, pair_num):
+        '''(pair_num, bit_len) boolean masks for all pairs at once, True where the
+        first child keeps the gene of the first parent
+        # one_point: genes in front of one cut point
+        # two_point: genes in front of the first cut or behind the second cut
+        # uniform:   every gene on its own, from packed random bytes
+        '''
+        masks, _, _ = self.crossover_segments(pair_num)
+        return masks
+
+    def crossover_segments(self, pair_num, with_masks=True):
+        '''crossover_masks() with the segment every mask swaps, (masks, starts, stops)
+        # the swapped genes of a pair are the loci in [start, stop), the segments of
+          uniform masks are not contiguous and come back as None
+        # with_masks: False leaves out the masks of one_point and two_point, their
+          segments say it all; the random draws are the same either way
+        '''
+        bit_len = self.bit_len
+        loci = np.arange(bit_len)
+        if 'one_point' == self.method:
+            starts = np.random.randint(bit_len, size=pair_num)
+            stops = np.full(pair_num, bit_len)
+        elif 'two_point' == self.method:
+            starts, stops = np.sort(np.random.randint(bit_len + 1, size=(pair_num, 2)), axis=1).T
+        elif 'uniform' == self.method:
+            random_bytes = np.random.randint(0, 256, size=(pair_num, (bit_len + 7) // 8), dtype=np.uint8)
+            return np.unpackbits(random_bytes, axis=1, count=bit_len).astype(bool), None, None
+        else:
+            raise ValueError('unknown crossover method: {}'.format(self.method))
+        if not with_masks:
+            return None, starts, stops
+        return (loci < starts[:, None]) | (loci >= stops[:, None]), starts, stops
+
+    def mate(self, population_size, parent_index=None):
+        '''row indices of the first and second parent of every pair
+        # the parents are paired by one random permutation, an odd population
+          gets one extra random mate for its last row
+        '''
+        if parent_index is None:
+            parent_index = np.arange(population_size)
+        order = parent_index[np.random.permutation(population_size)]
+        if population_size % 2:
+            order = np.append(order, parent_index[np.random.randint(population_size)])
+        return order[0::2], order[1::2]
+
+    def crossover_matrix(self, parents):
+        '''batched cross-over of the whole genome matrix, see crossover_into()'''
+        genomes = parents.genomes
+        children = self.crossover_into(genomes, np.arange(parents.population_size), np.empty_like(genomes))
+        return parents.spawn(children)
+
+    def crossover_into(self, genomes, parent_index, out):
+        '''cross-over of all pairs at once, written straight into a preallocated buffer
+        # pairs come from one permutation of parent_index, the crossover rate is a
+          boolean vector over the pairs and every pair gets its mask row, pairs that
+          do not cross get an all True mask and are copied as they are
+        '''
+        population_size = len(parent_index)
+        first, second = self.mate(population_size, parent_index)
+        pair_num = len(first)
+
+        do_cross = np.random.rand(pair_num) < self.c_rate
+        if out.dtype == np.uint64:
+            masks = self.crossover_word_masks(pair_num, genomes.shape[1])
+            masks[~do_cross] = ~np.uint64(0)
+            parent_a, parent_b = genomes[first], genomes[second]
+            second_num = population_size // 2
+            out[0::2] = (parent_a & masks) | (parent_b & ~masks)
+            out[1::2] = ((parent_b & masks) | (parent_a & ~masks))[:second_num]
+            return out
+
+        masks, starts, stops = self.crossover_segments(pair_num)
+        masks[~do_cross] = True
+        if starts is not None:
+            # pairs that do not cross swap an empty segment
+            stops = np.where(do_cross, stops, starts)
+        self.last_pairs = (first, second, starts, stops)
+
+        parent_a, parent_b = genomes[first], genomes[second]
+        second_num = population_size // 2
+        out[0::2] = np.where(masks, parent_a, parent_b)
+        out[1::2] = np.where(masks, parent_b, parent_a)[:second_num]
+        return out
+
+    def crossover_word_masks(self, pair_num, word_len):
+        '''packed version of crossover_masks(), one uint64 mask word per genome word
+        # the cut points are drawn the same way, so a packed and an unpacked population
+          split at the same loci under the same seed
+        '''
+        bit_len = self.bit_len
+        if 'one_point' == self.method:
+            cut = np.random.randint(bit_len, size=pair_num)
+            return prefix_word_masks(cut, word_len)
+        if 'two_point' == self.method:
+            cuts = np.sort(np.random.randint(bit_len + 1, size=(pair_num, 2)), axis=1)
+            return prefix_word_masks(cuts[:, 0], word_len) | ~prefix_word_masks(cuts[:, 1], word_len)
+        if 'uniform' == self.method:
+            return np.random.randint(0, 2**64, size=(pair_num, word_len), dtype=np.uint64)
+        raise ValueError('unknown crossover method: {}'.format(self.method))
+
+
+# cross-over masks crossover_masks() knows
+CROSSOVER_METHODS = ['one_point', 'two_point', 'uniform']
+
 
 class Mutation():
     def __init__(self, mu_rate):
         self.mu_rate = mu_rate
+        # (rows, cols) of the genes the last mutation_inplace() on a matrix flipped
+        self.last_flips = None
 
     def mutation(self, population):
         '''
         # Mutation: Bitwise (each bit has a probability of flipping its state).
         # CGA generally uses small mutation rates
         '''
+        if isinstance(population, CGAComponents.PopulationMatrix):
+            return self.mutation_matrix(population)
+        if isinstance(population, CGAComponents.PopulationPacked):
+            return self.mutation_packed(population)
+
         mutation_rate = self.mu_rate
         pop_size = population.population_size
         totalBits = population.bit_len
@@ -147,3 +404,426 @@ class Mutation():
         next_generation = CGAComponents.Population(totalBits, pop_size)
         next_generation.setIndividuals(new_population)
         return next_generation
+
+    def mutation_matrix(self, population):
+        '''bitwise mutation of the whole genome matrix, see mutation_inplace()'''
+        genomes = population.genomes.copy()
+        self.mutation_inplace(genomes, population.bit_len)
+        return population.spawn(genomes)
+
+    def mutation_inplace(self, genomes, bit_len):
+        '''bitwise mutation of a genome matrix, flipping the bits where they are
+        # the cost scales with the number of flips, not with population_size * bit_len
+        '''
+        if genomes.dtype == np.uint64:
+            return self._flip_words(genomes, bit_len)
+
+        # at the usual small rates almost every per-bit draw would do nothing, so only
+        # the flipped positions are drawn and all of them are applied with one xor
+        positions = bernoulli_positions(genomes.shape[0] * bit_len, self.mu_rate)
+        rows, cols = np.divmod(positions, bit_len)
+        genomes[rows, cols] ^= 1
+        self.last_flips = (rows, cols)
+        return genomes
+
+    def mutation_packed(self, population):
+        '''bitwise mutation on packed words
+        # drawing one number per bit is what makes long genomes slow, so only the
+          flipped positions are drawn, see bernoulli_positions()
+        '''
+        words = population.genomes.copy()
+        self._flip_words(words, population.bit_len)
+        return population.spawn(words)
+
+    def _flip_words(self, words, bit_len):
+        '''packed version of mutation_inplace()'''
+        positions = bernoulli_positions(words.shape[0] * bit_len, self.mu_rate)
+        rows, genes = np.divmod(positions, bit_len)
+        cols, offsets = np.divmod(genes, CGAComponents.WORD_BITS)
+        masks = np.left_shift(np.uint64(1), offsets.astype(np.uint64))
+        # several flips can land in the same word, so the xor has to be unbuffered
+        np.bitwise_xor.at(words, (rows, cols), masks)
+        return words
+
+
+class Generation_Pipeline():
+    '''
+    # double buffered generation loop for matrix populations: two genome buffers are
+      allocated once, the offspring are written straight into the back buffer from the
+      parent indices, then the buffers swap roles, so the population object and its
+      memory stay the same from one generation to the next
+    '''
+    def __init__(self, selection, crossover, mutation, population):
+        self.selection = selection
+        self.crossover = crossover
+        self.mutation = mutation
+        self.population = population
+        self.back = np.empty_like(population.genomes)
+
+    def step(self, selection_weights):
+        '''one generation, selection_weights is the wheel, or the fitness list for a ranked selection'''
+        population = self.population
+        front = population.genomes
+        parent_index = self.selection.select_indices(selection_weights, population.population_size)
+        self.crossover.crossover_into(front, parent_index, self.back)
+        self.mutation.mutation_inplace(self.back, population.bit_len)
+
+        population.genomes, self.back = self.back, front
+        return population
+
+
+class Fused_Pipeline(Generation_Pipeline):
+    '''
+    # Generation_Pipeline with selection, cross-over and mutation in one compiled pass,
+      see CGAKernels; only for uint8 genome matrices and with numba installed
+    # the random numbers are drawn here with numpy.random, in the order the operators of
+      Generation_Pipeline draw them, so a seeded run gives the same generations
+    # roulette spins are located on the wheel inside the kernel, the other selections
+      hand in their parent indices
+    '''
+    def __init__(self, selection, crossover, mutation, population):
+        if not CGAKernels.AVAILABLE:
+            raise ValueError('the fused pipeline needs numba')
+        super().__init__(selection, crossover, mutation, population)
+        self.no_spins = np.zeros(0, dtype=np.float64)
+        self.no_index = np.zeros(0, dtype=np.int64)
+        self.no_masks = np.zeros((0, population.bit_len), dtype=bool)
+        self.no_segments = np.zeros(0, dtype=np.int64)
+
+    def step(self, selection_weights):
+        '''one generation, selection_weights is the wheel, or the fitness list for a ranked selection'''
+        population = self.population
+        population_size = population.population_size
+        front = population.genomes
+
+        wheel, spins, parent_index = self.no_spins, self.no_spins, self.no_index
+        if type(self.selection) is Roulette_Wheel_Selection:
+            wheel = np.asarray(selection_weights, dtype=np.float64)
+            spins = np.random.rand(population_size) * wheel[-1]
+        else:
+            parent_index = self.selection.select_indices(selection_weights, population_size)
+
+        crossover = self.crossover
+        first_pos, second_pos = crossover.mate(population_size)
+        do_cross = np.random.rand(len(first_pos)) < crossover.c_rate
+        masks, starts, stops = crossover.crossover_segments(len(first_pos), with_masks=False)
+        if masks is None:
+            masks = self.no_masks
+        else:
+            starts = stops = self.no_segments
+        flips = bernoulli_positions(population_size * population.bit_len, self.mutation.mu_rate)
+
+        CGAKernels.fused_generation(front, self.back, wheel, spins, parent_index, first_pos, second_pos, do_cross,
+                                    starts, stops, masks, flips)
+        population.genomes, self.back = self.back, front
+        return population
+
+
+def ragged_ranges(starts, stops):
+    '''(range index, locus) of every locus in the ranges [starts[i], stops[i]), all at once'''
+    lengths = stops - starts
+    range_index = np.repeat(np.arange(len(lengths)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return range_index, np.repeat(starts, lengths) + offsets
+
+
+class Delta_Pipeline(Generation_Pipeline):
+    '''
+    # Generation_Pipeline that never re-evaluates a whole genome of a separable objective:
+      the locus_values() total of every row is kept next to the matrix and every child
+      gets the total of its parent plus the delta of the genes that changed
+    # cross-over: the Crossover records the segment every pair swapped, a child that did
+      not cross keeps its parent total, the others add the delta over the shorter of the
+      segment and its complement, on top of the parent the shorter side belongs to
+    # mutation: the Mutation records the flipped loci, O(flips) per generation
+    # uniform masks swap scattered genes, those children are evaluated in full
+    # integer locus values, as Max-One has, keep the totals exact however long the run
+    '''
+    def __init__(self, selection, crossover, mutation, population):
+        if not getattr(population, 'separable', False):
+            raise ValueError('incremental evaluation needs a separable objective')
+        super().__init__(selection, crossover, mutation, population)
+        self.totals = self.full_totals(population.genomes)
+        self.evaluated_genes = population.genomes.size
+
+    def full_totals(self, genomes):
+        return self.population.locus_values(genomes, np.arange(genomes.shape[1])).sum(axis=1)
+
+    def fitness(self):
+        '''(proportional_list, fit_list) of the population, as population.fitness() would give them'''
+        population = self.population
+        fit_list = population.normalize(population.total_value(self.totals))
+        return CGAComponents.get_probability_list(fit_list), fit_list
+
+    def crossover_totals(self, front, population_size):
+        '''totals of the children crossover_into() just wrote, from the parent totals'''
+        population = self.population
+        bit_len = population.bit_len
+        first, second, starts, stops = self.crossover.last_pairs
+        if starts is None:
+            self.evaluated_genes += self.back.size
+            return self.full_totals(self.back)
+
+        # the first child is the first parent with [start, stop) of the second, or the
+        # second parent with the rest of the first, whichever has fewer loci to look at
+        inside = (stops - starts) <= bit_len // 2
+        base, other = np.where(inside, first, second), np.where(inside, second, first)
+        range_starts = np.concatenate([starts[inside], np.zeros(np.sum(~inside), dtype=starts.dtype), stops[~inside]])
+        range_stops = np.concatenate([stops[inside], starts[~inside], np.full(np.sum(~inside), bit_len)])
+        pair_of_range = np.concatenate([np.flatnonzero(inside), np.flatnonzero(~inside), np.flatnonzero(~inside)])
+        range_index, cols = ragged_ranges(range_starts, range_stops)
+        rows = pair_of_range[range_index]
+        gains = population.delta(cols, front[base[rows], cols], front[other[rows], cols])
+        self.evaluated_genes += len(cols)
+
+        pair_delta = np.bincount(rows, weights=gains, minlength=len(first)).astype(self.totals.dtype)
+        first_totals = self.totals[base] + pair_delta
+        # the second child is the mirror image, the parent totals add up to both children
+        second_totals = self.totals[first] + self.totals[second] - first_totals
+        totals = np.empty(population_size, dtype=self.totals.dtype)
+        totals[0::2] = first_totals
+        totals[1::2] = second_totals[:population_size // 2]
+        return totals
+
+    def step(self, selection_weights):
+        '''one generation, the totals follow the genomes through both operators'''
+        population = self.population
+        front = population.genomes
+        parent_index = self.selection.select_indices(selection_weights, population.population_size)
+        self.crossover.crossover_into(front, parent_index, self.back)
+        totals = self.crossover_totals(front, population.population_size)
+
+        self.mutation.mutation_inplace(self.back, population.bit_len)
+        rows, cols = self.mutation.last_flips
+        new_genes = self.back[rows, cols]
+        gains = population.delta(cols, new_genes ^ 1, new_genes)
+        totals += np.bincount(rows, weights=gains, minlength=len(totals)).astype(totals.dtype)
+        self.evaluated_genes += len(cols)
+
+        population.genomes, self.back = self.back, front
+        self.totals = totals
+        return population
+
+
+# victims of Steady_State_Pipeline, by the name run() takes
+REPLACEMENTS = ['worst', 'tournament']
+
+
+class Steady_State_Pipeline():
+    '''
+    # steady-state loop for matrix populations: every step breeds offspring_num children
+      into a preallocated buffer and writes them in place over the worst rows of the
+      genome matrix, or over the losers of replacement tournaments of tournament_size
+    # the evaluate() value of every row is kept next to the matrix, so a step evaluates
+      its children only, the population fitness is normalized from the kept values
+    # the archive holds the elite_num best genomes seen so far, replaced rows included
+    '''
+    def __init__(self, selection, crossover, mutation, population, offspring_num=2, replacement='worst',
+                 tournament_size=TOURNAMENT_SIZE, elite_num=1):
+        if replacement not in REPLACEMENTS:
+            raise ValueError('unknown replacement: {}'.format(replacement))
+        if not 0 < offspring_num <= population.population_size:
+            raise ValueError('offspring_num has to be in [1, {}]'.format(population.population_size))
+        self.selection = selection
+        self.crossover = crossover
+        self.mutation = mutation
+        self.population = population
+        self.replacement = replacement
+        self.tournament_size = tournament_size
+
+        self.children = np.empty((offspring_num,) + population.genomes.shape[1:], dtype=population.genomes.dtype)
+        self.pheno_val_list = population.evaluate(population.genomes)
+        self.evaluations = population.population_size
+
+        elite = self.fittest(self.pheno_val_list, elite_num)
+        self.elite_genomes = population.genomes[elite].copy()
+        self.elite_pheno_val_list = self.pheno_val_list[elite]
+
+    def fittest(self, pheno_val_list, num):
+        '''indices of the num fittest of some evaluate() values, fittest first
+        # ranked by population.elite_order(), not by normalize(), which scales by the set it
+          is given and can turn the order around when that set changes
+        '''
+        return self.population.elite_order(pheno_val_list)[:num]
+
+    def fitness(self):
+        '''(proportional_list, fit_list) of the population, as population.fitness() would give them'''
+        fit_list = self.population.normalize(self.pheno_val_list)
+        return CGAComponents.get_probability_list(fit_list), fit_list
+
+    def victims(self, fit_list, num):
+        '''distinct rows the children replace, with the index of the child for each of them'''
+        if 'worst' == self.replacement:
+            return np.argpartition(fit_list, num - 1)[:num], np.arange(num)
+        entrants = np.random.randint(len(fit_list), size=(num, self.tournament_size))
+        losers = entrants[np.arange(num), np.argmin(fit_list[entrants], axis=1)]
+        # a row that loses twice takes the first child only
+        losers, child_index = np.unique(losers, return_index=True)
+        return losers, child_index
+
+    def step(self):
+        '''breed, evaluate and insert one batch of children'''
+        population = self.population
+        genomes = population.genomes
+        proportional_list, fit_list = self.fitness()
+        selection_weights = fit_list if self.selection.ranked else proportional_list
+
+        parent_index = self.selection.select_indices(selection_weights, len(self.children))
+        self.crossover.crossover_into(genomes, parent_index, self.children)
+        self.mutation.mutation_inplace(self.children, population.bit_len)
+        child_pheno_val_list = population.evaluate(self.children)
+        self.evaluations += len(self.children)
+
+        rows, child_index = self.victims(fit_list, len(self.children))
+        genomes[rows] = self.children[child_index]
+        self.pheno_val_list[rows] = child_pheno_val_list[child_index]
+
+        # the archive competes with every child, also the ones replacement threw away
+        candidates = np.concatenate([self.elite_pheno_val_list, child_pheno_val_list])
+        elite = self.fittest(candidates, len(self.elite_genomes))
+        self.elite_genomes = np.concatenate([self.elite_genomes, self.children])[elite]
+        self.elite_pheno_val_list = candidates[elite]
+        return population
+
+    def generation(self):
+        '''as many steps as it takes to breed one population of children'''
+        offspring_num = len(self.children)
+        for _ in range(-(-self.population.population_size // offspring_num)):
+            self.step()
+        return self.population
+
+
+def test():
+    print('now doing the test function')
+    # both wheels return parent indices with the fitness proportional expectation,
+    # and sus hands out floor or ceil of the expected count to every slot
+    fit_list = np.array([1.0, 2.0, 3.0, 4.0])
+    proportional_list = CGAComponents.get_probability_list(fit_list)
+    counts = np.bincount(Roulette_Wheel_Selection(4).select_indices(proportional_list, 100000), minlength=4)
+    assert np.allclose(counts / 100000, fit_list / fit_list.sum(), atol=0.01)
+    expected = 40 * fit_list / fit_list.sum()
+    for _ in range(100):
+        counts = np.bincount(Stochastic_Universal_Sampling(4).select_indices(proportional_list, 40), minlength=4)
+        assert (counts >= np.floor(expected)).all() and (counts <= np.ceil(expected)).all()
+
+    # a k-tournament winner is the fittest of k uniform draws, truncation only breeds
+    # from the fittest fraction, whatever the scale of the fitness scores
+    fit_list = np.arange(10.0)
+    chosen = Tournament_Selection(4, k=3).select_indices(fit_list * 1e-9, 100000)
+    rank_share = np.bincount(chosen, minlength=10) / 100000
+    assert np.allclose(rank_share, ((np.arange(10) + 1) ** 3 - np.arange(10) ** 3) / 1000, atol=0.01)
+    chosen = Truncation_Selection(4, fraction=0.3).select_indices(fit_list[::-1], 1000)
+    assert set(chosen) == {0, 1, 2}
+
+    for bit_len in [1, 63, 64, 65, 130]:
+        genomes = (np.random.rand(9, bit_len) > 0.5).astype(np.uint8)
+        packed_population = CGAComponents.PopulationPacked(bit_len, 9)
+        packed_population.setGenomes(CGAComponents.pack_genomes(genomes))
+        matrix_population = CGAComponents.PopulationMatrix(bit_len, 9)
+        matrix_population.setGenomes(genomes)
+
+        # operators must keep the padding bits of the last word at zero
+        padding = ~packed_population.tail_mask
+        for method in CROSSOVER_METHODS:
+            offspring = Crossover(1.0, bit_len, method).crossover(packed_population)
+            assert not (offspring.genomes[:, -1] & padding).any()
+        offspring = Mutation(0.5).mutation(offspring)
+        assert not (offspring.genomes[:, -1] & padding).any()
+
+        # the same cut points give the same children in both layouts
+        for method in ['one_point', 'two_point']:
+            np.random.seed(bit_len)
+            packed_children = Crossover(1.0, bit_len, method).crossover(packed_population)
+            np.random.seed(bit_len)
+            matrix_children = Crossover(1.0, bit_len, method).crossover(matrix_population)
+            assert (CGAComponents.unpack_genomes(packed_children.genomes, bit_len) == matrix_children.genomes).all()
+
+        # cross-over only moves genes between the two children of a pair, and a zero rate copies the parents
+        parent_index = np.random.randint(9, size=8)
+        for method in CROSSOVER_METHODS:
+            out = Crossover(1.0, bit_len, method).crossover_into(genomes, parent_index, np.empty_like(genomes[:8]))
+            assert (out.sum(axis=0) == genomes[parent_index].sum(axis=0)).all()
+        out = Crossover(0.0, bit_len, 'uniform').crossover_into(genomes, parent_index, np.empty_like(genomes[:8]))
+        assert sorted(map(bytes, out)) == sorted(map(bytes, genomes[parent_index]))
+
+    # the packed mutation has to flip bits at the requested rate
+    packed_population = CGAComponents.PopulationPacked(1000, 100)
+    flipped = Mutation(0.3).mutation(packed_population)
+    flip_rate = CGAComponents.popcount(flipped.genomes).sum() / (1000 * 100)
+    assert abs(flip_rate - 0.3) < 0.01, flip_rate
+    for mu_rate in [0.001, 0.01, 0.3]:
+        genomes = np.zeros((1000, 100), dtype=np.uint8)
+        Mutation(mu_rate).mutation_inplace(genomes, 100)
+        assert abs(genomes.mean() - mu_rate) < 0.1 * mu_rate + 0.001, genomes.mean()
+    print('packed operators keep the padding and the mutation rate')
+
+    # the pipeline only ever swaps its two buffers
+    population = CGAComponents.PopulationMatrix(32, 10)
+    population.initialize()
+    pipeline = Generation_Pipeline(Roulette_Wheel_Selection(32), Crossover(0.5, 32, 'uniform'), Mutation(0.01), population)
+    buffers = {id(population.genomes), id(pipeline.back)}
+    for _ in range(5):
+        population = pipeline.step(population.fitness()[0])
+        assert {id(population.genomes), id(pipeline.back)} == buffers
+    print('generation pipeline reuses its buffers')
+
+    # the fused kernel breeds the same generations from the same seed
+    if CGAKernels.AVAILABLE:
+        for method in CROSSOVER_METHODS:
+            for select_method in ['roulette', 'tournament', 'sus']:
+                runs = []
+                for pipeline_class in [Generation_Pipeline, Fused_Pipeline]:
+                    np.random.seed(7)
+                    population = CGAComponents.PopulationMatrix(37, 11)
+                    population.initialize()
+                    pipeline = pipeline_class(SELECTIONS[select_method](37), Crossover(0.7, 37, method), Mutation(0.05), population)
+                    for _ in range(10):
+                        proportional_list, fitness_list = population.fitness()
+                        population = pipeline.step(fitness_list if pipeline.selection.ranked else proportional_list)
+                    runs.append(population.genomes.copy())
+                assert np.array_equal(*runs), (method, select_method)
+        print('fused pipeline matches the numpy pipeline')
+
+    # steady state writes its children into the rows of the same matrix, evaluates
+    # only them, and the archive never loses the best genome it has seen
+    for replacement in REPLACEMENTS:
+        population = CGAComponents.PopulationMatrix(32, 10)
+        population.initialize()
+        genomes = population.genomes
+        steady = Steady_State_Pipeline(Tournament_Selection(32), Crossover(0.7, 32, 'uniform'), Mutation(0.05), population,
+                                       offspring_num=3, replacement=replacement, elite_num=2)
+        best = steady.elite_pheno_val_list[0]
+        for n in range(20):
+            population = steady.step()
+            assert population.genomes is genomes
+            assert np.allclose(steady.pheno_val_list, population.evaluate(genomes))
+            assert steady.elite_pheno_val_list[0] >= best and steady.elite_pheno_val_list[0] >= steady.pheno_val_list.max()
+            best = steady.elite_pheno_val_list[0]
+        assert steady.evaluations == 10 + 20 * 3
+        assert np.allclose(population.evaluate(steady.elite_genomes), steady.elite_pheno_val_list)
+        steady.generation()
+        assert steady.evaluations == 10 + 20 * 3 + 4 * 3
+    print('steady state replaces in place and keeps its elite')
+
+    # the delta totals always equal a full evaluation, whatever the segments and flips
+    for method in CROSSOVER_METHODS:
+        for bit_len in [1, 7, 64]:
+            population = CGAComponents.PopulationMatrix(bit_len, 11)
+            population.initialize()
+            delta = Delta_Pipeline(Tournament_Selection(bit_len), Crossover(0.8, bit_len, method), Mutation(0.05), population)
+            for _ in range(30):
+                population = delta.step(delta.fitness()[1])
+                assert np.array_equal(delta.totals, population.genomes.sum(axis=1))
+                assert np.array_equal(delta.fitness()[1], population.fitness()[1])
+    # with rare flips and a low crossover rate only a fraction of the genes are read
+    population = CGAComponents.PopulationMatrix(1000, 50)
+    population.initialize()
+    delta = Delta_Pipeline(Roulette_Wheel_Selection(1000), Crossover(0.1, 1000, 'two_point'), Mutation(0.001), population)
+    for _ in range(10):
+        delta.step(delta.fitness()[0])
+    assert delta.evaluated_genes < 50 * 1000 * 2
+    print('delta evaluation matches the full evaluation')
+
+
+if __name__ == "__main__":
+    test()
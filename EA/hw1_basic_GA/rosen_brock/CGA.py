@@ -9,9 +9,13 @@ import random
 import math
 import numpy as np
 import copy
+import functools
 
 import CGAComponents_rosenBrock
 import CGAOperator
+import CGAStatistics
+import CGAIsland
+import CGAKernels
 
 '''
 Canonical Genetic Algorithm (CGA)
@@ -64,6 +68,13 @@ def print_runtime_line(gen_num, most_fit_score, avg_fit_score, identical_percent
     print(screen_line)
 
 
+def print_statistics_line(statistics):
+    # <distinct genome fraction> <share of the most common genome> <fraction of loci every genome agrees on>
+    screen_line = '<distinct genome fraction: {:f}> <modal genome share: {:f}> <converged loci: {:f}>'.format(
+        statistics['distinct_fraction'], statistics['modal_share'], statistics['converged_loci'])
+    print(screen_line)
+
+
 def print_termination_line(best_fit_flag):
     if best_fit_flag:
         termination_reason = 'population has converaged'
@@ -81,53 +92,144 @@ def stopCondition(fitness_score_list):
     return False
 
 
-def run_rosenbrock(population_size, bit_len, mu_rate, c_rate, generation_limit, float_bit_len, qname):
-    '''run Canonical Genetic Algorithm for rosen brock minimization problem'''
+def run_rosenbrock(population_size, bit_len, mu_rate, c_rate, generation_limit, float_bit_len, qname, matrix=False, select_method='roulette', double_buffer=False, crossover_method='one_point', n_vars=2, stats=False,
+                   steady_state=0, replacement='worst', elite_num=1, jit=False):
+    '''run Canonical Genetic Algorithm for rosen brock minimization problem
+    # matrix: keep the population in one (population_size, bit_len) uint8 matrix
+      instead of one Individual object per genome
+    # select_method: parent selection, one of CGAOperator.SELECTIONS
+    # double_buffer: run selection, crossover and mutation through two preallocated
+      genome buffers instead of building new populations, implies matrix
+    # crossover_method: one of CGAOperator.CROSSOVER_METHODS, all but one_point need
+      a matrix population
+    # n_vars: number of variables the genome is split into, more than two need a
+      matrix population
+    # stats: also print the modal genome share and the per-locus convergence every
+      generation, implies matrix
+    # steady_state: children bred per step of a steady-state run, 0 runs generations;
+      they replace rows in place, a generation number then counts population_size
+      children, implies matrix
+    # replacement: rows the children replace, one of CGAOperator.REPLACEMENTS
+    # elite_num: genomes kept in the elite archive of a steady-state run
+    # jit: run the double buffered generations through the fused numba kernel, the
+      NumPy pipeline is used when numba is not installed, implies double_buffer
+    '''
     print_header_line(qname, population_size, bit_len, mu_rate, c_rate)
 
     # setup all objects
-    population = CGAComponents_rosenBrock.Population(bit_len, float_bit_len, population_size)
-    selection = CGAOperator.Roulette_Wheel_Selection(bit_len)
-    crossover = CGAOperator.Crossover(c_rate, bit_len, float_bit_len)
+    if matrix or double_buffer or stats or steady_state or jit:
+        population = CGAComponents_rosenBrock.PopulationMatrix(bit_len, float_bit_len, population_size, n_vars)
+    elif n_vars != 2:
+        raise ValueError('{} variables need a matrix population'.format(n_vars))
+    else:
+        population = CGAComponents_rosenBrock.Population(bit_len, float_bit_len, population_size)
+    selection = CGAOperator.SELECTIONS[select_method](bit_len)
+    crossover = CGAOperator.Crossover(c_rate, bit_len, float_bit_len, crossover_method)
     mutation = CGAOperator.Mutation(mu_rate)
 
     # initialize population
     population.initialize()
+    pipeline = None
+    steady = None
+    if steady_state:
+        steady = CGAOperator.Steady_State_Pipeline(selection, crossover, mutation, population, steady_state, replacement,
+                                                   elite_num=elite_num)
+    elif jit and CGAKernels.AVAILABLE:
+        pipeline = CGAOperator.Fused_Pipeline(selection, crossover, mutation, population)
+    elif double_buffer or jit:
+        if jit:
+            print('numba is not installed, running the NumPy pipeline')
+        pipeline = CGAOperator.Generation_Pipeline(selection, crossover, mutation, population)
 
     # solving process
     best_fit_flag = False
     for n in range(generation_limit):
-        # evaluate
-        proportional_list, fitness_list = population.fitness()
-        most_fit_score = max(fitness_list)
-        avg_fit_score = sum(fitness_list) / len(fitness_list)
+        # evaluate, a steady-state run only evaluated the new children
+        if steady is not None:
+            proportional_list, fitness_list = steady.fitness()
+        else:
+            proportional_list, fitness_list = population.fitness()
+        most_fit_score = np.max(fitness_list)
+        avg_fit_score = np.mean(fitness_list)
         identical_percentage = population.compute_identical_percentage()
         print_runtime_line(n, most_fit_score, avg_fit_score, identical_percentage)
+        if stats:
+            print_statistics_line(CGAStatistics.summarize(population.genomes, bit_len))
 
         # check stop condition
         if stopCondition(fitness_list):
             best_fit_flag = True
             break
 
-        # select
-        parents = selection.select(proportional_list, population)
+        # ranked selections pick from the fitness scores, not from the wheel
+        selection_weights = fitness_list if selection.ranked else proportional_list
+
+        if steady is not None:
+            # population_size children, written over the replaced rows
+            population = steady.generation()
+        elif pipeline is not None:
+            # select, crossover and mutation into the back buffer, then swap
+            population = pipeline.step(selection_weights)
+        else:
+            # select
+            parents = selection.select(selection_weights, population)
 
-        # crossover
-        offspring = crossover.crossover(parents)
+            # crossover
+            offspring = crossover.crossover(parents)
 
-        # mutation
-        population = mutation.mutation(offspring)
+            # mutation
+            population = mutation.mutation(offspring)
 
     # print termination line
     print_termination_line(best_fit_flag)
 
+    if steady is not None:
+        # the archive also holds children replacement threw away
+        print('<evaluations: {}> <objective value of the elite: {:f}>'.format(steady.evaluations, steady.elite_pheno_val_list[0]))
+        # the archive is kept fittest first
+        return population.spawn(steady.elite_genomes[:1]).best([1.0])
+
     # return the best individual
     return population.best(fitness_list)
 
 
-def main():
+def make_island(population_size, bit_len, mu_rate, c_rate, float_bit_len, select_method='roulette', crossover_method='one_point', n_vars=2):
+    '''one island of the island model, built inside its worker process'''
+    population = CGAComponents_rosenBrock.PopulationMatrix(bit_len, float_bit_len, population_size, n_vars)
+    selection = CGAOperator.SELECTIONS[select_method](bit_len)
+    crossover = CGAOperator.Crossover(c_rate, bit_len, float_bit_len, crossover_method)
+    mutation = CGAOperator.Mutation(mu_rate)
+    return CGAIsland.Island(population, selection, crossover, mutation, stopCondition)
+
+
+def run_rosenbrock_islands(population_size, bit_len, mu_rate, c_rate, generation_limit, float_bit_len, qname, island_num,
+                           migration_interval=10, migrant_num=2, topology='ring', select_method='roulette',
+                           crossover_method='one_point', n_vars=2, seed=None):
+    '''run island_num Canonical Genetic Algorithms of population_size each in parallel
+    # migration_interval: generations between two migrations
+    # migrant_num: fittest genomes every island sends along the topology
+    # topology: one of CGAIsland.TOPOLOGIES
+    '''
+    print_header_line(qname, population_size, bit_len, mu_rate, c_rate)
+    print('<islands: {}> <topology: {}> <migration interval: {}> <migrants: {}>'.format(island_num, topology, migration_interval, migrant_num))
+
+    island = functools.partial(make_island, population_size, bit_len, mu_rate, c_rate, float_bit_len, select_method, crossover_method, n_vars)
+    genomes, best_fit_flag = CGAIsland.run_islands(island, island_num, generation_limit, migration_interval, migrant_num, topology, seed,
+                                                   report=print_runtime_line)
+
+    # print termination line
+    print_termination_line(best_fit_flag)
+
+    # return the best individual of all islands
+    population = CGAComponents_rosenBrock.PopulationMatrix(bit_len, float_bit_len, len(genomes), n_vars)
+    population.setGenomes(genomes)
+    _, fitness_list = population.fitness()
+    return population.best(fitness_list)
+
+
+def main(opts):
     # setup parameters
-    bit_len = 20    # Genome length
+    bit_len = 10 * opts.n_vars    # Genome length, 10 bits for each variable
     population_size = 32
     c_rate = 0.5    # crossover rate
     mu_rate = 0.01   # mutation rate
@@ -138,10 +240,39 @@ def main():
     # e.g. [1,1,1,0,0,1,1,0], [1,1,1,0] are for the integer part, [0,1,1,0] are for the fraction part
     float_bit_len = 4
 
-    run_rosenbrock(population_size, bit_len, mu_rate, c_rate, generation_limit, float_bit_len, 'rosen_brock')
+    if opts.islands:
+        run_rosenbrock_islands(population_size, bit_len, mu_rate, c_rate, generation_limit, float_bit_len, 'rosen_brock', opts.islands,
+                               migration_interval=opts.migration_interval, migrant_num=opts.migrants, topology=opts.topology,
+                               select_method=opts.selection, crossover_method=opts.crossover, n_vars=opts.n_vars)
+        print('CGA run finished!')
+        return
+
+    run_rosenbrock(population_size, bit_len, mu_rate, c_rate, generation_limit, float_bit_len, 'rosen_brock', matrix=opts.matrix, select_method=opts.selection, double_buffer=opts.double_buffer, crossover_method=opts.crossover, stats=opts.stats, n_vars=opts.n_vars,
+                   steady_state=opts.steady_state, replacement=opts.replacement, elite_num=opts.elite, jit=opts.jit)
 
     print('CGA run finished!')
 
 
+def parserArgs(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--matrix', action='store_true', help='keep the population in one uint8 genome matrix')
+    parser.add_argument('-b', '--double-buffer', action='store_true', help='double buffered generation pipeline')
+    parser.add_argument('--stats', action='store_true', help='print genome statistics every generation')
+    parser.add_argument('-i', '--islands', type=int, default=0, help='number of islands evolved in parallel, 0 runs one population')
+    parser.add_argument('--migration-interval', type=int, default=10, help='generations between two migrations')
+    parser.add_argument('--migrants', type=int, default=2, help='genomes every island sends per migration')
+    parser.add_argument('--topology', default='ring', choices=sorted(CGAIsland.TOPOLOGIES), help='islands an island receives migrants from')
+    parser.add_argument('-n', '--n-vars', type=int, default=2, help='number of variables of the objective')
+    parser.add_argument('-x', '--crossover', default='one_point', choices=CGAOperator.CROSSOVER_METHODS, help='cross-over mask')
+    parser.add_argument('-s', '--selection', default='roulette', choices=sorted(CGAOperator.SELECTIONS), help='parent selection')
+    parser.add_argument('--jit', action='store_true', help='fused numba generation kernel, NumPy without numba')
+    parser.add_argument('--steady-state', type=int, default=0, help='children bred per steady-state step, 0 runs generations')
+    parser.add_argument('--replacement', default='worst', choices=CGAOperator.REPLACEMENTS, help='rows the steady-state children replace')
+    parser.add_argument('--elite', type=int, default=1, help='genomes kept in the steady-state elite archive')
+    opts = parser.parse_args()
+    return opts
+
+
 if __name__ == "__main__":
-    main()
+    opts = parserArgs(sys.argv)
+    main(opts)
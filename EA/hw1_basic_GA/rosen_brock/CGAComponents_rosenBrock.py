@@ -11,6 +11,8 @@ import numpy as np
 import numpy.random as np_rand
 import copy
 
+import CGAStatistics
+
 
 '''
 Canonical Genetic Algorithm (CGA)
@@ -46,9 +48,10 @@ Optimization of Rosenbrock:
 
 
 def get_probability_list(fitness_list):
-    total_fit = float(sum(fitness_list))
-    relative_fitness = [f/total_fit for f in fitness_list]
-    proportional_list = [sum(relative_fitness[:i+1]) for i in range(len(relative_fitness))]
+    '''cumulative selection probability of each slot of the wheel'''
+    fitness_list = np.asarray(fitness_list, dtype=np.float64)
+    relative_fitness = fitness_list / fitness_list.sum()
+    proportional_list = np.cumsum(relative_fitness)
     return proportional_list
 
 
@@ -82,6 +85,29 @@ def convert_bin_2_deci(x_bin, int_bit_len):
     return x_val
 
 
+def decode_weights(var_bit_len, float_bit_len):
+    '''weight of every bit of one variable, so that bits.dot(weights) is its decimal value
+    # the integer part counts down from 2^(int_bit_len-1), the fraction part from 2^-1,
+      the same value convert_bin_2_deci() builds through strings
+    '''
+    int_bit_len = var_bit_len - float_bit_len
+    return 2.0 ** np.arange(int_bit_len - 1, int_bit_len - 1 - var_bit_len, -1)
+
+
+def decode_genomes(genomes, n_vars, weights):
+    '''(N, n_vars) decimal values of every variable of every row, with one dot product'''
+    var_bits = genomes.reshape(len(genomes), n_vars, -1)
+    return var_bits.dot(weights)
+
+
+def rosenbrock(values, a=1, b=100):
+    '''phenotype of every row of decoded values, any number of variables
+    # f(x, y) = (a - x)^2 + b(y - x^2), summed over neighbouring variables
+    '''
+    x, y = values[:, :-1], values[:, 1:]
+    return ((a - x)**2 + b * (y - x**2)).sum(axis=1)
+
+
 class Individual():
     def __init__(self, bit_len, float_bit_len, doInitialize=True):
         # set representation format
@@ -101,6 +127,13 @@ class Individual():
         self.fitness = None
         self.a, self.b = 1, 100
 
+    @classmethod
+    def from_row(cls, row, float_bit_len):
+        '''wrap one row of a population matrix as an individual, without copying it'''
+        individual = cls(len(row), float_bit_len, doInitialize=False)
+        individual.value = row
+        return individual
+
     def calculate_phenotype(self):
         '''
         # x and y gene are fixed float binary representation
@@ -167,21 +200,8 @@ class Population():
 
     def compute_identical_percentage(self):
         '''compute identical individual percentage'''
-        def notInPool(indv_val, identical_pool):
-            if not identical_pool:
-                return True
-            for item in identical_pool:
-                if (indv_val == item).all():
-                    return False
-            return True
-
-        identical_pool = []
-        for individual in self.individuals:
-            indv_val = individual.value
-            if notInPool(indv_val, identical_pool):
-                identical_pool.append(indv_val)
-
-        identical_percentage = len(identical_pool) / self.population_size
+        genomes = np.array([individual.value for individual in self.individuals], dtype=np.uint8)
+        identical_percentage = CGAStatistics.distinct_fraction(genomes)
         return identical_percentage
 
     def best(self, fit_list):
@@ -191,5 +211,111 @@ class Population():
         print('best one has value: ', bestOne.value)
 
 
+class PopulationMatrix():
+    '''collection of individuals backed by one contiguous (population_size, bit_len) uint8 matrix,
+    each row of the matrix is the genome of one individual'''
+    def __init__(self, bit_len, float_bit_len, size=10, n_vars=2):
+        self.bit_len = bit_len
+        self.float_bit_len = float_bit_len
+        self.population_size = size
+
+        # every variable takes bit_len // n_vars bits of the genome
+        if bit_len % n_vars:
+            raise ValueError('bit_len {} can not be split into {} variables'.format(bit_len, n_vars))
+        self.n_vars = n_vars
+        self.weights = decode_weights(bit_len // n_vars, float_bit_len)
+
+        self.genomes = np.zeros((size, bit_len), dtype=np.uint8)
+        self.IndvClass = Individual
+
+    @property
+    def individuals(self):
+        '''row views of the genome matrix, only built when someone asks for them'''
+        return [self.IndvClass.from_row(row, self.float_bit_len) for row in self.genomes]
+
+    def setGenomes(self, genomes):
+        '''set genome matrix for the next generation'''
+        self.genomes = np.ascontiguousarray(genomes, dtype=np.uint8)
+        self.population_size = self.genomes.shape[0]
+
+    def spawn(self, genomes):
+        '''new population with the same encoding, holding the given genome matrix'''
+        next_generation = PopulationMatrix(self.bit_len, self.float_bit_len, len(genomes), self.n_vars)
+        next_generation.setGenomes(genomes)
+        return next_generation
+
+    def initialize(self):
+        '''initialization random individuals for start point'''
+        self.genomes = (np.random.rand(self.population_size, self.bit_len) > 0.5).astype(np.uint8)
+
+    def decode(self):
+        '''(population_size, n_vars) decimal values of the genome matrix'''
+        return decode_genomes(self.genomes, self.n_vars, self.weights)
+
+    def evaluate(self, genomes):
+        '''phenotype of every row of a genome matrix of this encoding'''
+        return rosenbrock(decode_genomes(genomes, self.n_vars, self.weights))
+
+    def normalize(self, pheno_val_list):
+        '''fitness of the phenotypes of a population, normalized the same way Population.fitness() does'''
+        sum_pheno = pheno_val_list.sum()
+        # and reverse it since we find the min
+        return 1 - (pheno_val_list / sum_pheno)
+
+    def elite_order(self, pheno_val_list):
+        '''indices of some phenotypes from the fittest to the least fit, the lowest value first
+        # normalize() depends on the sum of the values, this order does not
+        '''
+        return np.argsort(pheno_val_list, kind='stable')
+
+    def fitness(self):
+        '''calculate fitness score, the whole matrix is decoded and evaluated at once'''
+        if 0 == self.genomes.size:
+            raise ValueError('individuals has not been set')
+
+        fit_list = self.normalize(self.evaluate(self.genomes))
+
+        proportional_list = get_probability_list(fit_list)
+        return proportional_list, fit_list
+
+    def compute_identical_percentage(self):
+        '''compute identical individual percentage'''
+        identical_percentage = CGAStatistics.distinct_fraction(self.genomes)
+        return identical_percentage
+
+    def best(self, fit_list):
+        '''return the most fit object'''
+        index = int(np.argmax(fit_list))
+        bestOne = self.IndvClass.from_row(self.genomes[index], self.float_bit_len)
+        print('best one has value: ', bestOne.value)
+
+
+def test():
+    print('now doing the test function')
+    # the matrix population has to score the same genomes the same way as the object one
+    genomes = (np.random.rand(20, 20) > 0.5).astype(np.uint8)
+    genomes[1] = genomes[0]
+    population = Population(20, 4, 20)
+    population.setIndividuals([Individual.from_row(row.copy(), 4) for row in genomes])
+    matrix_population = PopulationMatrix(20, 4, 20)
+    matrix_population.setGenomes(genomes)
+
+    proportional_list, fit_list = population.fitness()
+    matrix_proportional_list, matrix_fit_list = matrix_population.fitness()
+    assert np.allclose(fit_list, matrix_fit_list)
+    assert np.allclose(proportional_list, matrix_proportional_list)
+    assert population.compute_identical_percentage() == matrix_population.compute_identical_percentage()
+    print('matrix population fitness matches the object population')
+
+    # the dot product decoder gives the same values as the string decoder
+    var_bit_len = matrix_population.bit_len // 2
+    int_bit_len = var_bit_len - matrix_population.float_bit_len
+    values = matrix_population.decode()
+    for row, row_values in zip(genomes, values):
+        assert np.isclose(row_values[0], convert_bin_2_deci(list(row[:var_bit_len]), int_bit_len))
+        assert np.isclose(row_values[1], convert_bin_2_deci(list(row[var_bit_len:]), int_bit_len))
+    print('vectorized decoder matches convert_bin_2_deci')
+
+
 if __name__ == "__main__":
-    pass
+    test()
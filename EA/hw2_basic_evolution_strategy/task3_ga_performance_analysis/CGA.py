@@ -12,6 +12,9 @@ import copy
 
 import CGAComponents
 import CGAOperator
+import CGAStatistics
+import CGATelemetry
+import CGACheckpoint
 
 '''
 Canonical Genetic Algorithm (CGA)
@@ -65,6 +68,13 @@ def print_runtime_line(gen_num, most_fit_score, avg_fit_score, identical_percent
     print(screen_line)
 
 
+def print_statistics_line(statistics):
+    # <distinct genome fraction> <share of the most common genome> <fraction of loci every genome agrees on>
+    screen_line = '<distinct genome fraction: {:f}> <modal genome share: {:f}> <converged loci: {:f}>'.format(
+        statistics['distinct_fraction'], statistics['modal_share'], statistics['converged_loci'])
+    print(screen_line)
+
+
 def print_termination_line(best_fit_flag):
     if best_fit_flag:
         termination_reason = 'population has converaged'
@@ -82,57 +92,110 @@ def stopCondition(fitness_score_list):
     return False
 
 
-def run(population_size, bit_len, mu_rate, c_rate, generation_limit, float_bit_len, qname):
-    '''run Canonical Genetic Algorithm for rosen brock minimization problem'''
+def run(population_size, bit_len, mu_rate, c_rate, generation_limit, float_bit_len, qname, matrix=False, select_method='roulette', double_buffer=False, crossover_method='one_point', stats=False, diversity_pairs=0, telemetry='print', telemetry_file=None,
+        checkpoint_file=None, checkpoint_interval=10, resume=False):
+    '''run Canonical Genetic Algorithm for rosen brock minimization problem
+    # matrix: keep the population in one (population_size, bit_len) uint8 matrix
+      instead of one Individual object per genome
+    # select_method: parent selection, one of CGAOperator.SELECTIONS
+    # double_buffer: run selection, crossover and mutation through two preallocated
+      genome buffers instead of building new populations, implies matrix
+    # crossover_method: one of CGAOperator.CROSSOVER_METHODS, all but one_point need
+      a matrix population
+    # stats: also print the modal genome share and the per-locus convergence every
+      generation, implies matrix
+    # diversity_pairs: estimate the diversity from this many random pairs of genomes
+      instead of comparing all pairs, implies matrix
+    # telemetry: one of CGATelemetry.MODES, print shows the runtime line of every
+      generation, full also streams the records to telemetry_file
+    # checkpoint_file: save the state of the run there every checkpoint_interval
+      generations, implies matrix
+    # resume: go on from the state in checkpoint_file, the rest of the run is the same
+      as if it had never stopped
+    return the most fit, average fitness and diversity trace of the run
+    '''
     print_header_line(qname, population_size, bit_len, mu_rate, c_rate)
 
     # setup all objects
-    population = CGAComponents.Population(bit_len, float_bit_len, population_size)
-    selection = CGAOperator.Roulette_Wheel_Selection(bit_len)
-    crossover = CGAOperator.Crossover(c_rate, bit_len, float_bit_len)
+    if matrix or double_buffer or stats or diversity_pairs or checkpoint_file:
+        population = CGAComponents.PopulationMatrix(bit_len, float_bit_len, population_size)
+        population.diversity_pairs = diversity_pairs
+    else:
+        population = CGAComponents.Population(bit_len, float_bit_len, population_size)
+    selection = CGAOperator.SELECTIONS[select_method](bit_len)
+    crossover = CGAOperator.Crossover(c_rate, bit_len, float_bit_len, crossover_method)
     mutation = CGAOperator.Mutation(mu_rate)
 
     # initialize population
-    population.initialize()
+    first_generation, records = 0, None
+    if resume:
+        state = CGACheckpoint.load_checkpoint(checkpoint_file)
+        if state['genomes'].shape != (population_size, bit_len):
+            raise ValueError('checkpoint holds {} genomes, the run needs {}'.format(state['genomes'].shape, (population_size, bit_len)))
+        population.setGenomes(np.array(state['genomes']))
+        mutation.mu_rate = state['params']['mu_rate']
+        crossover.c_rate = state['params']['c_rate']
+        CGACheckpoint.set_random_state(state)
+        first_generation, records = state['generation'], state['records']
+        print('resume from generation {} of {}'.format(first_generation, checkpoint_file))
+    else:
+        population.initialize()
+    pipeline = None
+    if double_buffer:
+        pipeline = CGAOperator.Generation_Pipeline(selection, crossover, mutation, population)
 
     # solving process
     best_fit_flag = False
-    most_fit_score_list, avg_fit_score_list, div_score_list = [], [], []
-    for n in range(generation_limit):
-        # evaluate
-        proportional_list, fitness_list = population.fitness()
-        most_fit_score = min(fitness_list)
-        avg_fit_score = sum(fitness_list) / len(fitness_list)
-        identical_percentage = population.compute_identical_percentage()
-        diversity_score = population.compute_diversity()
-        print_runtime_line(n, most_fit_score, avg_fit_score, identical_percentage)
-
-        most_fit_score_list.append(most_fit_score)
-        avg_fit_score_list.append(avg_fit_score)
-        div_score_list.append(diversity_score)
-
-        # check stop condition
-        if stopCondition(fitness_list):
-            best_fit_flag = True
-            break
-
-        # select
-        parents = selection.select(proportional_list, population)
-
-        # crossover
-        offspring = crossover.crossover(parents)
-
-        # mutation
-        population = mutation.mutation(offspring)
+    sink = CGATelemetry.Telemetry_Sink(telemetry, telemetry_file, print_runtime_line, capacity=generation_limit, records=records)
+    try:
+        for n in range(first_generation, generation_limit):
+            # evaluate
+            proportional_list, fitness_list = population.fitness()
+            most_fit_score = np.min(fitness_list)
+            avg_fit_score = np.mean(fitness_list)
+            identical_percentage = population.compute_identical_percentage()
+            diversity_score = population.compute_diversity()
+            sink.record(n, most_fit_score, avg_fit_score, identical_percentage, diversity_score)
+            if stats:
+                print_statistics_line(CGAStatistics.summarize(population.genomes, bit_len))
+
+            # check stop condition
+            if stopCondition(fitness_list):
+                best_fit_flag = True
+                break
+
+            # ranked selections pick from the fitness scores, not from the wheel
+            selection_weights = fitness_list if selection.ranked else proportional_list
+
+            if pipeline is not None:
+                # select, crossover and mutation into the back buffer, then swap
+                population = pipeline.step(selection_weights)
+            else:
+                # select
+                parents = selection.select(selection_weights, population)
+
+                # crossover
+                offspring = crossover.crossover(parents)
+
+                # mutation
+                population = mutation.mutation(offspring)
+
+            if checkpoint_file is not None and (n + 1) % checkpoint_interval == 0:
+                CGACheckpoint.save_checkpoint(checkpoint_file, n + 1, population.genomes, sink.history(),
+                                              {'mu_rate': mutation.mu_rate, 'c_rate': crossover.c_rate})
+    finally:
+        # the records written so far stay in the telemetry file when the run dies
+        sink.close()
 
     # print termination line
     print_termination_line(best_fit_flag)
 
     # return the best individual
-    return most_fit_score_list, avg_fit_score_list, div_score_list
+    records = sink.history()
+    return records['most_fit'], records['avg_fit'], records['diversity']
 
 
-def main():
+def main(opts):
     # setup parameters
     bit_len = 20    # Genome length
     population_size = 100
@@ -145,12 +208,17 @@ def main():
     # e.g. [1,1,1,0,0,1,1,0], [1,1,1,0] are for the integer part, [0,1,1,0] are for the fraction part
     float_bit_len = 6
 
-    most_fit_score_list, avg_fit_score_list, div_score_list = run(population_size, bit_len, mu_rate, c_rate, generation_limit, float_bit_len, 'rosen_brock')
+    this_file_path = os.path.realpath(__file__)
+    current_dir = os.path.dirname(this_file_path)
+    telemetry_file = opts.telemetry_file or os.path.join(current_dir, 'run_stat.telemetry')
+    checkpoint_file = opts.checkpoint
+    if '' == checkpoint_file or (opts.resume and checkpoint_file is None):
+        checkpoint_file = os.path.join(current_dir, 'run_stat.ckpt.npz')
+
+    most_fit_score_list, avg_fit_score_list, div_score_list = run(population_size, bit_len, mu_rate, c_rate, generation_limit, float_bit_len, 'rosen_brock', matrix=opts.matrix, select_method=opts.selection, double_buffer=opts.double_buffer, crossover_method=opts.crossover, stats=opts.stats, diversity_pairs=opts.diversity_pairs, telemetry=opts.telemetry, telemetry_file=telemetry_file, checkpoint_file=checkpoint_file, checkpoint_interval=opts.checkpoint_interval, resume=opts.resume)
 
     # save the data during the run, and plot the data with a standalone script
     avg_fit_score_list, most_fit_score_list, div_score_list = np.array(avg_fit_score_list), np.array(most_fit_score_list), np.array(div_score_list)
-    this_file_path = os.path.realpath(__file__)
-    current_dir = os.path.dirname(this_file_path)
     save_path = os.path.join(current_dir, 'run_stat.npz')
     np.savez(save_path, avg_data=avg_fit_score_list, most_data=most_fit_score_list, div_data=div_score_list)
     print('save the avg_fitness_list data to path: {}'.format(save_path))
@@ -158,5 +226,23 @@ def main():
     print('CGA run finished!')
 
 
+def parserArgs(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--matrix', action='store_true', help='keep the population in one uint8 genome matrix')
+    parser.add_argument('-b', '--double-buffer', action='store_true', help='double buffered generation pipeline')
+    parser.add_argument('--stats', action='store_true', help='print genome statistics every generation')
+    parser.add_argument('--diversity-pairs', type=int, default=0, help='sampled genome pairs of the diversity trace, 0 compares all pairs')
+    parser.add_argument('--telemetry', default='print', choices=CGATelemetry.MODES, help='per-generation output, full also streams binary records to a file')
+    parser.add_argument('--telemetry-file', default=None, help='records file of full telemetry, run_stat.telemetry next to this script by default')
+    parser.add_argument('--checkpoint', nargs='?', const='', default=None, help='save the state of the run to this file, run_stat.ckpt.npz next to this script without one')
+    parser.add_argument('--checkpoint-interval', type=int, default=10, help='generations between two checkpoints')
+    parser.add_argument('--resume', action='store_true', help='go on from the checkpoint of an interrupted run')
+    parser.add_argument('-x', '--crossover', default='one_point', choices=CGAOperator.CROSSOVER_METHODS, help='cross-over mask')
+    parser.add_argument('-s', '--selection', default='roulette', choices=sorted(CGAOperator.SELECTIONS), help='parent selection')
+    opts = parser.parse_args()
+    return opts
+
+
 if __name__ == "__main__":
-    main()
+    opts = parserArgs(sys.argv)
+    main(opts)
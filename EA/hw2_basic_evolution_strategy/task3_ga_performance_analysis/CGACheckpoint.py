@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import argparse
+import pdb
+
+import glob
+import random
+import numpy as np
+
+'''
+Checkpoints of a Canonical Genetic Algorithm run.
+
+A checkpoint holds everything the next generation depends on: the genome matrix, the state
+of the numpy and python random generators, the operator parameters and the telemetry
+records so far. Restoring all of it and going on from the saved generation draws the same
+random numbers in the same order, so the resumed run is bit-for-bit the run that was
+interrupted.
+
+The checkpoint is one .npz file. It is written to a temporary file next to it and moved
+over the old one with os.replace(), so a run killed while writing leaves the previous
+checkpoint intact. Genome matrices of memmap_bytes and more go to their own .npy file,
+named after the generation, which load_checkpoint() maps instead of reading; the .npz
+names the .npy it belongs to, and the older ones are removed once it is in place.
+'''
+
+MEMMAP_BYTES = 1 << 26
+PARAM_PREFIX = 'param_'
+
+
+def random_state():
+    '''state of numpy.random and random as arrays'''
+    _, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    version, internal_state, gauss_next = random.getstate()
+    return dict(np_keys=keys, np_pos=pos, np_has_gauss=has_gauss, np_cached_gaussian=cached_gaussian,
+                py_version=version, py_state=np.array(internal_state, dtype=np.uint64),
+                py_gauss_next=np.nan if gauss_next is None else gauss_next)
+
+
+def set_random_state(state):
+    '''restore the generators from the arrays of random_state()'''
+    np.random.set_state(('MT19937', state['np_keys'], int(state['np_pos']), int(state['np_has_gauss']),
+                         float(state['np_cached_gaussian'])))
+    gauss_next = float(state['py_gauss_next'])
+    random.setstate((int(state['py_version']), tuple(int(i) for i in state['py_state']),
+                     None if np.isnan(gauss_next) else gauss_next))
+
+
+def write_atomic(file_path, write):
+    '''write(f) into a temporary file, then move it over file_path'''
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+
+def genome_path(file_path, generation):
+    return '{}.{}.genomes.npy'.format(file_path, generation)
+
+
+def save_checkpoint(file_path, generation, genomes, records, params, memmap_bytes=MEMMAP_BYTES):
+    '''
+    # generation: number of the next generation to evaluate
+    # records: CGATelemetry records of the generations before it
+    # params: dict of scalar operator parameters, restored as they are
+    # memmap_bytes: size from which the genomes get their own .npy file
+    '''
+    arrays = random_state()
+    arrays.update(('{}{}'.format(PARAM_PREFIX, name), value) for name, value in params.items())
+    arrays.update(generation=generation, records=records)
+
+    old_genome_files = glob.glob(genome_path(file_path, '*'))
+    if genomes.nbytes >= memmap_bytes:
+        genome_file = genome_path(file_path, generation)
+        write_atomic(genome_file, lambda f: np.save(f, genomes))
+        arrays.update(genome_file=os.path.basename(genome_file))
+    else:
+        arrays.update(genomes=genomes)
+    write_atomic(file_path, lambda f: np.savez(f, **arrays))
+
+    # the checkpoint in place no longer needs the genomes of the earlier ones
+    current = arrays.get('genome_file')
+    for old_file in old_genome_files:
+        if os.path.basename(old_file) != current:
+            os.remove(old_file)
+
+
+def load_checkpoint(file_path):
+    '''dict of the saved arrays, params holds the operator parameters, large genome
+    matrices are memory mapped'''
+    with np.load(file_path) as data:
+        state = {name: data[name] for name in data.files}
+    state['generation'] = int(state['generation'])
+    state['params'] = {name[len(PARAM_PREFIX):]: state.pop(name).item() for name in list(state) if name.startswith(PARAM_PREFIX)}
+    if 'genome_file' in state:
+        genome_file = os.path.join(os.path.dirname(file_path), str(state['genome_file']))
+        state['genomes'] = np.load(genome_file, mmap_mode='r')
+    return state
+
+
+def test():
+    print('now doing the test function')
+    import tempfile
+    records = np.zeros(3, dtype=[('generation', '<i8'), ('most_fit', '<f8')])
+    records['generation'] = np.arange(3)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, 'run.ckpt.npz')
+        genomes = (np.random.rand(6, 10) > 0.5).astype(np.uint8)
+        random.random()
+        np.random.normal()
+        save_checkpoint(file_path, 3, genomes, records, {'mu_rate': 0.01, 'crossover_method': 'uniform'})
+        expected = (np.random.rand(5), [random.random() for i in range(5)], np.random.normal())
+
+        np.random.seed(0)
+        random.seed(0)
+        state = load_checkpoint(file_path)
+        set_random_state(state)
+        assert (np.random.rand(5) == expected[0]).all() and [random.random() for i in range(5)] == expected[1]
+        assert np.random.normal() == expected[2]
+        assert state['generation'] == 3 and np.array_equal(state['genomes'], genomes)
+        assert np.array_equal(state['records'], records)
+        assert state['params'] == {'mu_rate': 0.01, 'crossover_method': 'uniform'}
+        print('checkpoint restores the random state and the run state')
+
+        # large genome matrices live in their own mapped file, one at a time
+        save_checkpoint(file_path, 4, genomes, records, {}, memmap_bytes=1)
+        save_checkpoint(file_path, 5, genomes, records, {}, memmap_bytes=1)
+        state = load_checkpoint(file_path)
+        assert isinstance(state['genomes'], np.memmap) and np.array_equal(state['genomes'], genomes)
+        assert sorted(os.listdir(tmp_dir)) == ['run.ckpt.npz', 'run.ckpt.npz.5.genomes.npy']
+        del state
+        save_checkpoint(file_path, 6, genomes, records, {})
+        assert os.listdir(tmp_dir) == ['run.ckpt.npz']
+    print('large genome matrices are memory mapped')
+
+
+if __name__ == "__main__":
+    test()
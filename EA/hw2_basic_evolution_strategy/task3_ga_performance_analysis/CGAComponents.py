@@ -11,6 +11,9 @@ import numpy as np
 import numpy.random as np_rand
 import copy
 
+import CGAStatistics
+import CGADiversity
+
 
 '''
 Canonical Genetic Algorithm (CGA)
@@ -46,9 +49,10 @@ Optimization of Rosenbrock:
 
 
 def get_probability_list(fitness_list):
-    total_fit = float(sum(fitness_list))
-    relative_fitness = [f/total_fit for f in fitness_list]
-    proportional_list = [sum(relative_fitness[:i+1]) for i in range(len(relative_fitness))]
+    '''cumulative selection probability of each slot of the wheel'''
+    fitness_list = np.asarray(fitness_list, dtype=np.float64)
+    relative_fitness = fitness_list / fitness_list.sum()
+    proportional_list = np.cumsum(relative_fitness)
     return proportional_list
 
 
@@ -82,6 +86,31 @@ def convert_bin_2_deci(x_bin, int_bit_len):
     return x_val
 
 
+def decode_weights(var_bit_len, float_bit_len):
+    '''weight of every bit of one variable, so that bits.dot(weights) is its decimal value
+    # the integer part counts down from 2^(int_bit_len-1), the fraction part from 2^-1,
+      the same value convert_bin_2_deci() builds through strings
+    '''
+    int_bit_len = var_bit_len - float_bit_len
+    return 2.0 ** np.arange(int_bit_len - 1, int_bit_len - 1 - var_bit_len, -1)
+
+
+def decode_genomes(genomes, n_vars, weights):
+    '''(N, n_vars) decimal values of every variable of every row, with one dot product'''
+    var_bits = genomes.reshape(len(genomes), n_vars, -1)
+    return var_bits.dot(weights)
+
+
+def himmelblau(values):
+    '''phenotype of every row of decoded (x, y) values
+    # f(x, y) = (x^2 + y - 11)^2 + (x + y^2 -7)^2, with x and y limited to [-10, 10]
+    '''
+    if values.shape[1] != 2:
+        raise ValueError('Himmelblau\'s function takes exactly two variables')
+    x, y = np.clip(values[:, 0], -10.0, 10.0), np.clip(values[:, 1], -10.0, 10.0)
+    return (x**2 + y - 11)**2 + (x + y**2 - 7)**2
+
+
 class Individual():
     def __init__(self, bit_len, float_bit_len, doInitialize=True):
         # set representation format
@@ -100,6 +129,13 @@ class Individual():
         self.evaluation = None
         self.fitness = None
 
+    @classmethod
+    def from_row(cls, row, float_bit_len):
+        '''wrap one row of a population matrix as an individual, without copying it'''
+        individual = cls(len(row), float_bit_len, doInitialize=False)
+        individual.value = row
+        return individual
+
     def calculate_phenotype(self):
         '''
         # x and y gene are fixed float binary representation
@@ -171,21 +207,8 @@ class Population():
 
     def compute_identical_percentage(self):
         '''compute identical individual percentage'''
-        def notInPool(indv_val, identical_pool):
-            if not identical_pool:
-                return True
-            for item in identical_pool:
-                if (indv_val == item).all():
-                    return False
-            return True
-
-        identical_pool = []
-        for individual in self.individuals:
-            indv_val = individual.value
-            if notInPool(indv_val, identical_pool):
-                identical_pool.append(indv_val)
-
-        identical_percentage = len(identical_pool) / self.population_size
+        genomes = np.array([individual.value for individual in self.individuals], dtype=np.uint8)
+        identical_percentage = CGAStatistics.distinct_fraction(genomes)
         return identical_percentage
 
     def best(self, fit_list):
@@ -195,22 +218,128 @@ class Population():
         print('best one has value: ', bestOne.value)
 
     def compute_diversity(self):
-        def compute_distance(individual_a, individual_b):
-            gene_a, gene_b = individual_a.value, individual_b.value
-            vec1, vec2 = np.array(gene_a), np.array(gene_b)
-            dist = np.linalg.norm(vec1-vec2)
-            return dist
-
-        largest_distance = 0
-        population = self.individuals
-        for i in range(self.population_size):
-            for j in range(i, self.population_size):
-                item_a, item_b = population[i], population[j]
-                tmp_dis = compute_distance(item_a, item_b)
-                if tmp_dis > largest_distance:
-                    largest_distance = tmp_dis
-        return largest_distance
+        '''largest euclidian distance between two individuals'''
+        genomes = np.array([individual.value for individual in self.individuals], dtype=np.uint8)
+        largest_distance = CGADiversity.max_pairwise_hamming(CGADiversity.pack_genomes(genomes))
+        return math.sqrt(largest_distance)
+
+
+class PopulationMatrix():
+    '''collection of individuals backed by one contiguous (population_size, bit_len) uint8 matrix,
+    each row of the matrix is the genome of one individual'''
+    def __init__(self, bit_len, float_bit_len, size=10, n_vars=2):
+        self.bit_len = bit_len
+        self.float_bit_len = float_bit_len
+        self.population_size = size
+
+        # every variable takes bit_len // n_vars bits of the genome
+        if bit_len % n_vars:
+            raise ValueError('bit_len {} can not be split into {} variables'.format(bit_len, n_vars))
+        self.n_vars = n_vars
+        self.weights = decode_weights(bit_len // n_vars, float_bit_len)
+
+        self.genomes = np.zeros((size, bit_len), dtype=np.uint8)
+        self.IndvClass = Individual
+        # 0 compares every pair in compute_diversity, otherwise the number of sampled pairs
+        self.diversity_pairs = 0
+
+    @property
+    def individuals(self):
+        '''row views of the genome matrix, only built when someone asks for them'''
+        return [self.IndvClass.from_row(row, self.float_bit_len) for row in self.genomes]
+
+    def setGenomes(self, genomes):
+        '''set genome matrix for the next generation'''
+        self.genomes = np.ascontiguousarray(genomes, dtype=np.uint8)
+        self.population_size = self.genomes.shape[0]
+
+    def spawn(self, genomes):
+        '''new population with the same encoding, holding the given genome matrix'''
+        next_generation = PopulationMatrix(self.bit_len, self.float_bit_len, len(genomes), self.n_vars)
+        next_generation.diversity_pairs = self.diversity_pairs
+        next_generation.setGenomes(genomes)
+        return next_generation
+
+    def initialize(self):
+        '''initialization random individuals for start point'''
+        self.genomes = (np.random.rand(self.population_size, self.bit_len) > 0.5).astype(np.uint8)
+
+    def decode(self):
+        '''(population_size, n_vars) decimal values of the genome matrix'''
+        return decode_genomes(self.genomes, self.n_vars, self.weights)
+
+    def fitness(self):
+        '''calculate fitness score, the whole matrix is decoded and evaluated at once'''
+        if 0 == self.genomes.size:
+            raise ValueError('individuals has not been set')
+
+        pheno_val_list = himmelblau(self.decode())
+
+        # normalize the phenotype value the same way Population.fitness() does
+        sum_pheno = pheno_val_list.sum()
+        # and reverse it since we find the min
+        fit_list = 1 - (pheno_val_list / sum_pheno)
+
+        proportional_list = get_probability_list(fit_list)
+        return proportional_list, fit_list
+
+    def compute_identical_percentage(self):
+        '''compute identical individual percentage'''
+        identical_percentage = CGAStatistics.distinct_fraction(self.genomes)
+        return identical_percentage
+
+    def best(self, fit_list):
+        '''return the most fit object'''
+        index = int(np.argmax(fit_list))
+        bestOne = self.IndvClass.from_row(self.genomes[index], self.float_bit_len)
+        print('best one has value: ', bestOne.value)
+
+    def compute_diversity(self):
+        '''largest euclidian distance between two rows of the genome matrix, when diversity_pairs
+        is set only that many random pairs are compared and the result is a lower bound'''
+        words = CGADiversity.pack_genomes(self.genomes)
+        if self.diversity_pairs:
+            largest_distance, _ = CGADiversity.sampled_max_hamming(words, self.diversity_pairs)
+        else:
+            largest_distance = CGADiversity.max_pairwise_hamming(words)
+        # the euclidian distance of two bit strings is the square root of their hamming distance
+        return math.sqrt(largest_distance)
+
+
+def test():
+    print('now doing the test function')
+    # the matrix population has to score the same genomes the same way as the object one
+    genomes = (np.random.rand(20, 20) > 0.5).astype(np.uint8)
+    genomes[1] = genomes[0]
+    population = Population(20, 6, 20)
+    population.setIndividuals([Individual.from_row(row.copy(), 6) for row in genomes])
+    matrix_population = PopulationMatrix(20, 6, 20)
+    matrix_population.setGenomes(genomes)
+
+    proportional_list, fit_list = population.fitness()
+    matrix_proportional_list, matrix_fit_list = matrix_population.fitness()
+    assert np.allclose(fit_list, matrix_fit_list)
+    assert np.allclose(proportional_list, matrix_proportional_list)
+    assert population.compute_identical_percentage() == matrix_population.compute_identical_percentage()
+    print('matrix population fitness matches the object population')
+
+    # the dot product decoder gives the same values as the string decoder
+    var_bit_len = matrix_population.bit_len // 2
+    int_bit_len = var_bit_len - matrix_population.float_bit_len
+    values = matrix_population.decode()
+    for row, row_values in zip(genomes, values):
+        assert np.isclose(row_values[0], convert_bin_2_deci(list(row[:var_bit_len]), int_bit_len))
+        assert np.isclose(row_values[1], convert_bin_2_deci(list(row[var_bit_len:]), int_bit_len))
+    print('vectorized decoder matches convert_bin_2_deci')
+
+    # the hamming engine reports the same largest euclidian distance as comparing every pair
+    distances = np.linalg.norm(genomes[:, None, :].astype(np.float64) - genomes[None, :, :], axis=2)
+    assert np.isclose(population.compute_diversity(), distances.max())
+    assert np.isclose(matrix_population.compute_diversity(), distances.max())
+    matrix_population.diversity_pairs = 64
+    assert matrix_population.compute_diversity() <= distances.max()
+    print('hamming diversity matches the euclidian distance')
 
 
 if __name__ == "__main__":
-    pass
+    test()
@@ -0,0 +1,132 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import argparse
+import pdb
+
+import math
+import numpy as np
+
+'''
+Hamming-distance diversity of a bit-string population.
+
+The diversity trace is the largest distance between two genomes of the population. For 0/1
+genomes the euclidian distance is the square root of the hamming distance, so it is enough
+to find the largest hamming distance. Genomes are packed into uint64 words (gene j in bit
+(j % 64) of word (j // 64)), and the distance of two genomes is the popcount of their XOR.
+All pairs are compared block by block, so the memory stays bounded for any population size.
+
+For very large populations the pairs can be sampled instead:
+    # largest distance: the largest sampled distance is a lower bound, the number of loci on
+      which the population still carries both alleles is an upper bound, no two genomes can
+      differ anywhere else
+    # mean distance: the sampled mean with a Hoeffding half width, the true mean lies in
+      mean +- half_width with the given confidence
+'''
+
+WORD_BITS = 64
+# words of the XOR tensor of one block pair
+BLOCK_WORDS = 1 << 20
+DEFAULT_PAIRS = 4096
+_BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def pack_genomes(bits):
+    '''pack a (N, bit_len) 0/1 matrix into (N, ceil(bit_len/64)) uint64 words'''
+    bits = np.asarray(bits, dtype=np.uint8)
+    word_len = (bits.shape[1] + WORD_BITS - 1) // WORD_BITS
+    packed = np.packbits(bits, axis=1, bitorder='little')
+    padded = np.zeros((bits.shape[0], word_len * 8), dtype=np.uint8)
+    padded[:, :packed.shape[1]] = packed
+    return padded.view('<u8').astype(np.uint64)
+
+
+def popcount(words):
+    '''number of set bits along the last axis of a uint64 word array'''
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+    as_bytes = np.ascontiguousarray(words, dtype='<u8').view(np.uint8)
+    return _BYTE_POPCOUNT[as_bytes].sum(axis=-1, dtype=np.int64)
+
+
+def diverging_loci(words):
+    '''number of loci on which not all genomes carry the same allele'''
+    diverging = np.bitwise_or.reduce(words, axis=0) ^ np.bitwise_and.reduce(words, axis=0)
+    return int(popcount(diverging))
+
+
+def max_pairwise_hamming(words, block_words=BLOCK_WORDS):
+    '''exact largest hamming distance over all pairs of packed genomes, the XOR of two
+    blocks holds about block_words words'''
+    population_size, word_len = words.shape
+    if population_size < 2:
+        return 0
+    block_size = max(1, int(math.sqrt(block_words / word_len)))
+    upper_bound = diverging_loci(words)
+
+    largest_distance = 0
+    for i in range(0, population_size, block_size):
+        block_a = words[i:i + block_size]
+        for j in range(i, population_size, block_size):
+            block_b = words[j:j + block_size]
+            distance = popcount(block_a[:, None, :] ^ block_b[None, :, :]).max()
+            largest_distance = max(largest_distance, int(distance))
+            # no pair can beat the number of diverging loci
+            if largest_distance == upper_bound:
+                return largest_distance
+    return largest_distance
+
+
+def sample_pairs(population_size, pair_num):
+    '''pair_num random pairs of different genomes'''
+    index_a = np.random.randint(0, population_size, pair_num)
+    index_b = (index_a + np.random.randint(1, population_size, pair_num)) % population_size
+    return index_a, index_b
+
+
+def sampled_max_hamming(words, pair_num=DEFAULT_PAIRS):
+    '''lower and upper bound of the largest hamming distance from pair_num sampled pairs'''
+    if len(words) < 2:
+        return 0, 0
+    index_a, index_b = sample_pairs(len(words), pair_num)
+    lower_bound = int(popcount(words[index_a] ^ words[index_b]).max())
+    upper_bound = diverging_loci(words)
+    return lower_bound, upper_bound
+
+
+def sampled_mean_hamming(words, bit_len, pair_num=DEFAULT_PAIRS, confidence=0.95):
+    '''mean hamming distance of pair_num sampled pairs, and its Hoeffding half width'''
+    if len(words) < 2:
+        return 0.0, 0.0
+    index_a, index_b = sample_pairs(len(words), pair_num)
+    mean_distance = popcount(words[index_a] ^ words[index_b]).mean()
+    # every distance lies in [0, bit_len]
+    half_width = bit_len * math.sqrt(math.log(2 / (1 - confidence)) / (2 * pair_num))
+    return mean_distance, half_width
+
+
+def test():
+    print('now doing the test function')
+    for bit_len in [1, 20, 64, 65, 130]:
+        genomes = (np.random.rand(50, bit_len) > 0.5).astype(np.uint8)
+        words = pack_genomes(genomes)
+        brute_force = (genomes[:, None, :] != genomes[None, :, :]).sum(axis=2)
+        assert max_pairwise_hamming(words) == brute_force.max()
+
+        lower_bound, upper_bound = sampled_max_hamming(words, 256)
+        assert lower_bound <= brute_force.max() <= upper_bound
+        mean_distance, half_width = sampled_mean_hamming(words, bit_len, 256)
+        assert 0 <= mean_distance <= bit_len and half_width > 0
+
+    # small blocks have to visit every pair as well
+    genomes = np.zeros((37, 10), dtype=np.uint8)
+    genomes[36] = 1
+    assert max_pairwise_hamming(pack_genomes(genomes), block_words=4) == 10
+    assert max_pairwise_hamming(pack_genomes(genomes[:1])) == 0
+    assert sampled_max_hamming(pack_genomes(genomes[:36])) == (0, 0)
+    print('packed hamming distances match the brute force distances')
+
+
+if __name__ == "__main__":
+    test()
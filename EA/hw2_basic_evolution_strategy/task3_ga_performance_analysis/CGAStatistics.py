@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import argparse
+import pdb
+
+import collections
+import numpy as np
+
+'''
+Population statistics in O(N * L) per generation.
+
+Counting identical genomes by comparing every genome with every distinct one seen so far
+costs O(N^2 * L) and runs every generation only to print the status line. Here each genome
+row is packed into bytes and used as a hash key, so one pass over the population gives the
+number of distinct genomes and the share of the most common one. Per-locus allele frequencies
+are one column sum, and whether all genomes agree on a locus is an OR / AND reduction over
+the packed words, so the convergence check touches L/64 words per genome.
+
+Genomes are either a (N, L) matrix of 0/1 genes or a (N, ceil(L/64)) uint64 packed matrix
+with gene j in bit (j % 64) of word (j // 64), the packed padding bits must be zero.
+'''
+
+
+def is_packed(genomes):
+    return genomes.dtype == np.uint64
+
+
+def row_keys(genomes):
+    '''one bytes object per genome, equal genomes give equal keys'''
+    if is_packed(genomes):
+        rows = np.ascontiguousarray(genomes)
+    else:
+        rows = np.packbits(np.asarray(genomes, dtype=np.uint8), axis=1)
+    rows = rows.view(np.uint8).reshape(len(rows), -1)
+    return rows.view(np.dtype((np.void, rows.shape[1]))).ravel().tolist()
+
+
+def genome_counts(genomes):
+    '''number of copies of every distinct genome, counted with a hash of the row bytes'''
+    return collections.Counter(row_keys(genomes))
+
+
+def distinct_fraction(genomes):
+    '''number of distinct genomes over the population size'''
+    if 0 == len(genomes):
+        return 0.0
+    return len(genome_counts(genomes)) / len(genomes)
+
+
+def modal_share(genomes):
+    '''share of the population held by the most common genome'''
+    if 0 == len(genomes):
+        return 0.0
+    return max(genome_counts(genomes).values()) / len(genomes)
+
+
+def allele_frequencies(genomes, bit_len):
+    '''frequency of the allele 1 at every locus, length bit_len'''
+    if is_packed(genomes):
+        words = np.ascontiguousarray(genomes, dtype='<u8')
+        genomes = np.unpackbits(words.view(np.uint8), axis=1, bitorder='little')[:, :bit_len]
+    return genomes.sum(axis=0, dtype=np.int64) / len(genomes)
+
+
+def locus_convergence(genomes, bit_len, threshold=1.0):
+    '''fraction of loci on which at least threshold of the population carries the same allele'''
+    if threshold >= 1.0:
+        # every genome agrees on a locus exactly when its OR and AND over the population match
+        if is_packed(genomes):
+            words = genomes
+        else:
+            words = np.packbits(np.asarray(genomes, dtype=np.uint8), axis=1)
+        diverging = np.bitwise_or.reduce(words, axis=0) ^ np.bitwise_and.reduce(words, axis=0)
+        diverging_loci = np.unpackbits(np.ascontiguousarray(diverging).view(np.uint8)).sum()
+        return 1.0 - diverging_loci / bit_len
+
+    frequencies = allele_frequencies(genomes, bit_len)
+    majority = np.maximum(frequencies, 1.0 - frequencies)
+    return np.count_nonzero(majority >= threshold) / bit_len
+
+
+def summarize(genomes, bit_len, threshold=1.0):
+    '''distinct-genome fraction, modal-genome share and per-bit convergence in one pass over the rows'''
+    counts = genome_counts(genomes)
+    population_size = len(genomes)
+    return {
+        'distinct_fraction': len(counts) / population_size,
+        'modal_share': max(counts.values()) / population_size,
+        'converged_loci': locus_convergence(genomes, bit_len, threshold),
+    }
+
+
+def test():
+    print('now doing the test function')
+    for bit_len in [1, 7, 64, 65, 130]:
+        genomes = (np.random.rand(40, bit_len) > 0.5).astype(np.uint8)
+        genomes[1] = genomes[0]
+        genomes[2] = genomes[0]
+
+        # hash counting agrees with sorting out the unique rows
+        unique_rows, unique_counts = np.unique(genomes, axis=0, return_counts=True)
+        assert distinct_fraction(genomes) == len(unique_rows) / 40
+        assert modal_share(genomes) == unique_counts.max() / 40
+        assert np.allclose(allele_frequencies(genomes, bit_len), genomes.mean(axis=0))
+
+        # the uint64 packed layout gives the same numbers
+        packed = np.zeros((40, (bit_len + 63) // 64 * 8), dtype=np.uint8)
+        packed_bytes = np.packbits(genomes, axis=1, bitorder='little')
+        packed[:, :packed_bytes.shape[1]] = packed_bytes
+        packed = packed.view('<u8').astype(np.uint64)
+        assert summarize(packed, bit_len) == summarize(genomes, bit_len)
+        assert np.allclose(allele_frequencies(packed, bit_len), genomes.mean(axis=0))
+
+        # the OR / AND check counts the loci on which every genome agrees
+        agreeing = ((genomes == genomes[0]).all(axis=0)).sum() / bit_len
+        assert np.isclose(locus_convergence(genomes, bit_len), agreeing)
+        assert np.isclose(locus_convergence(packed, bit_len), agreeing)
+        assert locus_convergence(np.repeat(genomes[:1], 5, axis=0), bit_len) == 1.0
+
+    genomes = np.zeros((10, 4), dtype=np.uint8)
+    genomes[0, 0] = 1
+    assert locus_convergence(genomes, 4, threshold=0.9) == 1.0
+    assert locus_convergence(genomes, 4) == 0.75
+    print('population statistics match the brute force counts')
+
+
+if __name__ == "__main__":
+    test()
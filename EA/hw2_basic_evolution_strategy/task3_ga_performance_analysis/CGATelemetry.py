@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import argparse
+import pdb
+
+import time
+import numpy as np
+
+'''
+Per-generation telemetry of a run.
+
+Formatting and printing the runtime lines every generation slows long runs down, and
+keeping the traces in Python lists until the final np.savez loses all of them when the
+run dies. A Telemetry_Sink keeps one structured record per generation (generation, most
+fit, average fitness, identical percentage, diversity, wall time) in a preallocated NumPy
+array, and decides what else happens to it:
+    # print: print the runtime line of every generation, the behaviour of run() before
+    # quiet: only keep the records
+    # summary: keep the records and print one summary line at the end
+    # full: also append the records to a binary file, one chunk of chunk_size records at
+      a time, and print the summary line at the end
+
+The file is nothing but the records back to back, so it is readable with read_records()
+while the run is still writing it, and everything up to the last flushed chunk survives
+a crash.
+'''
+
+RECORD_DTYPE = np.dtype([('generation', '<i8'), ('most_fit', '<f8'), ('avg_fit', '<f8'),
+                         ('identical', '<f8'), ('diversity', '<f8'), ('wall_time', '<f8')])
+MODES = ['print', 'quiet', 'summary', 'full']
+CHUNK_SIZE = 256
+
+
+class Telemetry_Sink():
+    '''
+    # report: called with (generation, most fit, average fitness, identical percentage)
+      in print mode
+    # capacity: records allocated up front, the array doubles when a run goes past it
+    # records: records of the generations before a resumed run, the file is rewritten
+      with them and the wall time goes on from the last one
+    '''
+    def __init__(self, mode='print', file_path=None, report=None, capacity=1024, chunk_size=CHUNK_SIZE, records=None):
+        if mode not in MODES:
+            raise ValueError('unknown telemetry mode: {}'.format(mode))
+        if 'full' == mode and file_path is None:
+            raise ValueError('full telemetry needs a file path')
+        if 'print' == mode and report is None:
+            raise ValueError('print telemetry needs a report function')
+        self.mode = mode
+        self.file_path = file_path
+        self.report = report
+        self.chunk_size = chunk_size
+
+        self.records = np.zeros(max(1, capacity), dtype=RECORD_DTYPE)
+        self.size = 0
+        self.flushed = 0
+        self.start_time = time.perf_counter()
+        if records is not None and len(records):
+            self.records = np.concatenate([np.asarray(records, dtype=RECORD_DTYPE), self.records])
+            self.size = len(records)
+            self.start_time = self.start_time - records[-1]['wall_time']
+        self.file = open(file_path, 'wb') if 'full' == mode else None
+        self.flush()
+
+    def record(self, generation, most_fit, avg_fit, identical, diversity):
+        if self.size == len(self.records):
+            self.records = np.concatenate([self.records, np.zeros(len(self.records), dtype=RECORD_DTYPE)])
+        self.records[self.size] = (generation, most_fit, avg_fit, identical, diversity, time.perf_counter() - self.start_time)
+        self.size = self.size + 1
+
+        if self.report is not None and 'print' == self.mode:
+            self.report(generation, most_fit, avg_fit, identical)
+        if self.file is not None and self.size - self.flushed >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        '''append the records that are not in the file yet'''
+        if self.file is None:
+            return
+        self.records[self.flushed:self.size].tofile(self.file)
+        self.file.flush()
+        self.flushed = self.size
+
+    def close(self):
+        '''flush the last chunk, and print the summary line in summary and full mode'''
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.mode in ['summary', 'full']:
+            print_summary_line(self.history())
+
+    def history(self):
+        '''the records of the run so far'''
+        return self.records[:self.size]
+
+
+def print_summary_line(records):
+    if 0 == len(records):
+        print('<generations: 0>')
+        return
+    last = records[-1]
+    screen_line = '<generations: {}> <fitness score of the most fit member of the last generation: {:f}> <average fitness score: {:f}> <diversity: {:f}> <wall time: {:f}s>'.format(
+        len(records), last['most_fit'], last['avg_fit'], last['diversity'], last['wall_time'])
+    print(screen_line)
+
+
+def read_records(file_path):
+    '''memory mapped records of a telemetry file, a record still being written is left out'''
+    record_num = os.path.getsize(file_path) // RECORD_DTYPE.itemsize
+    if 0 == record_num:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(file_path, dtype=RECORD_DTYPE, mode='r', shape=(record_num,))
+
+
+def save_npz(records, save_path):
+    '''the records in the run_stat.npz layout plot_graph.py reads'''
+    np.savez(save_path, avg_data=np.asarray(records['avg_fit']), most_data=np.asarray(records['most_fit']),
+             div_data=np.asarray(records['diversity']))
+
+
+def test():
+    print('now doing the test function')
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, 'run_stat.telemetry')
+        sink = Telemetry_Sink('full', file_path, capacity=4, chunk_size=3)
+        for n in range(7):
+            sink.record(n, 1.0 / (n + 1), 2.0, 0.5, n * 0.1)
+            # only whole chunks reach the file while the run goes on
+            assert len(read_records(file_path)) == (n + 1) // 3 * 3
+
+        # a half written record is not read
+        with open(file_path, 'ab') as f:
+            f.write(b'\0' * 5)
+        assert len(read_records(file_path)) == 6
+        with open(file_path, 'r+b') as f:
+            f.truncate(6 * RECORD_DTYPE.itemsize)
+
+        sink.close()
+        records = read_records(file_path)
+        assert np.array_equal(records, sink.history()) and len(records) == 7
+        assert (np.diff(records['wall_time']) >= 0).all()
+
+        save_path = os.path.join(tmp_dir, 'run_stat.npz')
+        save_npz(records, save_path)
+        assert np.allclose(np.load(save_path)['div_data'], np.arange(7) * 0.1)
+        records = np.array(records)
+
+        # a resumed sink starts with the records of the interrupted run
+        sink = Telemetry_Sink('full', file_path, records=records[:4])
+        sink.record(4, 0.2, 2.0, 0.5, 0.4)
+        sink.close()
+        assert np.array_equal(read_records(file_path)['most_fit'], records['most_fit'][:5])
+        assert read_records(file_path)['wall_time'][4] >= records['wall_time'][3]
+    print('telemetry file is readable while the run writes it')
+
+    lines = []
+    sink = Telemetry_Sink('print', report=lambda *args: lines.append(args))
+    sink.record(0, 1.0, 2.0, 0.5, 0.1)
+    sink.close()
+    assert lines == [(0, 1.0, 2.0, 0.5)]
+    print('print mode reports every generation')
+
+
+if __name__ == "__main__":
+    test()
@@ -9,6 +9,9 @@ import matplotlib.pyplot as plt
 
 import es_component
 import es_strategy
+import es_sweep
+import es_parallel
+import es_checkpoint
 
 '''
 Recombination: Discrete or Intermediate as you see fit. On of the two must be present and you
@@ -77,8 +80,15 @@ def stopCondition(fit_score_list):
     return False
 
 
-def run_es(mu_size, lamda_size, mu_dev, c_rate, bit_len, generation_limit, DNA_RANGE):
-    '''run Evolution Strategy Algorithm for Himmelblau's function maximization problem'''
+def run_es(mu_size, lamda_size, mu_dev, c_rate, bit_len, generation_limit, DNA_RANGE, checkpoint_file=None,
+           checkpoint_interval=10, resume=False, workers=0, chunk_size=16):
+    '''run Evolution Strategy Algorithm for Himmelblau's function maximization problem
+    # checkpoint_file: save the state of the run there every checkpoint_interval generations
+    # resume: go on from the state in checkpoint_file, exactly where the saved run was
+    # workers: evaluate the offspring on a persistent pool of this many processes through
+      shared memory, 0 evaluates them in this process
+    # chunk_size: individuals a worker evaluates per task
+    '''
     p_name= 'Evolution Strategy for Himmelblaus\'s function'
     print_header_line(p_name, mu_size, lamda_size, mu_dev, c_rate)
 
@@ -89,43 +99,67 @@ def run_es(mu_size, lamda_size, mu_dev, c_rate, bit_len, generation_limit, DNA_R
     mutation = es_strategy.Mutation(learning_rate=mu_dev, bit_len=bit_len, DNA_RANGE=DNA_RANGE)
 
     # initialize population
-    population.initialize()
-
-    # solving process
-    best_fit_flag = False
+    first_generation = 0
     candidate_num_sum = 0
     avg_fitness_list, most_fit_score_list, diversity_list = [], [], []
-    for n in range(generation_limit):
-        # recombination, here we set parents num == 3
-        offspring = recombination.recombination(population, 3)
-
-        # mutation
-        population = mutation.mutation(offspring)
-
-        # evaluate
-        prob_list, fitness_list = population.fitness()
-        most_fit_score = min(fitness_list)
-        avg_fit_score = sum(fitness_list) / len(fitness_list)
-        diversity_score = population.diversity_score()
-
-        avg_fitness_list.append(avg_fit_score)
-        most_fit_score_list.append(most_fit_score)
-        diversity_list.append(diversity_score)
-
-        # print the runtime line
-        candidate_num_sum += len(fitness_list)
-        print_runtime_line(n, candidate_num_sum, most_fit_score, avg_fit_score, diversity_score)
-
-        # check stop condition, stop if most_fit_score did not change for 3 iters
-        if stopCondition(fitness_list):
-            best_fit_flag = True
-            break
-
-        # select
-        population = selection.select(prob_list, population)
+    if resume:
+        state = es_checkpoint.load_checkpoint(checkpoint_file)
+        if state['population'].population_size != mu_size:
+            raise ValueError('checkpoint holds {} parents, the run needs {}'.format(state['population'].population_size, mu_size))
+        population = state['population']
+        mutation.learning_rate = state['learning_rate']
+        candidate_num_sum = state['candidate_num_sum']
+        avg_fitness_list, most_fit_score_list, diversity_list = state['traces']
+        es_checkpoint.set_random_state(state)
+        first_generation = state['generation']
+        print('resume from generation {} of {}'.format(first_generation, checkpoint_file))
+    else:
+        population.initialize()
+    evaluator = None
+    if workers:
+        evaluator = es_parallel.Shared_Evaluator(es_component.rosenbrock_rows, bit_len, np.float64, workers, chunk_size, lamda_size)
 
-        # decrease learning rate
-        mutation.decrease_lr(n)
+    # solving process
+    best_fit_flag = False
+    try:
+        for n in range(first_generation, generation_limit):
+            # recombination, here we set parents num == 3
+            offspring = recombination.recombination(population, 3)
+
+            # mutation
+            population = mutation.mutation(offspring)
+
+            # evaluate
+            prob_list, fitness_list = population.fitness(evaluator)
+            most_fit_score = min(fitness_list)
+            avg_fit_score = sum(fitness_list) / len(fitness_list)
+            diversity_score = population.diversity_score()
+
+            avg_fitness_list.append(avg_fit_score)
+            most_fit_score_list.append(most_fit_score)
+            diversity_list.append(diversity_score)
+
+            # print the runtime line
+            candidate_num_sum += len(fitness_list)
+            print_runtime_line(n, candidate_num_sum, most_fit_score, avg_fit_score, diversity_score)
+
+            # check stop condition, stop if most_fit_score did not change for 3 iters
+            if stopCondition(fitness_list):
+                best_fit_flag = True
+                break
+
+            # select
+            population = selection.select(prob_list, population)
+
+            # decrease learning rate
+            mutation.decrease_lr(n)
+
+            if checkpoint_file is not None and (n + 1) % checkpoint_interval == 0:
+                es_checkpoint.save_checkpoint(checkpoint_file, n + 1, population, mutation.learning_rate, candidate_num_sum,
+                                              (avg_fitness_list, most_fit_score_list, diversity_list))
+    finally:
+        if evaluator is not None:
+            evaluator.close()
 
     # print termination line
     print_termination_line(best_fit_flag)
@@ -134,7 +168,7 @@ def run_es(mu_size, lamda_size, mu_dev, c_rate, bit_len, generation_limit, DNA_R
     return avg_fitness_list, most_fit_score_list, diversity_list
 
 
-def one_test(param):
+def one_test(param, checkpoint_file=None, checkpoint_interval=10, resume=False, workers=0, chunk_size=16):
     # setup parameters
     bit_len = 2    # Genome length
     mu_size = 30
@@ -144,7 +178,8 @@ def one_test(param):
     generation_limit = 100
     DNA_RANGE = [-5.12, 5.11]
 
-    avg_fitness_list, most_fitness_list, diversity_list = run_es(mu_size, lamda_size, mu_dev, c_rate, bit_len, generation_limit, DNA_RANGE)
+    avg_fitness_list, most_fitness_list, diversity_list = run_es(mu_size, lamda_size, mu_dev, c_rate, bit_len, generation_limit, DNA_RANGE,
+                                                                 checkpoint_file, checkpoint_interval, resume, workers, chunk_size)
 
     if min(most_fitness_list) < 0.2:
         flag = True
@@ -180,27 +215,22 @@ def find_highest(tuple_list):
 
 
 def tune_params(opts):
-    '''tuning the params and plot a graph at last'''
-    params = []
-    param_with_success_rate = []
+    '''tuning the params over a process pool, 10 seeded runs per lamda size, and plot a graph at last'''
     params = np.arange(30, 150, 30)
-    for param in params:
-        count, success = 0, 0
-        for i in range(10):
-            flag = one_test(param)
-            count += 1
-            if flag:
-                success += 1
-
-        success_rate = success / count
-        print('The success rate for the ES is: {}'.format(success_rate))
-        tmp_tuple = (30/param, success_rate)
-        param_with_success_rate.append(tmp_tuple)
+    os.makedirs(opts.output, exist_ok=True)
+    table, entropy = es_sweep.run_sweep(one_test, params, 10, seed=opts.seed, processes=opts.jobs or None,
+                                        quiet=not opts.verbose, file_path=os.path.join(opts.output, 'sweep_results.csv'),
+                                        on_result=es_sweep.print_result_line)
+    print('sweep seed: {}'.format(entropy))
+
+    param_with_success_rate = []
+    for param, success_rate in table.success_rates():
+        print('The success rate for the ES with lamda size {} is: {}'.format(param, success_rate))
+        param_with_success_rate.append((30/param, success_rate))
 
     highest_param, highest_success_rate = find_highest(param_with_success_rate)
-    print('The highest success rate is: {:f}, the corresponding params is: {}'.format(success_rate, highest_param))
+    print('The highest success rate is: {:f}, the corresponding params is: {}'.format(highest_success_rate, highest_param))
 
-    os.makedirs(opts.output, exist_ok=True)
     file2save = os.path.join(opts.output, 'utility_performance.jpg')
     plot_graph(param_with_success_rate, file2save)
 
@@ -209,6 +239,14 @@ def parserArgs(argv):
     parser = argparse.ArgumentParser()
     parser.add_argument('-t', '--tune', action='store_true', help='')
     parser.add_argument('-o', '--output', default='resDir', help='')
+    parser.add_argument('-j', '--jobs', type=int, default=0, help='worker processes of the tuning sweep, 0 for one per core')
+    parser.add_argument('--seed', type=int, default=None, help='entropy of the tuning sweep, printed at the end of every sweep')
+    parser.add_argument('-v', '--verbose', action='store_true', help='keep the output of every tuning run')
+    parser.add_argument('--checkpoint', nargs='?', const='', default=None, help='save the state of the run to this file, es.ckpt.npz next to this script without one')
+    parser.add_argument('--checkpoint-interval', type=int, default=10, help='generations between two checkpoints')
+    parser.add_argument('--resume', action='store_true', help='go on from the checkpoint of an interrupted run')
+    parser.add_argument('-w', '--workers', type=int, default=0, help='processes evaluating the offspring through shared memory, 0 evaluates serially')
+    parser.add_argument('--chunk-size', type=int, default=16, help='individuals per task of the evaluation workers')
     opts = parser.parse_args()
     return opts
 
@@ -218,4 +256,7 @@ if __name__ == "__main__":
     if opts.tune:
         tune_params(opts)
     else:
-        one_test(120)
+        checkpoint_file = opts.checkpoint
+        if '' == checkpoint_file or (opts.resume and checkpoint_file is None):
+            checkpoint_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'es.ckpt.npz')
+        one_test(120, checkpoint_file, opts.checkpoint_interval, opts.resume, opts.workers, opts.chunk_size)
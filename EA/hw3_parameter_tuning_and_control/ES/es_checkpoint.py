@@ -0,0 +1,110 @@
+#!/usr/bin python3.6
+import os
+import sys
+import argparse
+import pdb
+
+import random
+import numpy as np
+
+import es_component
+
+'''
+Checkpoints of an Evolution Strategy run.
+
+The state of run_es() between two generations is the parent population, with the genes and
+the mutation step sizes of every individual, the learning rate of the mutation, which
+decays as the run goes on, the candidate evaluations so far, the traces for the plots and
+the state of both random generators; recombination draws from random, mutation from
+numpy.random. With all of it restored the resumed run draws the same numbers in the same
+order as the interrupted one.
+
+The state goes to one .npz, written to a temporary file first and moved over the old
+checkpoint with os.replace(), so a crash while saving never leaves half a checkpoint.
+'''
+
+
+def random_state():
+    '''state of numpy.random and random as arrays'''
+    _, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    version, internal_state, gauss_next = random.getstate()
+    return dict(np_keys=keys, np_pos=pos, np_has_gauss=has_gauss, np_cached_gaussian=cached_gaussian,
+                py_version=version, py_state=np.array(internal_state, dtype=np.uint64),
+                py_gauss_next=np.nan if gauss_next is None else gauss_next)
+
+
+def set_random_state(state):
+    np.random.set_state(('MT19937', state['np_keys'], int(state['np_pos']), int(state['np_has_gauss']),
+                         float(state['np_cached_gaussian'])))
+    gauss_next = float(state['py_gauss_next'])
+    random.setstate((int(state['py_version']), tuple(int(i) for i in state['py_state']),
+                     None if np.isnan(gauss_next) else gauss_next))
+
+
+def save_checkpoint(file_path, generation, population, learning_rate, candidate_num_sum, traces):
+    '''
+    # generation: number of the next generation
+    # traces: (average fitness, most fit, diversity) lists of the generations before it
+    '''
+    individuals = population.individuals
+    arrays = random_state()
+    arrays.update(generation=generation, learning_rate=learning_rate, candidate_num_sum=candidate_num_sum,
+                  genes=np.array([individual.gene for individual in individuals]),
+                  mutations=np.array([individual.mutations for individual in individuals]),
+                  avg_fitness=np.array(traces[0], dtype=np.float64), most_fit=np.array(traces[1], dtype=np.float64),
+                  diversity=np.array(traces[2], dtype=np.float64))
+
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+
+def load_checkpoint(file_path):
+    '''dict of the saved arrays, population holds the parents rebuilt from them'''
+    with np.load(file_path) as data:
+        state = {name: data[name] for name in data.files}
+    genes, mutations = state['genes'], state['mutations']
+    individuals = []
+    for gene, mutation in zip(genes, mutations):
+        individual = es_component.Individual(genes.shape[1], doInitialize=False)
+        individual.set_individual(gene.copy(), mutation.copy())
+        individuals.append(individual)
+    population = es_component.Population(genes.shape[1], len(individuals))
+    population.setIndividuals(individuals)
+
+    state['population'] = population
+    state['generation'] = int(state['generation'])
+    state['learning_rate'] = float(state['learning_rate'])
+    state['candidate_num_sum'] = int(state['candidate_num_sum'])
+    state['traces'] = (list(state['avg_fitness']), list(state['most_fit']), list(state['diversity']))
+    return state
+
+
+def test():
+    print('now doing the test function')
+    import tempfile
+    population = es_component.Population(2, 5)
+    population.initialize()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, 'es.ckpt.npz')
+        save_checkpoint(file_path, 7, population, 0.125, 700, ([3.0, 2.0], [1.0, 0.5], [4.0, 3.0]))
+        expected = (np.random.normal(size=3), random.sample(range(100), 5))
+
+        np.random.seed(0)
+        random.seed(0)
+        state = load_checkpoint(file_path)
+        set_random_state(state)
+        assert (np.random.normal(size=3) == expected[0]).all() and random.sample(range(100), 5) == expected[1]
+        assert state['generation'] == 7 and state['learning_rate'] == 0.125 and state['candidate_num_sum'] == 700
+        assert state['traces'] == ([3.0, 2.0], [1.0, 0.5], [4.0, 3.0])
+        for restored, individual in zip(state['population'].individuals, population.individuals):
+            assert (restored.gene == individual.gene).all() and (restored.mutations == individual.mutations).all()
+        assert not os.path.exists(file_path + '.tmp')
+    print('checkpoint restores the parents, the learning rate and the random state')
+
+
+if __name__ == '__main__':
+    test()
@@ -28,6 +28,13 @@ and y in the range of [-10.0, ... , 10.0]
 '''
 
 
+def rosenbrock_rows(genes):
+    '''phenotype of every row of a (N, 2) gene matrix, the value calculate_phenotype() gives,
+    a module level function so that es_parallel workers can be handed it'''
+    x, y = genes[:, 0], genes[:, 1]
+    return (1 - x)**2 + 100*(y - x**2)**2
+
+
 class Individual():
     def __init__(self, bit_len, doInitialize=True):
         # set representation format
@@ -89,21 +96,24 @@ class Population():
         tmp_list = [IndvClass(self.bit_len) for i in range(self.population_size)]
         self.individuals = np.array(tmp_list, dtype=IndvClass)
 
-    def fitness(self):
+    def fitness(self, evaluator=None):
         '''calculate fitness score for the whole population
         # Selection Method:
             In this assignment, we will use the ranking selection, and we are trying
             to minimize the given problem, so we want the phenotype value to be small.
+        # evaluator: optional es_parallel.Shared_Evaluator, evaluates the gene matrix of
+          the population on its worker pool instead of in this process
+        # both ways run rosenbrock_rows() over the gene matrix, so they give the same values
+          to the last bit
         '''
         # evaluation function
         if 0 == self.individuals.size:
             raise ValueError('individuals has not been set')
 
         # calculate phenotype
-        pheno_val_list = []
-        for indv in self.individuals:
-            tmp_pheno_score = indv.calculate_phenotype()
-            pheno_val_list.append(tmp_pheno_score)
+        evaluate = rosenbrock_rows if evaluator is None else evaluator
+        pheno_val_list = list(evaluate(np.array([indv.gene for indv in self.individuals])))
+        for indv, tmp_pheno_score in zip(self.individuals, pheno_val_list):
             indv.fitness = tmp_pheno_score
 
         # calculate ranking and then use the ranking to get the fitness
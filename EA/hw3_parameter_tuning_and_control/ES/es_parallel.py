@@ -0,0 +1,132 @@
+#!/usr/bin python3.6
+import os
+import sys
+import argparse
+import pdb
+
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+import es_component
+
+'''
+Shared memory parallel evaluation.
+
+Evaluating the offspring one individual after the other is fine for Rosenbrock, not for
+an objective that runs a simulation for milliseconds. A Shared_Evaluator keeps a persistent
+pool of worker processes and two multiprocessing.shared_memory blocks: the gene matrix,
+written by the parent before every call, and a float64 result vector the workers write
+into. Both are attached once, when a worker starts, so a call only sends the (start, stop)
+row bounds of every chunk to the workers; no gene and no individual is ever pickled.
+
+evaluate is called with a (rows, bit_len) slice of the gene matrix and returns the
+phenotype of every row. It is pickled once per worker, at start up, so it has to be a
+module level function, or a functools.partial of one.
+
+The blocks grow when a call has more rows than they hold, the pool is started again then
+to attach the new ones.
+'''
+
+# state of a worker process, set by attach()
+worker_state = {}
+
+
+def attach(evaluate, genome_name, result_name, shape, dtype):
+    '''pool initializer, maps both shared blocks into the worker'''
+    genome_block = shared_memory.SharedMemory(name=genome_name)
+    result_block = shared_memory.SharedMemory(name=result_name)
+    worker_state.update(evaluate=evaluate, blocks=(genome_block, result_block),
+                        genomes=np.ndarray(shape, dtype=dtype, buffer=genome_block.buf),
+                        results=np.ndarray(shape[0], dtype=np.float64, buffer=result_block.buf))
+
+
+def evaluate_chunk(bounds):
+    '''evaluate the rows [start, stop) of the shared genomes into the shared results'''
+    start, stop = bounds
+    worker_state['results'][start:stop] = worker_state['evaluate'](worker_state['genomes'][start:stop])
+
+
+class Shared_Evaluator():
+    '''
+    # evaluate: module level function from a gene matrix to its phenotypes
+    # width: genes per individual, dtype: gene dtype
+    # worker_num: processes of the pool, all cores when None
+    # chunk_size: rows per task, small chunks balance uneven evaluation times, large ones
+      cost less dispatching
+    # capacity: rows the shared blocks hold at first
+    '''
+    def __init__(self, evaluate, width, dtype=np.float64, worker_num=None, chunk_size=16, capacity=256):
+        self.evaluate = evaluate
+        self.width = width
+        self.dtype = np.dtype(dtype)
+        self.worker_num = worker_num or os.cpu_count()
+        self.chunk_size = chunk_size
+
+        self.pool = None
+        self.blocks = None
+        self.allocate(capacity)
+
+    def allocate(self, capacity):
+        '''shared blocks of capacity rows, and a pool attached to them'''
+        self.close()
+        self.capacity = capacity
+        self.blocks = (shared_memory.SharedMemory(create=True, size=max(1, capacity * self.width * self.dtype.itemsize)),
+                       shared_memory.SharedMemory(create=True, size=max(1, capacity * 8)))
+        shape = (capacity, self.width)
+        self.genomes = np.ndarray(shape, dtype=self.dtype, buffer=self.blocks[0].buf)
+        self.results = np.ndarray(capacity, dtype=np.float64, buffer=self.blocks[1].buf)
+        self.pool = multiprocessing.Pool(self.worker_num, initializer=attach,
+                                         initargs=(self.evaluate, self.blocks[0].name, self.blocks[1].name, shape, self.dtype))
+
+    def __call__(self, genomes):
+        '''phenotype of every row of a gene matrix, evaluated by the pool'''
+        row_num = len(genomes)
+        if row_num > self.capacity:
+            self.allocate(max(row_num, 2 * self.capacity))
+        self.genomes[:row_num] = genomes
+
+        bounds = [(start, min(row_num, start + self.chunk_size)) for start in range(0, row_num, self.chunk_size)]
+        self.pool.map(evaluate_chunk, bounds, chunksize=1)
+        return self.results[:row_num].copy()
+
+    def close(self):
+        '''stop the pool and free the shared blocks'''
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.blocks is not None:
+            # the arrays on the blocks have to go before the blocks can be closed
+            self.genomes = self.results = None
+            for block in self.blocks:
+                block.close()
+                block.unlink()
+            self.blocks = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def test():
+    print('now doing the test function')
+    np.random.seed(5)
+    population = es_component.Population(2, 50)
+    population.initialize()
+    _, serial_list = population.fitness()
+    with Shared_Evaluator(es_component.rosenbrock_rows, 2, worker_num=2, chunk_size=7, capacity=20) as evaluator:
+        # more rows than the blocks hold, they grow and the pool attaches the new ones
+        _, parallel_list = population.fitness(evaluator)
+        assert parallel_list == serial_list and evaluator.capacity >= 50
+        pool = evaluator.pool
+        population.fitness(evaluator)
+        assert evaluator.pool is pool
+    assert evaluator.pool is None and evaluator.blocks is None
+    print('shared evaluator matches the serial evaluation')
+
+
+if __name__ == '__main__':
+    test()
@@ -55,12 +55,12 @@ class Mutation():
             individual = copy.deepcopy(population[p])
             for i in range(self.bit_len):
                 # mutate the mutation parameters first
-                standard_norm = np.random.normal(0, 1, 1)
+                standard_norm = np.random.normal(0, 1)
                 mutation_new = individual.mutations[i] * math.exp(self.learning_rate * standard_norm)
                 individual.mutations[i] = mutation_new
 
                 # mutate the allele based on new mutation allele
-                standard_norm = np.random.normal(0, 1, 1)
+                standard_norm = np.random.normal(0, 1)
                 tmp = individual.gene[i] + mutation_new * standard_norm
                 individual.gene[i] = np.clip(tmp, *self.DNA_RANGE)
             new_population.append(individual)
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import argparse
+import pdb
+
+import random
+import contextlib
+import multiprocessing
+import numpy as np
+
+'''
+Parallel, reproducible parameter sweeps.
+
+A sweep runs a job once for every (param, repeat) pair of a grid. The jobs are fanned out
+across a process pool and their results stream into a Sweep_Table as they finish, in
+whatever order the workers complete them.
+
+Every job gets its own child of one numpy SeedSequence, in grid order, and seeds both
+numpy.random and random from it before it starts. A job therefore gives the same result
+whichever worker runs it and whatever else runs at the same time, and the whole sweep is
+reproduced by passing the entropy it printed as seed.
+
+The runs print a header and a line per generation, which only slows a sweep down, so the
+stdout of the jobs is sent to os.devnull unless quiet is turned off.
+'''
+
+
+class Sweep_Table():
+    '''results of a sweep, one row per param and one column per repeat, NaN until the job finishes
+    every finished job is also appended to the csv file at file_path'''
+    def __init__(self, params, repeats, file_path=None):
+        self.params = list(params)
+        self.repeats = repeats
+        self.results = np.full((len(self.params), repeats), np.nan)
+        self.file_path = file_path
+        if file_path is not None:
+            with open(file_path, 'w') as f:
+                f.write('param,repeat,result\n')
+
+    def add(self, param_index, repeat, result):
+        '''record one finished job, return True when it was the last repeat of its param'''
+        self.results[param_index, repeat] = float(result)
+        if self.file_path is not None:
+            with open(self.file_path, 'a') as f:
+                f.write('{},{},{}\n'.format(self.params[param_index], repeat, float(result)))
+        return not np.isnan(self.results[param_index]).any()
+
+    def done_num(self):
+        return int(np.count_nonzero(~np.isnan(self.results)))
+
+    def mean(self, param_index):
+        return np.nanmean(self.results[param_index])
+
+    def success_rates(self):
+        '''(param, mean result) of every param whose repeats all finished, in grid order'''
+        return [(param, self.mean(i)) for i, param in enumerate(self.params) if not np.isnan(self.results[i]).any()]
+
+
+def run_job(job, param_index, param, repeat, seed_seq, quiet=True):
+    '''run one job with the random state of its own seed'''
+    state = seed_seq.generate_state(2)
+    np.random.seed(state[0])
+    random.seed(int(state[1]))
+    if quiet:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            result = job(param)
+    else:
+        result = job(param)
+    return param_index, repeat, result
+
+
+def _run_job(args):
+    return run_job(*args)
+
+
+def run_sweep(job, params, repeats, seed=None, processes=None, quiet=True, file_path=None, on_result=None):
+    '''
+    # job: picklable callable taking one param, its result has to convert to float
+    # processes: pool size, None for one worker per core, 1 runs every job in this process
+    # on_result: called with (table, param_index, repeat, result, param finished) as each job finishes
+    return the filled Sweep_Table and the entropy that reproduces the sweep
+    '''
+    seed_seq = np.random.SeedSequence(seed)
+    table = Sweep_Table(params, repeats, file_path)
+    grid = [(i, param, repeat) for i, param in enumerate(table.params) for repeat in range(repeats)]
+    jobs = [(job, i, param, repeat, child, quiet) for (i, param, repeat), child in zip(grid, seed_seq.spawn(len(grid)))]
+
+    def collect(finished):
+        for param_index, repeat, result in finished:
+            param_finished = table.add(param_index, repeat, result)
+            if on_result is not None:
+                on_result(table, param_index, repeat, result, param_finished)
+
+    if processes == 1:
+        collect(_run_job(args) for args in jobs)
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            collect(pool.imap_unordered(_run_job, jobs))
+    return table, seed_seq.entropy
+
+
+def print_result_line(table, param_index, repeat, result, param_finished):
+    '''default streaming output of a sweep'''
+    screen_line = '<param: {}> <repeat: {}> <result: {}> <finished jobs: {}/{}>'.format(
+        table.params[param_index], repeat, result, table.done_num(), table.results.size)
+    if param_finished:
+        screen_line += ' <mean result of the param: {:f}>'.format(table.mean(param_index))
+    print(screen_line, flush=True)
+
+
+def _random_job(param):
+    return param + np.random.rand() + random.random()
+
+
+def test():
+    print('now doing the test function')
+    # the same seed gives the same table, serial or pooled, whatever the finishing order
+    table, entropy = run_sweep(_random_job, [1, 2, 3], 4, seed=7, processes=1)
+    pooled_table, pooled_entropy = run_sweep(_random_job, [1, 2, 3], 4, seed=7, processes=2)
+    assert entropy == pooled_entropy == 7
+    assert (table.results.shape == (3, 4)) and not np.isnan(table.results).any()
+    assert np.array_equal(table.results, pooled_table.results)
+    assert len(np.unique(table.results)) == table.results.size
+    assert [param for param, _ in table.success_rates()] == [1, 2, 3]
+
+    other_table, _ = run_sweep(_random_job, [1, 2, 3], 4, seed=8, processes=1)
+    assert not np.array_equal(table.results, other_table.results)
+    print('sweep results are reproducible from the seed')
+
+
+if __name__ == "__main__":
+    test()
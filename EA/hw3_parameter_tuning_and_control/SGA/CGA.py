@@ -9,10 +9,18 @@ import random
 import math
 import numpy as np
 import copy
+import functools
 import matplotlib.pyplot as plt
 
 import CGAComponents
 import CGAOperator
+import CGAStatistics
+import CGALandscape
+import CGASweep
+import CGABatch
+import CGARace
+import CGAProfile
+import CGAParallel
 
 '''
 Canonical Genetic Algorithm (CGA)
@@ -65,6 +73,13 @@ def print_runtime_line(gen_num, most_fit_score, avg_fit_score, identical_percent
     print(screen_line)
 
 
+def print_statistics_line(statistics):
+    # <distinct genome fraction> <share of the most common genome> <fraction of loci every genome agrees on>
+    screen_line = '<distinct genome fraction: {:f}> <modal genome share: {:f}> <converged loci: {:f}>'.format(
+        statistics['distinct_fraction'], statistics['modal_share'], statistics['converged_loci'])
+    print(screen_line)
+
+
 def print_termination_line(best_fit_flag):
     if best_fit_flag:
         termination_reason = 'population has converaged'
@@ -73,6 +88,11 @@ def print_termination_line(best_fit_flag):
     print('termination reason is: {}'.format(termination_reason))
 
 
+def print_cache_line(cache):
+    screen_line = '<fitness cache hits: {}> <misses: {}> <hit rate: {:f}>'.format(cache.hits, cache.misses, cache.hit_rate())
+    print(screen_line)
+
+
 def stopCondition(fitness_score_list):
     # stop the algorithm if there is one individual's fitness socore is
     # equal to 1 or the total iteration number is greater than countlimit
@@ -82,45 +102,138 @@ def stopCondition(fitness_score_list):
     return False
 
 
-def run(population_size, bit_len, mu_rate, c_rate, generation_limit, float_bit_len, qname):
-    '''run Canonical Genetic Algorithm for rosen brock minimization problem'''
+def run(population_size, bit_len, mu_rate, c_rate, generation_limit, float_bit_len, qname, matrix=False,
+        select_method='roulette', double_buffer=False, crossover_method='one_point', n_vars=2,
+        landscape=False, landscape_bit_limit=CGALandscape.DEFAULT_BIT_LIMIT, cache_size=0,
+        stats=False, profile=False, profile_capture=None, profile_window=(0, 10), workers=0, chunk_size=16):
+    '''run Canonical Genetic Algorithm for rosen brock minimization problem
+    # matrix: keep the population in one (population_size, bit_len) uint8 matrix
+      instead of one Individual object per genome
+    # select_method: parent selection, one of CGAOperator.SELECTIONS
+    # double_buffer: run selection, crossover and mutation through two preallocated
+      genome buffers instead of building new populations, implies matrix
+    # crossover_method: one of CGAOperator.CROSSOVER_METHODS, all but one_point need
+      a matrix population
+    # n_vars: number of variables the genome is split into, more than two need a
+      matrix population
+    # landscape: look the phenotype up in a precomputed table of every genome when
+      bit_len is at most landscape_bit_limit, implies matrix
+    # cache_size: keep the phenotype of up to cache_size distinct genomes in an LRU
+      cache, 0 turns it off, implies matrix
+    # stats: also print the modal genome share and the per-locus convergence every
+      generation, implies matrix
+    # profile: time every stage of the generation loop and print a summary table at
+      the end, without it nothing is timed
+    # profile_capture: also run one of CGAProfile.CAPTURES over the generations in
+      profile_window, (first, last) with last excluded
+    # workers: evaluate the genomes on a persistent pool of this many processes through
+      shared memory, 0 evaluates in this process, implies matrix
+    # chunk_size: genomes a worker evaluates per task
+    '''
     print_header_line(qname, population_size, bit_len, mu_rate, c_rate)
 
     # setup all objects
-    population = CGAComponents.Population(bit_len, float_bit_len, population_size)
-    selection = CGAOperator.Roulette_Wheel_Selection(bit_len)
-    crossover = CGAOperator.Crossover(c_rate, bit_len, float_bit_len)
+    if matrix or double_buffer or landscape or cache_size or stats or workers:
+        population = CGAComponents.PopulationMatrix(bit_len, float_bit_len, population_size, n_vars)
+    elif n_vars != 2:
+        raise ValueError('{} variables need a matrix population'.format(n_vars))
+    else:
+        population = CGAComponents.Population(bit_len, float_bit_len, population_size)
+    selection = CGAOperator.SELECTIONS[select_method](bit_len)
+    crossover = CGAOperator.Crossover(c_rate, bit_len, float_bit_len, crossover_method)
     mutation = CGAOperator.Mutation(mu_rate)
 
+    if landscape:
+        population.landscape = CGALandscape.get_table(bit_len, float_bit_len, n_vars, landscape_bit_limit)
+    evaluator = None
+    if workers:
+        evaluate_rows = functools.partial(CGAComponents.evaluate_rows, n_vars=n_vars, weights=population.weights)
+        evaluator = CGAParallel.Shared_Evaluator(evaluate_rows, bit_len, np.uint8, workers, chunk_size, population_size)
+        population.evaluator = evaluator
+    if cache_size:
+        population.cache = CGAComponents.FitnessCache(population.evaluate, cache_size)
+
     # initialize population
     population.initialize()
+    pipeline = None
+    if double_buffer:
+        pipeline = CGAOperator.Generation_Pipeline(selection, crossover, mutation, population)
+
+    # the population object may change every generation, so its methods are called
+    # through the class, the operators stay the same and are instrumented in place
+    evaluate = type(population).fitness
+    identical = type(population).compute_identical_percentage
+    summarize = CGAStatistics.summarize
+    print_runtime = print_runtime_line
+    profiler = None
+    if profile or profile_capture:
+        profiler = CGAProfile.Stage_Profiler(capture=profile_capture, window=profile_window)
+        evaluate = profiler.wrap('evaluate', evaluate)
+        identical = profiler.wrap('identical', identical)
+        summarize = profiler.wrap('statistics', summarize)
+        print_runtime = profiler.wrap('print', print_runtime)
+        if pipeline is not None:
+            profiler.instrument(selection, 'select_indices', 'select')
+            profiler.instrument(crossover, 'crossover_into', 'crossover')
+            profiler.instrument(mutation, 'mutation_inplace', 'mutation')
+        else:
+            profiler.instrument(selection, 'select', 'select')
+            profiler.instrument(crossover, 'crossover', 'crossover')
+            profiler.instrument(mutation, 'mutation', 'mutation')
 
     # solving process
     best_fit_flag = False
-    for n in range(generation_limit):
-        # evaluate
-        proportional_list, fitness_list = population.fitness()
-        most_fit_score = max(fitness_list)
-        avg_fit_score = sum(fitness_list) / len(fitness_list)
-        identical_percentage = population.compute_identical_percentage()
-        print_runtime_line(n, most_fit_score, avg_fit_score, identical_percentage)
-
-        # check stop condition
-        if stopCondition(fitness_list):
-            best_fit_flag = True
-            break
-
-        # select
-        parents = selection.select(proportional_list, population)
-
-        # crossover
-        offspring = crossover.crossover(parents)
-
-        # mutation
-        population = mutation.mutation(offspring)
+    try:
+        for n in range(generation_limit):
+            if profiler is not None:
+                profiler.generation(n)
+
+            # evaluate
+            proportional_list, fitness_list = evaluate(population)
+            most_fit_score = np.max(fitness_list)
+            avg_fit_score = np.mean(fitness_list)
+            identical_percentage = identical(population)
+            print_runtime(n, most_fit_score, avg_fit_score, identical_percentage)
+            if stats:
+                print_statistics_line(summarize(population.genomes, bit_len))
+
+            # check stop condition
+            if stopCondition(fitness_list):
+                best_fit_flag = True
+                break
+
+            # ranked selections pick from the fitness scores, not from the wheel
+            selection_weights = fitness_list if selection.ranked else proportional_list
+
+            if pipeline is not None:
+                # select, crossover and mutation into the back buffer, then swap
+                population = pipeline.step(selection_weights)
+            else:
+                # select
+                parents = selection.select(selection_weights, population)
+
+                # crossover
+                offspring = crossover.crossover(parents)
+
+                # mutation
+                population = mutation.mutation(offspring)
+    finally:
+        if evaluator is not None:
+            evaluator.close()
 
     # print termination line
     print_termination_line(best_fit_flag)
+    if cache_size:
+        print_cache_line(population.cache)
+    if profiler is not None:
+        profiler.finish()
+        profiler.count('generations', n + 1)
+        if cache_size:
+            profiler.count('evaluations', population.cache.misses)
+            profiler.count('cache hits', population.cache.hits)
+        else:
+            profiler.count('evaluations', profiler.calls['evaluate'] * population_size)
+        CGAProfile.print_summary(profiler)
 
     if most_fit_score < 0.2:
         return True
@@ -128,11 +241,23 @@ def run(population_size, bit_len, mu_rate, c_rate, generation_limit, float_bit_l
         return False
 
 
-def one_test(param):
+def run_options(opts):
+    '''keyword arguments of run() picked from the command line options'''
+    if opts is None:
+        return {}
+    return dict(matrix=opts.matrix, select_method=opts.selection, double_buffer=opts.double_buffer,
+                crossover_method=opts.crossover, n_vars=opts.n_vars, landscape=opts.landscape,
+                landscape_bit_limit=opts.landscape_bit_limit, cache_size=opts.cache_size,
+                stats=opts.stats, profile=opts.profile, profile_capture=opts.profile_capture,
+                profile_window=tuple(opts.profile_window), workers=opts.workers, chunk_size=opts.chunk_size)
+
+
+def one_test(param, opts=None, c_rate=0.5):
     # setup parameters
-    bit_len = 16    # Total Genome length, two variables, each have 8 bit, 1 for sign bit, 3 for integer, 4 for float point
+    run_kwargs = run_options(opts)
+    bit_len = 8 * run_kwargs.get('n_vars', 2)    # Total Genome length, two variables by default, each have 8 bit, 1 for sign bit, 3 for integer, 4 for float point
     population_size = 64
-    c_rate = 0.5    # crossover rate
+    # c_rate: crossover rate
     # mu_rate = 0.01   # mutation rate
     mu_rate = param
     generation_limit = 150
@@ -144,13 +269,43 @@ def one_test(param):
     float_bit_len = 4
 
     qname = 'DeJong\'s_Test_Suite_Function_2'
-    flag = run(population_size, bit_len, mu_rate, c_rate, generation_limit, float_bit_len, qname)
+    flag = run(population_size, bit_len, mu_rate, c_rate, generation_limit, float_bit_len, qname, **run_kwargs)
 
     print('CGA run finished!')
 
     return flag
 
 
+def batch_success(mu_rates, c_rates, opts=None):
+    '''success flag of one run per entry of mu_rates and c_rates, all evolved as one
+    replicate batch with the settings of one_test()'''
+    run_kwargs = run_options(opts)
+    n_vars = run_kwargs.get('n_vars', 2)
+    bit_len = 8 * n_vars
+    population_size = 64
+    generation_limit = 150
+    float_bit_len = 4
+
+    return CGABatch.run_replicates(len(mu_rates), population_size, bit_len, mu_rates, c_rates, generation_limit, float_bit_len, n_vars,
+                                   select_method=run_kwargs.get('select_method', 'roulette'),
+                                   crossover_method=run_kwargs.get('crossover_method', 'one_point'),
+                                   landscape=run_kwargs.get('landscape', False),
+                                   landscape_bit_limit=run_kwargs.get('landscape_bit_limit', CGALandscape.DEFAULT_BIT_LIMIT))
+
+
+def one_test_batch(params, repeats, opts=None):
+    '''success rate of every mutation rate in params, all repeats of all rates in one replicate batch'''
+    # replicate row i * repeats + j is repeat j of params[i]
+    success = batch_success(np.repeat(params, repeats), 0.5, opts)
+    success_rates = success.reshape(len(params), repeats).mean(axis=1)
+    return list(zip(params, success_rates))
+
+
+def race_test(candidate, opts=None):
+    '''one_test() of a (mutation rate,) or (mutation rate, crossover rate) candidate'''
+    return one_test(candidate[0], opts, *candidate[1:])
+
+
 def plot_graph(param_with_success_rate, file_path):
     '''rendering the graph with the given data'''
     x, y = [], []
@@ -176,41 +331,97 @@ def find_highest(tuple_list):
 
 
 def tune_params(opts):
-    ''''''
-    param_with_success_rate = []
+    '''sweep the mutation rate, 10 seeded runs per rate on a process pool or in one replicate batch,
+    plot the utility landscape at last'''
     params = np.arange(0, 0.3, 0.02)
-    for param in params:
-        count, success = 0, 0
-        for i in range(10):
-            flag = one_test(param)
-            count += 1
-            if flag:
-                success += 1
-
-        success_rate = success / count
-        print('The success rate for the SGA is: {}'.format(success_rate))
-        tmp_tuple = (param, success_rate)
-        param_with_success_rate.append(tmp_tuple)
+    os.makedirs(opts.output, exist_ok=True)
+    if opts.batched:
+        seed_seq = np.random.SeedSequence(opts.seed)
+        np.random.seed(seed_seq.generate_state(1)[0])
+        param_with_success_rate = one_test_batch(params, 10, opts)
+        entropy = seed_seq.entropy
+    else:
+        table, entropy = CGASweep.run_sweep(functools.partial(one_test, opts=opts), params, 10, seed=opts.seed,
+                                            processes=opts.jobs or None, quiet=not opts.verbose,
+                                            file_path=os.path.join(opts.output, 'sweep_results.csv'),
+                                            on_result=CGASweep.print_result_line)
+        param_with_success_rate = table.success_rates()
+    print('sweep seed: {}'.format(entropy))
+
+    for param, success_rate in param_with_success_rate:
+        print('The success rate for the SGA with mutation rate {} is: {}'.format(param, success_rate))
 
     highest_param, highest_success_rate = find_highest(param_with_success_rate)
-    print('The highest success rate is: {:f}, the corresponding params is: {}'.format(success_rate, highest_param))
+    print('The highest success rate is: {:f}, the corresponding params is: {}'.format(highest_success_rate, highest_param))
 
-    os.makedirs(opts.output, exist_ok=True)
     file2save = os.path.join(opts.output, 'utility_performance.jpg')
     plot_graph(param_with_success_rate, file2save)
 
 
+def race_params(opts):
+    '''race mutation rates, and crossover rates with --c-range, drawn from continuous ranges'''
+    ranges = [tuple(opts.mu_range)]
+    if opts.c_range:
+        ranges.append(tuple(opts.c_range))
+    candidates = CGARace.sample_candidates(ranges, opts.race_candidates, opts.seed)
+
+    def evaluate(candidates, repeats, seed):
+        if opts.batched:
+            np.random.seed(np.random.SeedSequence(seed).generate_state(1)[0])
+            mu_rates = np.repeat([candidate[0] for candidate in candidates], repeats)
+            c_rates = np.repeat([candidate[1] if len(candidate) > 1 else 0.5 for candidate in candidates], repeats)
+            return batch_success(mu_rates, c_rates, opts).reshape(len(candidates), repeats)
+        table, _ = CGASweep.run_sweep(functools.partial(race_test, opts=opts), candidates, repeats, seed=seed,
+                                      processes=opts.jobs or None, quiet=not opts.verbose)
+        return table.results
+
+    race = CGARace.Race(candidates, evaluate, keep_fraction=0.5 if opts.halving else None, budget=opts.budget or None)
+    winner = race.run(opts.seed, report=CGARace.print_round_line)
+
+    for candidate, success, count, success_rate, alive in race.table():
+        print('<params: {}> <successes: {}/{}> <success rate: {:f}> <survived: {}>'.format(candidate, success, count, success_rate, alive))
+    print('The highest success rate is: {:f}, the corresponding params is: {}, after {} runs'.format(
+        race.rates()[winner], race.candidates[winner], race.evaluations()))
+    return race.candidates[winner]
+
+
 def parserArgs(argv):
     parser = argparse.ArgumentParser()
     parser.add_argument('-t', '--tune', action='store_true', help='')
     parser.add_argument('-o', '--output', default='resDir', help='')
+    parser.add_argument('-j', '--jobs', type=int, default=0, help='worker processes of the tuning sweep, 0 for one per core')
+    parser.add_argument('--seed', type=int, default=None, help='entropy of the tuning sweep, printed at the end of every sweep')
+    parser.add_argument('--batched', action='store_true', help='evolve every run of the tuning sweep at once as one replicate batch')
+    parser.add_argument('-r', '--race', action='store_true', help='race candidate rates and drop the losing ones early')
+    parser.add_argument('--race-candidates', type=int, default=15, help='candidates drawn from the ranges of a race')
+    parser.add_argument('--mu-range', type=float, nargs=2, default=[0, 0.3], help='mutation rate range of a race')
+    parser.add_argument('--c-range', type=float, nargs=2, default=None, help='also race the crossover rate over this range')
+    parser.add_argument('--halving', action='store_true', help='keep only the better half of the race after every round')
+    parser.add_argument('--budget', type=int, default=0, help='most runs a race may spend, 0 for no limit')
+    parser.add_argument('-v', '--verbose', action='store_true', help='keep the output of every tuning run')
+    parser.add_argument('-m', '--matrix', action='store_true', help='keep the population in one uint8 genome matrix')
+    parser.add_argument('-b', '--double-buffer', action='store_true', help='double buffered generation pipeline')
+    parser.add_argument('--stats', action='store_true', help='print genome statistics every generation')
+    parser.add_argument('-n', '--n-vars', type=int, default=2, help='number of variables of the objective')
+    parser.add_argument('-l', '--landscape', action='store_true', help='look fitness up in a table of every genome')
+    parser.add_argument('--landscape-bit-limit', type=int, default=CGALandscape.DEFAULT_BIT_LIMIT, help='largest bit_len to build the table for')
+    parser.add_argument('--cache-size', type=int, default=0, help='LRU fitness cache entries, 0 turns it off')
+    parser.add_argument('--profile', action='store_true', help='print a per-stage timing table at the end of the run')
+    parser.add_argument('--profile-capture', default=None, choices=CGAProfile.CAPTURES, help='also capture a window of generations, implies --profile')
+    parser.add_argument('--profile-window', type=int, nargs=2, default=[0, 10], help='first and last (excluded) generation of the capture')
+    parser.add_argument('-w', '--workers', type=int, default=0, help='processes evaluating the genomes through shared memory, 0 evaluates serially')
+    parser.add_argument('--chunk-size', type=int, default=16, help='genomes per task of the evaluation workers')
+    parser.add_argument('-x', '--crossover', default='one_point', choices=CGAOperator.CROSSOVER_METHODS, help='cross-over mask')
+    parser.add_argument('-s', '--selection', default='roulette', choices=sorted(CGAOperator.SELECTIONS), help='parent selection')
     opts = parser.parse_args()
     return opts
 
 
 if __name__ == "__main__":
     opts = parserArgs(sys.argv)
-    if opts.tune:
+    if opts.race:
+        race_params(opts)
+    elif opts.tune:
         tune_params(opts)
     else:
-        one_test(0.01)
+        one_test(0.01, opts)
@@ -0,0 +1,280 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import argparse
+import pdb
+
+import numpy as np
+
+import CGAComponents
+import CGAOperator
+import CGALandscape
+
+'''
+Replicate-batched Simple Genetic Algorithm.
+
+A success rate needs many independent repeats of the same run, and every repeat of run()
+pays its Python overhead once per generation. Replicate_Batch evolves R independent runs
+at once as one (R, N, L) uint8 genome tensor: fitness, roulette or SUS selection, one-point,
+two-point or uniform cross-over and bitwise mutation are each one NumPy pass over the
+replicate axis. Every replicate row may have its own mutation and crossover rate, so a
+whole parameter grid with its repeats fits in one batch.
+
+Each replicate follows the rules of run(): the fitness is the phenotype over the sum of its
+own population, a replicate stops when one of its genomes reaches fitness 1 or at the
+generation limit, and it counts as a success when the most fit score of its last evaluated
+generation is under 0.2. Stopped replicates are frozen and drop out of the remaining passes.
+'''
+
+SUCCESS_THRESHOLD = 0.2
+
+
+class Replicate_Batch():
+    '''R independent populations of population_size genomes each
+    # mu_rate, c_rate: one rate for every replicate, or one per replicate row
+    '''
+    def __init__(self, replicate_num, population_size, bit_len, float_bit_len, mu_rate, c_rate, n_vars=2,
+                 select_method='roulette', crossover_method='one_point', landscape=None):
+        if bit_len % n_vars:
+            raise ValueError('bit_len {} can not be split into {} variables'.format(bit_len, n_vars))
+        if select_method not in CGAOperator.SELECTIONS:
+            raise ValueError('unknown selection method: {}'.format(select_method))
+        if crossover_method not in CGAOperator.CROSSOVER_METHODS:
+            raise ValueError('unknown crossover method: {}'.format(crossover_method))
+        self.replicate_num = replicate_num
+        self.population_size = population_size
+        self.bit_len = bit_len
+        self.n_vars = n_vars
+        self.weights = CGAComponents.decode_weights(bit_len // n_vars, float_bit_len)
+        self.mu_rate = np.broadcast_to(np.asarray(mu_rate, dtype=np.float64), (replicate_num,)).copy()
+        self.c_rate = np.broadcast_to(np.asarray(c_rate, dtype=np.float64), (replicate_num,)).copy()
+        self.select_method = select_method
+        self.crossover_method = crossover_method
+        # optional CGALandscape.LandscapeTable, looked up instead of decoding
+        self.landscape = landscape
+
+        self.genomes = np.zeros((replicate_num, population_size, bit_len), dtype=np.uint8)
+        self.active = np.ones(replicate_num, dtype=bool)
+
+    def initialize(self):
+        '''random genomes for every replicate'''
+        self.genomes = (np.random.rand(self.replicate_num, self.population_size, self.bit_len) > 0.5).astype(np.uint8)
+        self.active[:] = True
+
+    def fitness(self, genomes):
+        '''(R, N) cumulative selection probabilities and fitness of a genome tensor,
+        every replicate is normalized over its own population'''
+        flat = genomes.reshape(-1, self.bit_len)
+        if self.landscape is not None:
+            pheno_val_list = self.landscape.lookup(flat)
+        else:
+            pheno_val_list = CGAComponents.rosenbrock(CGAComponents.decode_genomes(flat, self.n_vars, self.weights))
+        pheno_val_list = pheno_val_list.reshape(genomes.shape[:2])
+        fit_list = pheno_val_list / pheno_val_list.sum(axis=1, keepdims=True)
+        return np.cumsum(fit_list, axis=1), fit_list
+
+    def select_indices(self, proportional_list, fit_list=None):
+        '''(R, N) parent indices, every replicate spins its own wheel
+        # the wheels are laid end to end, replicate r covering [2r, 2r + 1], so all
+          spins are located with one binary search over the flattened wheels
+        # tournament and truncation selection work on fit_list instead
+        '''
+        if 'tournament' == self.select_method:
+            return self.tournament_indices(fit_list, CGAOperator.TOURNAMENT_SIZE)
+        if 'truncation' == self.select_method:
+            return self.truncation_indices(fit_list, CGAOperator.TRUNCATION_FRACTION)
+
+        replicate_num, population_size = proportional_list.shape
+        offsets = 2.0 * np.arange(replicate_num)[:, None]
+        wheels = proportional_list / proportional_list[:, -1:] + offsets
+        if 'sus' == self.select_method:
+            pointers = (np.random.rand(replicate_num, 1) + np.arange(population_size)) / population_size
+        else:
+            pointers = np.random.rand(replicate_num, population_size)
+        chosen = np.searchsorted(wheels.ravel(), (pointers + offsets).ravel(), side='left').reshape(replicate_num, -1)
+        chosen = chosen - population_size * np.arange(replicate_num)[:, None]
+        return np.clip(chosen, 0, population_size - 1)
+
+    def tournament_indices(self, fit_list, k):
+        '''(R, N) winners of k-tournaments, one (R, N, k) entrant tensor for the whole batch'''
+        replicate_num, population_size = fit_list.shape
+        entrants = np.random.randint(population_size, size=(replicate_num, population_size, k))
+        winners = np.argmax(fit_list[np.arange(replicate_num)[:, None, None], entrants], axis=2)
+        return np.take_along_axis(entrants, winners[:, :, None], axis=2)[:, :, 0]
+
+    def truncation_indices(self, fit_list, fraction):
+        '''(R, N) parents drawn uniformly from the fittest fraction of every replicate'''
+        replicate_num, population_size = fit_list.shape
+        keep_num = max(1, int(np.ceil(population_size * fraction)))
+        fittest = np.argpartition(-fit_list, keep_num - 1, axis=1)[:, :keep_num]
+        return np.take_along_axis(fittest, np.random.randint(keep_num, size=(replicate_num, population_size)), axis=1)
+
+    def crossover_masks(self, replicate_num, pair_num):
+        '''(R, pair_num, bit_len) masks, True where the first child keeps the gene of the first parent'''
+        bit_len = self.bit_len
+        loci = np.arange(bit_len)
+        if 'one_point' == self.crossover_method:
+            cut = np.random.randint(bit_len, size=(replicate_num, pair_num, 1))
+            return loci < cut
+        if 'two_point' == self.crossover_method:
+            cuts = np.sort(np.random.randint(bit_len + 1, size=(replicate_num, pair_num, 2)), axis=2)
+            return (loci < cuts[:, :, :1]) | (loci >= cuts[:, :, 1:])
+        random_bytes = np.random.randint(0, 256, size=(replicate_num, pair_num, (bit_len + 7) // 8), dtype=np.uint8)
+        return np.unpackbits(random_bytes, axis=2, count=bit_len).astype(bool)
+
+    def crossover(self, parents, c_rate):
+        '''cross-over of all pairs of all replicates, pairs come from one permutation per replicate'''
+        replicate_num, population_size, bit_len = parents.shape
+        order = np.argsort(np.random.rand(replicate_num, population_size), axis=1)
+        if population_size % 2:
+            extra = np.random.randint(population_size, size=(replicate_num, 1))
+            order = np.concatenate([order, extra], axis=1)
+        first, second = order[:, 0::2], order[:, 1::2]
+        pair_num = first.shape[1]
+
+        do_cross = np.random.rand(replicate_num, pair_num) < c_rate[:, None]
+        masks = self.crossover_masks(replicate_num, pair_num)
+        masks[~do_cross] = True
+
+        parent_a = np.take_along_axis(parents, first[:, :, None], axis=1)
+        parent_b = np.take_along_axis(parents, second[:, :, None], axis=1)
+        children = np.empty_like(parents)
+        children[:, 0::2] = np.where(masks, parent_a, parent_b)
+        children[:, 1::2] = np.where(masks, parent_b, parent_a)[:, :population_size // 2]
+        return children
+
+    def mutation(self, genomes, mu_rate):
+        '''bitwise mutation in place, replicate r flips every bit with probability mu_rate[r]
+        # candidate positions are drawn sparsely at the largest rate of the batch, then each
+          candidate of replicate r is kept with probability mu_rate[r] / largest rate
+        '''
+        largest_rate = mu_rate.max() if len(mu_rate) else 0
+        if largest_rate <= 0:
+            return genomes
+        positions = CGAOperator.bernoulli_positions(genomes.size, largest_rate)
+        replicate = positions // (genomes.shape[1] * genomes.shape[2])
+        positions = positions[np.random.rand(len(positions)) * largest_rate < mu_rate[replicate]]
+        genomes.reshape(-1)[positions] ^= 1
+        return genomes
+
+    def step(self, proportional_list, fit_list):
+        '''one generation of the active replicates'''
+        active = self.active
+        genomes = self.genomes[active]
+        chosen = self.select_indices(proportional_list, fit_list)
+        parents = np.take_along_axis(genomes, chosen[:, :, None], axis=1)
+        children = self.crossover(parents, self.c_rate[active])
+        self.genomes[active] = self.mutation(children, self.mu_rate[active])
+
+    def run(self, generation_limit):
+        '''evolve every replicate until it stops, return the (generation_limit, R) most fit and
+        average fitness histories, NaN after a replicate stopped, and the success flags'''
+        most_fit_history = np.full((generation_limit, self.replicate_num), np.nan)
+        avg_fit_history = np.full((generation_limit, self.replicate_num), np.nan)
+        last_most_fit = np.full(self.replicate_num, np.nan)
+        best_fit_flag = np.zeros(self.replicate_num, dtype=bool)
+
+        for n in range(generation_limit):
+            active = np.flatnonzero(self.active)
+            if 0 == len(active):
+                break
+            # evaluate
+            proportional_list, fit_list = self.fitness(self.genomes[active])
+            most_fit_history[n, active] = last_most_fit[active] = fit_list.max(axis=1)
+            avg_fit_history[n, active] = fit_list.mean(axis=1)
+
+            # check stop condition, reached replicates are frozen from now on
+            reached = (fit_list == 1).any(axis=1)
+            best_fit_flag[active[reached]] = True
+            self.active[active[reached]] = False
+            if reached.any():
+                proportional_list, fit_list = proportional_list[~reached], fit_list[~reached]
+
+            if self.active.any():
+                self.step(proportional_list, fit_list)
+
+        self.active[:] = False
+        return most_fit_history, avg_fit_history, last_most_fit < SUCCESS_THRESHOLD
+
+
+def run_replicates(replicate_num, population_size, bit_len, mu_rate, c_rate, generation_limit, float_bit_len, n_vars=2,
+                   select_method='roulette', crossover_method='one_point', landscape=False,
+                   landscape_bit_limit=CGALandscape.DEFAULT_BIT_LIMIT):
+    '''run() for replicate_num independent replicates at once, return the success flag of each one
+    # mu_rate, c_rate: scalars or one rate per replicate
+    '''
+    table = None
+    if landscape:
+        table = CGALandscape.get_table(bit_len, float_bit_len, n_vars, landscape_bit_limit)
+    batch = Replicate_Batch(replicate_num, population_size, bit_len, float_bit_len, mu_rate, c_rate, n_vars,
+                            select_method, crossover_method, table)
+    batch.initialize()
+    _, _, success = batch.run(generation_limit)
+    return success
+
+
+def test():
+    print('now doing the test function')
+    # a batch of one replicate scores the same genomes the same way as the matrix population
+    batch = Replicate_Batch(3, 10, 16, 4, [0.0, 0.01, 0.5], 0.5)
+    batch.initialize()
+    population = CGAComponents.PopulationMatrix(16, 4, 10)
+    for r in range(3):
+        population.setGenomes(batch.genomes[r])
+        proportional_list, fit_list = population.fitness()
+        batch_proportional_list, batch_fit_list = batch.fitness(batch.genomes[r:r + 1])
+        assert np.allclose(fit_list, batch_fit_list[0])
+        assert np.allclose(proportional_list, batch_proportional_list[0])
+    print('batched fitness matches the matrix population')
+
+    # every replicate picks its parents from its own wheel only
+    proportional_list = np.zeros((3, 10))
+    proportional_list[0, 4:] = 1
+    proportional_list[1, 9:] = 1
+    proportional_list[2] = np.arange(1, 11) / 10
+    for method in ['roulette', 'sus']:
+        batch.select_method = method
+        chosen = batch.select_indices(proportional_list)
+        assert (chosen[0] == 4).all() and (chosen[1] == 9).all()
+        assert chosen.min() >= 0 and chosen.max() <= 9
+    counts = np.bincount(chosen[2], minlength=10)
+    assert (counts == 1).all()
+
+    # ranked selections only pick the fittest of every replicate
+    fit_list = np.tile(np.arange(10.0), (3, 1))
+    fit_list[1] = -fit_list[1]
+    batch.select_method = 'tournament'
+    chosen = batch.select_indices(None, fit_list)
+    assert chosen.shape == (3, 10) and chosen[0].mean() > 4.5 and chosen[1].mean() < 4.5
+    batch.select_method = 'truncation'
+    chosen = batch.select_indices(None, fit_list)
+    assert (chosen[0] >= 5).all() and (chosen[1] < 5).all()
+    print('batched selection stays inside every replicate')
+
+    # cross-over keeps the genes of every locus, each replicate mutates at its own rate
+    for method in CGAOperator.CROSSOVER_METHODS:
+        batch.crossover_method = method
+        for population_size in [10, 11]:
+            parents = (np.random.rand(3, population_size, 16) > 0.5).astype(np.uint8)
+            children = batch.crossover(parents, np.array([0.0, 1.0, 1.0]))
+            assert (np.sort(children[0], axis=0) == np.sort(parents[0], axis=0)).all()
+            if population_size % 2 == 0:
+                assert (children.sum(axis=1) == parents.sum(axis=1)).all()
+    genomes = np.zeros((3, 200, 50), dtype=np.uint8)
+    batch.mutation(genomes, batch.mu_rate)
+    flip_rate = genomes.reshape(3, -1).mean(axis=1)
+    assert flip_rate[0] == 0 and abs(flip_rate[1] - 0.01) < 0.003 and abs(flip_rate[2] - 0.5) < 0.02
+    print('batched cross-over and mutation keep every replicate apart')
+
+    # stopped replicates are frozen, the rest keep evolving
+    batch = Replicate_Batch(4, 16, 16, 4, 0.05, 0.5)
+    batch.initialize()
+    most_fit_history, avg_fit_history, success = batch.run(20)
+    assert most_fit_history.shape == (20, 4) and success.shape == (4,)
+    assert not batch.active.any()
+    print('replicate batch runs to the generation limit')
+
+
+if __name__ == "__main__":
+    test()
@@ -10,6 +10,9 @@ import math
 import numpy as np
 import numpy.random as np_rand
 import copy
+import collections
+
+import CGAStatistics
 
 
 '''
@@ -46,9 +49,10 @@ Optimization of Rosenbrock:
 
 
 def get_probability_list(fitness_list):
-    total_fit = float(sum(fitness_list))
-    relative_fitness = [f/total_fit for f in fitness_list]
-    proportional_list = [sum(relative_fitness[:i+1]) for i in range(len(relative_fitness))]
+    '''cumulative selection probability of each slot of the wheel'''
+    fitness_list = np.asarray(fitness_list, dtype=np.float64)
+    relative_fitness = fitness_list / fitness_list.sum()
+    proportional_list = np.cumsum(relative_fitness)
     return proportional_list
 
 
@@ -89,6 +93,40 @@ def convert_bin_2_deci(x_bin, int_bit_len):
     return x_val
 
 
+def decode_weights(var_bit_len, float_bit_len):
+    '''weight of every magnitude bit of one variable, the first bit is the sign bit and
+    gets no weight, so that bits[1:].dot(weights) is the absolute decimal value
+    # the integer part counts down from 2^(int_bit_len-2), the fraction part from 2^-1,
+      the same value convert_bin_2_deci() builds through strings
+    '''
+    int_bit_len = var_bit_len - 1 - float_bit_len
+    return 2.0 ** np.arange(int_bit_len - 1, int_bit_len - 1 - (var_bit_len - 1), -1)
+
+
+def decode_genomes(genomes, n_vars, weights):
+    '''(N, n_vars) decimal values of every variable of every row, with one dot product
+    # sign bit 0 means positive and 1 means negative, for the integer and fraction part alike
+    '''
+    var_bits = genomes.reshape(len(genomes), n_vars, -1)
+    sign = 1.0 - 2.0 * var_bits[:, :, 0]
+    return sign * var_bits[:, :, 1:].dot(weights)
+
+
+def evaluate_rows(genomes, n_vars, weights):
+    '''phenotype of every row of a genome matrix, a module level function so that
+    CGAParallel workers can be handed it'''
+    return rosenbrock(decode_genomes(genomes, n_vars, weights))
+
+
+def rosenbrock(values, value_range=(-5.12, 5.11)):
+    '''phenotype of every row of decoded values, any number of variables
+    # f(x) = sum (1 - x_i)^2 + 100(x_i+1 - x_i^2)^2, with every x_i limited to value_range
+    '''
+    values = np.clip(values, *value_range)
+    x, y = values[:, :-1], values[:, 1:]
+    return ((1 - x)**2 + 100 * (y - x**2)**2).sum(axis=1)
+
+
 class Individual():
     def __init__(self, bit_len, float_bit_len, doInitialize=True):
         # set representation format
@@ -108,6 +146,13 @@ class Individual():
         self.evaluation = None
         self.fitness = None
 
+    @classmethod
+    def from_row(cls, row, float_bit_len):
+        '''wrap one row of a population matrix as an individual, without copying it'''
+        individual = cls(len(row), float_bit_len, doInitialize=False)
+        individual.value = row
+        return individual
+
     def calculate_phenotype(self):
         '''
         # x and y gene are fixed float binary representation
@@ -178,21 +223,8 @@ class Population():
 
     def compute_identical_percentage(self):
         '''compute identical individual percentage'''
-        def notInPool(indv_val, identical_pool):
-            if not identical_pool:
-                return True
-            for item in identical_pool:
-                if (indv_val == item).all():
-                    return False
-            return True
-
-        identical_pool = []
-        for individual in self.individuals:
-            indv_val = individual.value
-            if notInPool(indv_val, identical_pool):
-                identical_pool.append(indv_val)
-
-        identical_percentage = len(identical_pool) / self.population_size
+        genomes = np.array([individual.value for individual in self.individuals], dtype=np.uint8)
+        identical_percentage = CGAStatistics.distinct_fraction(genomes)
         return identical_percentage
 
     def best(self, fit_list):
@@ -202,6 +234,138 @@ class Population():
         print('best one has value: ', bestOne.value)
 
 
+class FitnessCache():
+    '''bounded LRU memo of phenotypes, keyed by the packed bytes of the genome
+    # converged populations hold many identical genomes, only the first one of them
+      pays for the evaluation, the least recently used entry leaves when it is full
+    '''
+    def __init__(self, evaluate, max_size=65536):
+        self.evaluate = evaluate
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, genomes):
+        '''phenotype of every row, evaluate() only sees the rows that are not cached'''
+        keys = [row.tobytes() for row in np.packbits(genomes, axis=1)]
+        pheno_val_list = np.empty(len(keys), dtype=np.float64)
+
+        entries = self.entries
+        missing = {}
+        for i, key in enumerate(keys):
+            if key in entries:
+                entries.move_to_end(key)
+                pheno_val_list[i] = entries[key]
+                self.hits += 1
+            else:
+                # identical genomes that are not cached yet are evaluated once
+                missing.setdefault(key, []).append(i)
+                self.misses += 1
+
+        if missing:
+            first_rows = [rows[0] for rows in missing.values()]
+            values = self.evaluate(genomes[first_rows])
+            for (key, rows), value in zip(missing.items(), values):
+                pheno_val_list[rows] = value
+                entries[key] = value
+            while len(entries) > self.max_size:
+                entries.popitem(last=False)
+        return pheno_val_list
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class PopulationMatrix():
+    '''collection of individuals backed by one contiguous (population_size, bit_len) uint8 matrix,
+    each row of the matrix is the genome of one individual'''
+    def __init__(self, bit_len, float_bit_len, size=10, n_vars=2):
+        self.bit_len = bit_len
+        self.float_bit_len = float_bit_len
+        self.population_size = size
+
+        # every variable takes bit_len // n_vars bits of the genome
+        if bit_len % n_vars:
+            raise ValueError('bit_len {} can not be split into {} variables'.format(bit_len, n_vars))
+        self.n_vars = n_vars
+        self.weights = decode_weights(bit_len // n_vars, float_bit_len)
+
+        # optional CGALandscape.LandscapeTable, looked up instead of decoding
+        self.landscape = None
+        # optional FitnessCache wrapped around evaluate()
+        self.cache = None
+        # optional CGAParallel.Shared_Evaluator evaluate() hands the genomes to
+        self.evaluator = None
+
+        self.genomes = np.zeros((size, bit_len), dtype=np.uint8)
+        self.IndvClass = Individual
+
+    @property
+    def individuals(self):
+        '''row views of the genome matrix, only built when someone asks for them'''
+        return [self.IndvClass.from_row(row, self.float_bit_len) for row in self.genomes]
+
+    def setGenomes(self, genomes):
+        '''set genome matrix for the next generation'''
+        self.genomes = np.ascontiguousarray(genomes, dtype=np.uint8)
+        self.population_size = self.genomes.shape[0]
+
+    def spawn(self, genomes):
+        '''new population with the same encoding, holding the given genome matrix'''
+        next_generation = PopulationMatrix(self.bit_len, self.float_bit_len, len(genomes), self.n_vars)
+        next_generation.landscape = self.landscape
+        next_generation.cache = self.cache
+        next_generation.evaluator = self.evaluator
+        next_generation.setGenomes(genomes)
+        return next_generation
+
+    def initialize(self):
+        '''initialization random individuals for start point'''
+        self.genomes = (np.random.rand(self.population_size, self.bit_len) > 0.5).astype(np.uint8)
+
+    def decode(self):
+        '''(population_size, n_vars) decimal values of the genome matrix'''
+        return decode_genomes(self.genomes, self.n_vars, self.weights)
+
+    def evaluate(self, genomes):
+        '''phenotype of every row of a genome matrix of this encoding'''
+        if self.evaluator is not None:
+            return self.evaluator(genomes)
+        return evaluate_rows(genomes, self.n_vars, self.weights)
+
+    def fitness(self):
+        '''calculate fitness score, the whole matrix is decoded and evaluated at once'''
+        if 0 == self.genomes.size:
+            raise ValueError('individuals has not been set')
+
+        if self.landscape is not None:
+            pheno_val_list = self.landscape.lookup(self.genomes)
+        elif self.cache is not None:
+            pheno_val_list = self.cache(self.genomes)
+        else:
+            pheno_val_list = self.evaluate(self.genomes)
+
+        # normalize the phenotype value the same way Population.fitness() does
+        sum_pheno = pheno_val_list.sum()
+        fit_list = pheno_val_list / sum_pheno
+
+        proportional_list = get_probability_list(fit_list)
+        return proportional_list, fit_list
+
+    def compute_identical_percentage(self):
+        '''compute identical individual percentage'''
+        identical_percentage = CGAStatistics.distinct_fraction(self.genomes)
+        return identical_percentage
+
+    def best(self, fit_list):
+        '''return the most fit object'''
+        index = int(np.argmax(fit_list))
+        bestOne = self.IndvClass.from_row(self.genomes[index], self.float_bit_len)
+        print('best one has value: ', bestOne.value)
+
+
 def test():
     print('now doing the test function')
     x_bin = [0, 1, 1, 1, 0, 1, 0]
@@ -214,6 +378,41 @@ def test():
     deci_val = convert_bin_2_deci(x_bin, int_bit_len)
     print('calculated value is: ', deci_val, '\texpected to be: -3.875')
 
+    # the matrix population has to score the same genomes the same way as the object one
+    genomes = (np.random.rand(20, 16) > 0.5).astype(np.uint8)
+    genomes[1] = genomes[0]
+    population = Population(16, 4, 20)
+    population.setIndividuals([Individual.from_row(row.copy(), 4) for row in genomes])
+    matrix_population = PopulationMatrix(16, 4, 20)
+    matrix_population.setGenomes(genomes)
+
+    proportional_list, fit_list = population.fitness()
+    matrix_proportional_list, matrix_fit_list = matrix_population.fitness()
+    assert np.allclose(fit_list, matrix_fit_list)
+    assert np.allclose(proportional_list, matrix_proportional_list)
+    assert population.compute_identical_percentage() == matrix_population.compute_identical_percentage()
+    print('matrix population fitness matches the object population')
+
+    # the dot product decoder gives the same values as the string decoder
+    var_bit_len = matrix_population.bit_len // 2
+    int_bit_len = var_bit_len - matrix_population.float_bit_len
+    values = matrix_population.decode()
+    for row, row_values in zip(genomes, values):
+        assert np.isclose(row_values[0], convert_bin_2_deci(list(row[:var_bit_len]), int_bit_len))
+        assert np.isclose(row_values[1], convert_bin_2_deci(list(row[var_bit_len:]), int_bit_len))
+    print('vectorized decoder matches convert_bin_2_deci')
+
+    # the cache returns what evaluate() returns, and only evaluates unseen genomes
+    matrix_population.cache = FitnessCache(matrix_population.evaluate, max_size=8)
+    for _ in range(2):
+        assert np.allclose(matrix_population.fitness()[1], matrix_fit_list)
+    assert len(matrix_population.cache.entries) == 8
+    matrix_population.cache = FitnessCache(matrix_population.evaluate)
+    matrix_population.fitness()
+    matrix_population.fitness()
+    assert matrix_population.cache.hits == 20 and matrix_population.cache.misses == 20
+    print('fitness cache matches the direct evaluation')
+
 
 if __name__ == "__main__":
     test()
@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import argparse
+import pdb
+
+import numpy as np
+
+import CGAComponents
+
+'''
+Exhaustive fitness landscape for small genome spaces.
+
+With bit_len = 16 there are only 65,536 different genomes, yet every generation of every
+tuning run decodes and evaluates the whole population again. When bit_len is at or below
+a limit (24 bits by default), the phenotype of every possible genome is computed once into
+a .npy file, memory-mapped afterwards, and the fitness of a population becomes a single
+gather by genome index.
+
+The table is cached on disk under a name made of the problem and the encoding parameters,
+so the next run, and every worker of a sweep, only maps the file.
+'''
+
+DEFAULT_BIT_LIMIT = 24
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'landscape_cache')
+
+# genomes evaluated per block while the table is built
+BLOCK_SIZE = 1 << 20
+
+# tables already mapped by this process
+_TABLES = {}
+
+
+def genome_index(genomes):
+    '''the genome rows read as big-endian binary numbers, first bit is the highest'''
+    bit_len = genomes.shape[1]
+    weights = np.left_shift(np.int64(1), np.arange(bit_len - 1, -1, -1, dtype=np.int64))
+    return genomes.dot(weights)
+
+
+def index_genomes(indices, bit_len):
+    '''inverse of genome_index, (len(indices), bit_len) uint8 matrix'''
+    shifts = np.arange(bit_len - 1, -1, -1, dtype=np.int64)
+    return ((indices[:, None] >> shifts) & 1).astype(np.uint8)
+
+
+class LandscapeTable():
+    '''phenotype of every genome of a small encoding, backed by a memory-mapped .npy file'''
+    def __init__(self, bit_len, float_bit_len, n_vars=2, problem='rosenbrock', cache_dir=DEFAULT_CACHE_DIR):
+        self.bit_len = bit_len
+        self.float_bit_len = float_bit_len
+        self.n_vars = n_vars
+        self.problem = problem
+        self.cache_dir = cache_dir
+        self.table = None
+
+    @property
+    def file_path(self):
+        file_name = '{}_b{}_f{}_v{}.npy'.format(self.problem, self.bit_len, self.float_bit_len, self.n_vars)
+        return os.path.join(self.cache_dir, file_name)
+
+    def load(self):
+        '''map the table, building it first when it is not on disk yet'''
+        if not os.path.exists(self.file_path):
+            self.build()
+        self.table = np.load(self.file_path, mmap_mode='r')
+        return self
+
+    def build(self):
+        '''evaluate every genome block by block, then move the finished file in place'''
+        os.makedirs(self.cache_dir, exist_ok=True)
+        genome_num = 1 << self.bit_len
+        weights = CGAComponents.decode_weights(self.bit_len // self.n_vars, self.float_bit_len)
+
+        # write to a private file first, a crash or a concurrent worker never sees half a table
+        tmp_path = '{}.{}.tmp.npy'.format(self.file_path[:-len('.npy')], os.getpid())
+        table = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float64, shape=(genome_num,))
+        for start in range(0, genome_num, BLOCK_SIZE):
+            indices = np.arange(start, min(start + BLOCK_SIZE, genome_num), dtype=np.int64)
+            values = CGAComponents.decode_genomes(index_genomes(indices, self.bit_len), self.n_vars, weights)
+            table[start:start + len(indices)] = CGAComponents.rosenbrock(values)
+        table.flush()
+        del table
+        os.replace(tmp_path, self.file_path)
+
+    def lookup(self, genomes):
+        '''phenotype of every row of the genome matrix'''
+        return np.asarray(self.table[genome_index(genomes)], dtype=np.float64)
+
+
+def get_table(bit_len, float_bit_len, n_vars=2, bit_limit=DEFAULT_BIT_LIMIT, cache_dir=DEFAULT_CACHE_DIR):
+    '''mapped landscape table of the encoding, or None when bit_len is over the limit'''
+    if bit_len > bit_limit:
+        return None
+    key = (bit_len, float_bit_len, n_vars, cache_dir)
+    if key not in _TABLES:
+        _TABLES[key] = LandscapeTable(bit_len, float_bit_len, n_vars, cache_dir=cache_dir).load()
+    return _TABLES[key]
+
+
+def test():
+    import tempfile
+    print('now doing the test function')
+    with tempfile.TemporaryDirectory() as cache_dir:
+        table = LandscapeTable(16, 4, cache_dir=cache_dir).load()
+        population = CGAComponents.PopulationMatrix(16, 4, 200)
+        population.initialize()
+        expected = CGAComponents.rosenbrock(population.decode())
+        assert np.allclose(table.lookup(population.genomes), expected)
+        assert (index_genomes(genome_index(population.genomes), 16) == population.genomes).all()
+        assert get_table(25, 4, cache_dir=cache_dir) is None
+    print('landscape table matches the direct evaluation')
+
+
+if __name__ == '__main__':
+    test()
@@ -46,31 +46,157 @@ Max One Problem:
 '''
 
 
+def bernoulli_positions(total, rate):
+    '''flat positions in range(total), each one picked independently with probability rate
+    # same law as drawing one random number per position, but the gaps between picked
+      positions are drawn from a geometric distribution, so the cost scales with the
+      number of picked positions instead of total
+    '''
+    if rate <= 0 or total <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if rate >= 1:
+        return np.arange(total, dtype=np.int64)
+
+    expected = total * rate
+    batch = int(expected + 4 * math.sqrt(expected)) + 16
+    chunks = []
+    last = -1
+    while True:
+        positions = last + np.cumsum(np.random.geometric(rate, size=batch))
+        if positions[-1] >= total:
+            chunks.append(positions[positions < total])
+            break
+        chunks.append(positions)
+        last = positions[-1]
+    return np.concatenate(chunks)
+
+# individuals per tournament of Tournament_Selection
+TOURNAMENT_SIZE = 2
+# share of the population Truncation_Selection breeds from
+TRUNCATION_FRACTION = 0.5
+
+
 class Roulette_Wheel_Selection():
+    # ranked selections take the fitness list instead of the cumulative wheel
+    ranked = False
+
     def __init__(self, bit_len):
         self.bit_len = bit_len
 
+    def select_indices(self, proportional_list, num=None):
+        '''indices of the chosen parents, one independent spin of the wheel per slot
+        # all spins are drawn at once and located on the cumulative probability list
+          with one binary search each, so the whole selection is O(N log N)
+        '''
+        proportional_list = np.asarray(proportional_list, dtype=np.float64)
+        population_size = len(proportional_list)
+        if num is None:
+            num = population_size
+
+        r = np.random.rand(num) * proportional_list[-1]
+        # first slot whose cumulative probability reaches r
+        chosen = np.searchsorted(proportional_list, r, side='left')
+        return np.minimum(chosen, population_size - 1)
+
     def select(self, proportional_list, population):
+        if isinstance(population, CGAComponents.PopulationMatrix):
+            return self.select_matrix(proportional_list, population)
+
         population_size = population.population_size
-        population = population.individuals
-        chosen = []
-        for n in range(population_size):
-            r = random.random()
-            for (i, individual) in enumerate(population):
-                if r <= proportional_list[i]:
-                    chosen.append(copy.deepcopy(individual))
-                    break
+        chosen = self.select_indices(proportional_list, population_size)
 
+        # the operators after selection copy before they change anything, so the
+        # chosen individuals can be shared instead of deep copied
         parents = CGAComponents.Population(self.bit_len, population_size)
-        parents.setIndividuals(chosen)
+        parents.setIndividuals(list(population.individuals[chosen]))
         return parents
 
+    def select_matrix(self, proportional_list, population):
+        '''same wheel as select(), but gathers the chosen rows of the genome matrix'''
+        chosen = self.select_indices(proportional_list, population.population_size)
+        return population.spawn(population.genomes[chosen])
+
+
+class Stochastic_Universal_Sampling(Roulette_Wheel_Selection):
+    '''
+    # Stochastic Universal Sampling: one spin of a wheel with N equally spaced pointers,
+      each individual is chosen either floor or ceil of its expected number of times,
+      so there is less sampling noise than with N independent spins
+    '''
+    def select_indices(self, proportional_list, num=None):
+        proportional_list = np.asarray(proportional_list, dtype=np.float64)
+        population_size = len(proportional_list)
+        if num is None:
+            num = population_size
+
+        step = proportional_list[-1] / num
+        pointers = (np.random.rand() + np.arange(num)) * step
+        chosen = np.searchsorted(proportional_list, pointers, side='left')
+        return np.minimum(chosen, population_size - 1)
+
+
+class Tournament_Selection(Roulette_Wheel_Selection):
+    '''
+    # k-tournament: every parent is the fittest of k individuals drawn uniformly with
+      replacement, all tournaments are one (num, k) index matrix and one argmax along
+      its rows, so the selection is O(N k)
+    # only the order of the fitness scores counts, the pressure does not depend on how
+      fitness() normalized them
+    '''
+    ranked = True
+
+    def __init__(self, bit_len, k=TOURNAMENT_SIZE):
+        super().__init__(bit_len)
+        self.k = k
+
+    def select_indices(self, fitness_list, num=None):
+        fitness_list = np.asarray(fitness_list, dtype=np.float64)
+        population_size = len(fitness_list)
+        if num is None:
+            num = population_size
+
+        entrants = np.random.randint(population_size, size=(num, self.k))
+        winners = np.argmax(fitness_list[entrants], axis=1)
+        return entrants[np.arange(num), winners]
+
+
+class Truncation_Selection(Roulette_Wheel_Selection):
+    '''
+    # truncation: only the fittest fraction of the population breeds, every parent is
+      drawn uniformly from it, the fittest are found with one O(N) argpartition
+    '''
+    ranked = True
+
+    def __init__(self, bit_len, fraction=TRUNCATION_FRACTION):
+        super().__init__(bit_len)
+        self.fraction = fraction
+
+    def select_indices(self, fitness_list, num=None):
+        fitness_list = np.asarray(fitness_list, dtype=np.float64)
+        population_size = len(fitness_list)
+        if num is None:
+            num = population_size
+
+        keep_num = max(1, int(math.ceil(population_size * self.fraction)))
+        fittest = np.argpartition(-fitness_list, keep_num - 1)[:keep_num]
+        return fittest[np.random.randint(keep_num, size=num)]
+
+
+# parent selection operators, by the name run() takes
+SELECTIONS = {
+    'roulette': Roulette_Wheel_Selection,
+    'sus': Stochastic_Universal_Sampling,
+    'tournament': Tournament_Selection,
+    'truncation': Truncation_Selection,
+}
+
 
 class Crossover():
-    def __init__(self, c_rate, bit_len, float_bit_len):
+    def __init__(self, c_rate, bit_len, float_bit_len, method='one_point'):
         self.c_rate = c_rate
         self.bit_len = bit_len
         self.float_bit_len = float_bit_len
+        self.method = method
 
     def crossover_one_pair(self, pa, pb):
         bit_len = self.bit_len
@@ -99,6 +225,11 @@ class Crossover():
         return offsprings
 
     def crossover(self, parents):
+        if isinstance(parents, CGAComponents.PopulationMatrix):
+            return self.crossover_matrix(parents)
+        if self.method != 'one_point':
+            raise ValueError('{} cross-over needs a matrix population'.format(self.method))
+
         crossover_rate = self.c_rate
         # one-point cross-over
         parents_size = parents.population_size
@@ -122,6 +253,68 @@ class Crossover():
         next_generation.setIndividuals(children_pool)
         return next_generation
 
+    def crossover_masks(self, pair_num):
+        '''(pair_num, bit_len) boolean masks for all pairs at once, True where the
+        first child keeps the gene of the first parent
+        # one_point: genes in front of one cut point
+        # two_point: genes in front of the first cut or behind the second cut
+        # uniform:   every gene on its own, from packed random bytes
+        '''
+        bit_len = self.bit_len
+        loci = np.arange(bit_len)
+        if 'one_point' == self.method:
+            cut = np.random.randint(bit_len, size=pair_num)
+            return loci < cut[:, None]
+        if 'two_point' == self.method:
+            cuts = np.sort(np.random.randint(bit_len + 1, size=(pair_num, 2)), axis=1)
+            return (loci < cuts[:, :1]) | (loci >= cuts[:, 1:])
+        if 'uniform' == self.method:
+            random_bytes = np.random.randint(0, 256, size=(pair_num, (bit_len + 7) // 8), dtype=np.uint8)
+            return np.unpackbits(random_bytes, axis=1, count=bit_len).astype(bool)
+        raise ValueError('unknown crossover method: {}'.format(self.method))
+
+    def mate(self, population_size, parent_index=None):
+        '''row indices of the first and second parent of every pair
+        # the parents are paired by one random permutation, an odd population
+          gets one extra random mate for its last row
+        '''
+        if parent_index is None:
+            parent_index = np.arange(population_size)
+        order = parent_index[np.random.permutation(population_size)]
+        if population_size % 2:
+            order = np.append(order, parent_index[np.random.randint(population_size)])
+        return order[0::2], order[1::2]
+
+    def crossover_matrix(self, parents):
+        '''batched cross-over of the whole genome matrix, see crossover_into()'''
+        genomes = parents.genomes
+        children = self.crossover_into(genomes, np.arange(parents.population_size), np.empty_like(genomes))
+        return parents.spawn(children)
+
+    def crossover_into(self, genomes, parent_index, out):
+        '''cross-over of all pairs at once, written straight into a preallocated buffer
+        # pairs come from one permutation of parent_index, the crossover rate is a
+          boolean vector over the pairs and every pair gets its mask row, pairs that
+          do not cross get an all True mask and are copied as they are
+        '''
+        population_size = len(parent_index)
+        first, second = self.mate(population_size, parent_index)
+        pair_num = len(first)
+
+        do_cross = np.random.rand(pair_num) < self.c_rate
+        masks = self.crossover_masks(pair_num)
+        masks[~do_cross] = True
+
+        parent_a, parent_b = genomes[first], genomes[second]
+        second_num = population_size // 2
+        out[0::2] = np.where(masks, parent_a, parent_b)
+        out[1::2] = np.where(masks, parent_b, parent_a)[:second_num]
+        return out
+
+
+# cross-over masks crossover_masks() knows
+CROSSOVER_METHODS = ['one_point', 'two_point', 'uniform']
+
 
 class Mutation():
     def __init__(self, mu_rate):
@@ -132,6 +325,9 @@ class Mutation():
         # Mutation: Bitwise (each bit has a probability of flipping its state).
         # CGA generally uses small mutation rates
         '''
+        if isinstance(population, CGAComponents.PopulationMatrix):
+            return self.mutation_matrix(population)
+
         mutation_rate = self.mu_rate
         pop_size = population.population_size
         totalBits = population.bit_len
@@ -149,3 +345,46 @@ class Mutation():
         next_generation = CGAComponents.Population(totalBits, pop_size)
         next_generation.setIndividuals(new_population)
         return next_generation
+
+    def mutation_matrix(self, population):
+        '''bitwise mutation of the whole genome matrix, see mutation_inplace()'''
+        genomes = population.genomes.copy()
+        self.mutation_inplace(genomes, population.bit_len)
+        return population.spawn(genomes)
+
+    def mutation_inplace(self, genomes, bit_len):
+        '''bitwise mutation of a genome matrix, flipping the bits where they are
+        # the cost scales with the number of flips, not with population_size * bit_len
+        '''
+        # at the usual small rates almost every per-bit draw would do nothing, so only
+        # the flipped positions are drawn and all of them are applied with one xor
+        positions = bernoulli_positions(genomes.shape[0] * bit_len, self.mu_rate)
+        rows, cols = np.divmod(positions, bit_len)
+        genomes[rows, cols] ^= 1
+        return genomes
+
+
+class Generation_Pipeline():
+    '''
+    # double buffered generation loop for matrix populations: two genome buffers are
+      allocated once, the offspring are written straight into the back buffer from the
+      parent indices, then the buffers swap roles, so the population object and its
+      memory stay the same from one generation to the next
+    '''
+    def __init__(self, selection, crossover, mutation, population):
+        self.selection = selection
+        self.crossover = crossover
+        self.mutation = mutation
+        self.population = population
+        self.back = np.empty_like(population.genomes)
+
+    def step(self, selection_weights):
+        '''one generation, selection_weights is the wheel, or the fitness list for a ranked selection'''
+        population = self.population
+        front = population.genomes
+        parent_index = self.selection.select_indices(selection_weights, population.population_size)
+        self.crossover.crossover_into(front, parent_index, self.back)
+        self.mutation.mutation_inplace(self.back, population.bit_len)
+
+        population.genomes, self.back = self.back, front
+        return population
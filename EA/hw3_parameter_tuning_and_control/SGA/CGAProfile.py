@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import argparse
+import pdb
+
+import io
+import time
+import collections
+import functools
+import cProfile
+import pstats
+import tracemalloc
+
+'''
+Per-stage profiling of the generation loop.
+
+A Stage_Profiler wraps the callables of the loop, evaluation, the identical percentage,
+selection, cross-over, mutation and printing, with a timer that adds the perf_counter_ns
+time of every call to its stage. Nothing is wrapped unless profiling is asked for, so a
+run without it executes exactly the code it did before; the loop only pays one
+"profiler is not None" test per generation.
+
+Every timed call is also passed to the optional hook, called with (stage, nanoseconds),
+for anyone who wants the raw timings instead of the totals. Counters (evaluations, cache
+hits, allocations) are plain named integers, filled in by the run or by the hook.
+
+One window of generations can additionally be captured with cProfile, for a per-function
+breakdown, or with tracemalloc, which counts the blocks and bytes allocated in the window
+and the peak of the traced memory.
+'''
+
+CAPTURES = ['cprofile', 'tracemalloc']
+# functions listed from the cProfile capture
+TOP_FUNCTIONS = 15
+
+
+class Stage_Profiler():
+    '''
+    # hook: called with (stage, elapsed nanoseconds) after every timed call
+    # timer: integer nanosecond clock
+    # capture: None, or one of CAPTURES, run over the generations in window
+    # window: (first, last) generation numbers of the capture, last excluded
+    '''
+    def __init__(self, hook=None, timer=time.perf_counter_ns, capture=None, window=(0, 10)):
+        if capture is not None and capture not in CAPTURES:
+            raise ValueError('unknown capture: {}'.format(capture))
+        self.hook = hook
+        self.timer = timer
+        self.capture = capture
+        self.window = tuple(window)
+
+        self.elapsed = collections.defaultdict(int)
+        self.calls = collections.defaultdict(int)
+        self.counters = collections.defaultdict(int)
+        self.start_time = timer()
+        self.end_time = None
+
+        self.capturing = False
+        self.profile = None
+        self.snapshot = None
+        self.capture_report = None
+
+    def record(self, stage, elapsed):
+        self.elapsed[stage] += elapsed
+        self.calls[stage] += 1
+        if self.hook is not None:
+            self.hook(stage, elapsed)
+
+    def count(self, name, num=1):
+        self.counters[name] += num
+
+    def wrap(self, stage, function):
+        '''function timed into stage'''
+        timer = self.timer
+        record = self.record
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            start = timer()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(stage, timer() - start)
+        return timed
+
+    def instrument(self, obj, method_name, stage):
+        '''time every call of obj.method_name into stage, only this object is affected'''
+        setattr(obj, method_name, self.wrap(stage, getattr(obj, method_name)))
+
+    def generation(self, gen_num):
+        '''called at the start of every generation, opens and closes the capture window'''
+        if self.capture is None:
+            return
+        if gen_num == self.window[0] and not self.capturing:
+            self.start_capture()
+        elif gen_num == self.window[1] and self.capturing:
+            self.stop_capture()
+
+    def start_capture(self):
+        self.capturing = True
+        if 'cprofile' == self.capture:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            tracemalloc.start()
+            self.snapshot = tracemalloc.take_snapshot()
+
+    def stop_capture(self):
+        self.capturing = False
+        if 'cprofile' == self.capture:
+            self.profile.disable()
+            stream = io.StringIO()
+            pstats.Stats(self.profile, stream=stream).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+            self.capture_report = stream.getvalue()
+        else:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            differences = snapshot.compare_to(self.snapshot, 'lineno')
+            self.count('allocated blocks', sum(max(0, stat.count_diff) for stat in differences))
+            self.count('allocated bytes', sum(max(0, stat.size_diff) for stat in differences))
+            self.count('peak traced bytes', peak)
+            self.snapshot = None
+
+    def finish(self):
+        '''stop the clock and a capture that is still open'''
+        if self.capturing:
+            self.stop_capture()
+        self.end_time = self.timer()
+
+    def total_time(self):
+        end_time = self.end_time if self.end_time is not None else self.timer()
+        return end_time - self.start_time
+
+    def summary(self):
+        '''(stage, calls, total ns, mean ns, share of the run) of every stage, slowest first,
+        the time outside all stages ends the table as "other"'''
+        total_time = self.total_time()
+        rows = [(stage, self.calls[stage], self.elapsed[stage], self.elapsed[stage] / self.calls[stage]) for stage in self.elapsed]
+        rows.sort(key=lambda row: row[2], reverse=True)
+        other = total_time - sum(row[2] for row in rows)
+        rows.append(('other', 0, other, 0.0))
+        return [row + (row[2] / total_time if total_time else 0.0,) for row in rows]
+
+
+def print_summary(profiler):
+    '''end of run timing table, the counters and the capture report'''
+    print('<stage> <calls> <total ms> <mean us> <share>')
+    for stage, calls, total, mean, share in profiler.summary():
+        print('<{}> <{}> <{:.3f}> <{:.3f}> <{:.1%}>'.format(stage, calls, total / 1e6, mean / 1e3, share))
+    print('<total run time ms: {:.3f}>'.format(profiler.total_time() / 1e6))
+    for name, num in profiler.counters.items():
+        print('<{}: {}>'.format(name, num))
+    if profiler.capture_report is not None:
+        print(profiler.capture_report)
+
+
+def test():
+    print('now doing the test function')
+    # a fake clock that advances 5ns on every reading times each call at 5ns
+    clock = iter(range(0, 10**6, 5))
+    timings = []
+    profiler = Stage_Profiler(hook=lambda stage, elapsed: timings.append((stage, elapsed)), timer=lambda: next(clock))
+    square = profiler.wrap('square', lambda x: x * x)
+    assert [square(x) for x in range(3)] == [0, 1, 4]
+
+    class Operator():
+        def apply(self, x):
+            return x + 1
+    operator = Operator()
+    profiler.instrument(operator, 'apply', 'apply')
+    assert operator.apply(1) == 2 and Operator().apply.__func__ is Operator.apply
+    profiler.count('evaluations', 30)
+    profiler.finish()
+
+    assert profiler.calls == {'square': 3, 'apply': 1}
+    assert profiler.elapsed['square'] == 15 and timings[-1] == ('apply', 5)
+    rows = profiler.summary()
+    assert rows[0][0] == 'square' and rows[-1][0] == 'other'
+    assert abs(sum(row[4] for row in rows) - 1) < 1e-9
+    print('stage timings add up to the run time')
+
+    # the capture only covers its window of generations
+    for capture in CAPTURES:
+        profiler = Stage_Profiler(capture=capture, window=(1, 3))
+        for gen_num in range(5):
+            profiler.generation(gen_num)
+            assert profiler.capturing == (1 <= gen_num < 3)
+            [bytearray(1000) for i in range(10)]
+        profiler.finish()
+    assert profiler.counters['peak traced bytes'] > 0 and not tracemalloc.is_tracing()
+    print('capture window opens and closes with the generations')
+
+
+if __name__ == "__main__":
+    test()
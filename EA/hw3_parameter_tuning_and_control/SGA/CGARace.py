@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import argparse
+import pdb
+
+import statistics
+import numpy as np
+
+'''
+Racing parameter tuner.
+
+The grid tuner spends the same number of runs on every candidate, also on those that are
+hopeless after two runs. A race runs the candidates in rounds of a few repeats each. After
+every round it puts a binomial (Wilson score) confidence interval around the success rate
+of every surviving candidate, and drops the candidates whose upper bound is below the
+largest lower bound: with the given confidence they are worse than the leader. The runs
+that are no longer spent on them go to the leaders in the next rounds.
+
+With keep_fraction set the race also does successive halving: after every round only that
+fraction of the survivors, the ones with the highest success rates, go on.
+
+The race stops when one candidate is left, when every survivor has max_repeats runs, or
+when the evaluation budget is spent. The winner is the survivor with the highest success
+rate, so the answer is the one the grid tuner gives, for a fraction of the evaluations.
+
+Candidates are tuples of parameter values. They may come from a grid, or be drawn from
+continuous ranges with sample_candidates(), for any number of parameters at once.
+'''
+
+
+def sample_candidates(ranges, candidate_num, seed=None):
+    '''candidate_num tuples with one value inside each (low, high) range
+    # Latin hypercube: every range is cut into candidate_num strata and every stratum of
+      every parameter is used exactly once, so few candidates still cover each range
+    '''
+    rng = np.random.default_rng(seed)
+    columns = []
+    for low, high in ranges:
+        strata = rng.permutation(candidate_num) + rng.random(candidate_num)
+        columns.append(low + (high - low) * strata / candidate_num)
+    return [tuple(float(value) for value in row) for row in zip(*columns)]
+
+
+def wilson_bounds(success, count, confidence=0.95):
+    '''lower and upper bound of a success rate after count runs with success successes'''
+    count = np.asarray(count, dtype=np.float64)
+    success = np.asarray(success, dtype=np.float64)
+    z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+    rate = np.divide(success, count, out=np.zeros_like(success), where=count > 0)
+    center = (rate + z**2 / (2 * count)) / (1 + z**2 / count)
+    half_width = z * np.sqrt(rate * (1 - rate) / count + z**2 / (4 * count**2)) / (1 + z**2 / count)
+    return np.clip(center - half_width, 0, 1), np.clip(center + half_width, 0, 1)
+
+
+class Race():
+    '''
+    # evaluate: called with (candidates, repeats, seed), returns a (len(candidates), repeats)
+      array of success flags
+    # round_repeats: runs added to every survivor per round
+    # min_repeats: runs a candidate needs before it can be dropped
+    # max_repeats: runs after which a survivor gets no more
+    # budget: total number of runs the race may spend, None for no limit
+    # keep_fraction: share of the survivors kept after every round, None keeps all that
+      the confidence bounds do not drop
+    '''
+    def __init__(self, candidates, evaluate, round_repeats=2, min_repeats=4, max_repeats=10, confidence=0.95, budget=None,
+                 keep_fraction=None):
+        self.candidates = list(candidates)
+        self.evaluate = evaluate
+        self.round_repeats = round_repeats
+        self.min_repeats = min_repeats
+        self.max_repeats = max_repeats
+        self.confidence = confidence
+        self.budget = budget
+        self.keep_fraction = keep_fraction
+
+        candidate_num = len(self.candidates)
+        self.success = np.zeros(candidate_num, dtype=np.int64)
+        self.count = np.zeros(candidate_num, dtype=np.int64)
+        self.alive = np.ones(candidate_num, dtype=bool)
+        self.round_num = 0
+
+    def evaluations(self):
+        return int(self.count.sum())
+
+    def rates(self):
+        return np.divide(self.success, self.count, out=np.zeros(len(self.count)), where=self.count > 0)
+
+    def eliminate(self):
+        '''drop the survivors that are worse than the leader with the given confidence'''
+        lower, upper = wilson_bounds(self.success, self.count, self.confidence)
+        ready = self.alive & (self.count >= self.min_repeats)
+        if not ready.any():
+            return
+        best_lower = lower[ready].max()
+        self.alive &= ~(ready & (upper < best_lower))
+
+        if self.keep_fraction is not None:
+            # successive halving, the worst survivors go whatever their bounds say
+            survivors = np.flatnonzero(self.alive)
+            keep_num = max(1, int(np.ceil(len(survivors) * self.keep_fraction)))
+            order = np.lexsort((survivors, -self.rates()[survivors]))
+            self.alive[survivors[order[keep_num:]]] = False
+
+    def run_round(self, seed=None):
+        '''one more round of repeats for every survivor that has not reached max_repeats'''
+        racing = np.flatnonzero(self.alive & (self.count < self.max_repeats))
+        repeats = min(self.round_repeats, self.max_repeats - int(self.count[racing].min()))
+        if self.budget is not None:
+            # the last round may only cover the leaders
+            affordable = (self.budget - self.evaluations()) // repeats
+            racing = racing[np.argsort(-self.rates()[racing], kind='stable')][:affordable]
+        if 0 == len(racing):
+            return False
+
+        results = np.asarray(self.evaluate([self.candidates[i] for i in racing], repeats, seed))
+        self.success[racing] += results.sum(axis=1).astype(np.int64)
+        self.count[racing] += repeats
+        self.round_num = self.round_num + 1
+        self.eliminate()
+        return True
+
+    def run(self, seed=None, report=None):
+        '''race until one survivor is left, the survivors are done or the budget is spent
+        # report: called with the race after every round
+        return the index of the winner'''
+        seed_seqs = iter(np.random.SeedSequence(seed).spawn(self.max_repeats * len(self.candidates)))
+        while self.alive.sum() > 1 and (self.alive & (self.count < self.max_repeats)).any():
+            if self.budget is not None and self.budget - self.evaluations() < 1:
+                break
+            if not self.run_round(next(seed_seqs).generate_state(4)):
+                break
+            if report is not None:
+                report(self)
+        return self.winner()
+
+    def winner(self):
+        '''the survivor with the highest success rate, the one with more runs on a tie'''
+        survivors = np.flatnonzero(self.alive)
+        order = np.lexsort((survivors, -self.count[survivors], -self.rates()[survivors]))
+        return int(survivors[order[0]])
+
+    def table(self):
+        '''(candidate, successes, runs, success rate, alive) of every candidate, leaders first'''
+        order = np.lexsort((np.arange(len(self.candidates)), -self.rates(), ~self.alive))
+        return [(self.candidates[i], int(self.success[i]), int(self.count[i]), self.rates()[i], bool(self.alive[i])) for i in order]
+
+
+def print_round_line(race):
+    '''default report of a race'''
+    screen_line = '<round: {}> <survivors: {}/{}> <evaluations: {}>'.format(
+        race.round_num, int(race.alive.sum()), len(race.candidates), race.evaluations())
+    winner = race.winner()
+    screen_line += ' <leader: {}> <leader success rate: {:f}>'.format(race.candidates[winner], race.rates()[winner])
+    print(screen_line, flush=True)
+
+
+def test():
+    print('now doing the test function')
+    lower, upper = wilson_bounds([0, 5, 10], [10, 10, 10])
+    assert np.isclose(lower[0], 0) and np.isclose(upper[2], 1)
+    assert lower[1] < 0.5 < upper[1] and upper[0] < lower[2]
+
+    candidates = sample_candidates([(0, 0.3), (0.4, 1.0)], 8, seed=1)
+    assert len(candidates) == 8 and all(0 <= mu < 0.3 and 0.4 <= c < 1.0 for mu, c in candidates)
+    # one candidate in every stratum of every range
+    assert sorted(int(mu / 0.3 * 8) for mu, c in candidates) == list(range(8))
+
+    # candidates succeed with a known probability, the race keeps the best one and spends
+    # far fewer runs than the grid of 10 runs each
+    probabilities = {(0.1 * i,): 0.1 * i for i in range(11)}
+
+    def evaluate(candidates, repeats, seed):
+        rng = np.random.default_rng(seed)
+        return rng.random((len(candidates), repeats)) < np.array([probabilities[c] for c in candidates])[:, None]
+
+    race = Race(list(probabilities), evaluate, round_repeats=2, min_repeats=4, max_repeats=10)
+    winner = race.run(seed=3)
+    assert race.candidates[winner][0] >= 0.8
+    assert race.evaluations() < 10 * len(probabilities)
+    assert not race.alive[:4].any()
+    assert race.table()[0][4]
+
+    halving = Race(list(probabilities), evaluate, round_repeats=3, keep_fraction=0.5)
+    winner = halving.run(seed=3)
+    assert halving.candidates[winner][0] >= 0.6
+    assert halving.evaluations() < race.evaluations()
+
+    race = Race(list(probabilities), evaluate, budget=30)
+    race.run(seed=3)
+    assert race.evaluations() <= 30
+    print('race keeps the best candidates with a fraction of the evaluations')
+
+
+if __name__ == "__main__":
+    test()